@@ -0,0 +1,98 @@
+"""
+Measures the round trip of a configuration command: write a message, let an
+emulated stick answer it with RESPONSE_NO_ERROR and wait for the ack. Compares
+the condition based `waitFor` with the old 1 ms sleep polling loop.
+
+Run from the repository root:
+    PYTHONPATH=src python benchmarks/ack_latency.py
+
+"""
+
+from __future__ import division, print_function
+
+from time import sleep, time
+from six.moves.queue import Queue, Empty
+
+from ant.core.constants import RESPONSE_NO_ERROR
+from ant.core.driver import Driver
+from ant.core.event import AckCallback, EventMachine
+from ant.core.exceptions import MessageTimeoutError
+from ant.core.message import ChannelEventResponseMessage, ChannelPeriodMessage
+
+NUMBER = 2000
+
+
+class LoopbackStick(Driver):
+    """Answers every command written to it with a successful response."""
+
+    def __init__(self):
+        super(LoopbackStick, self).__init__()
+        self.is_open = False
+        self.reads = Queue()
+
+    @property
+    def _opened(self):
+        return self.is_open
+
+    def _open(self):
+        self.is_open = True
+
+    def _close(self):
+        self.is_open = False
+
+    def _read(self, count):
+        try:
+            return self.reads.get(timeout=0.01)
+        except Empty:
+            return b''
+
+    def _write(self, data):
+        response = ChannelEventResponseMessage(data[3], data[2], RESPONSE_NO_ERROR)
+        self.reads.put(bytes(response.encode()))
+        return len(data)
+
+
+class PollingAckCallback(AckCallback):
+    """`waitFor` as it was before the condition variable."""
+
+    def waitFor(self, foo, timeout=10):  # pylint: disable=blacklisted-name
+        messages = self.messages
+        basetime = time()
+        while time() - basetime < timeout:
+            with self.lock:
+                for emsg in messages:
+                    if self.WAIT_UNTIL(foo, emsg):
+                        messages.remove(emsg)
+                        return emsg
+            sleep(0.001)
+        raise MessageTimeoutError("%s: timeout" % str(foo), internal=foo)
+
+
+def measure(ack=None):
+    evm = EventMachine(LoopbackStick())
+    if ack is not None:
+        evm.removeCallback(evm.ack)
+        evm.ack = ack
+        evm.registerCallback(ack)
+    evm.start()
+    try:
+        msg = ChannelPeriodMessage(1, 8070)
+        basetime = time()
+        for _ in range(NUMBER):
+            evm.writeMessage(msg).waitForAck(msg)
+        return time() - basetime
+    finally:
+        evm.stop()
+
+
+def report(name, seconds):
+    print('%-22s %8.1f us/ack' % (name, seconds / NUMBER * 1e6))
+
+
+def main():
+    report('sleep polling', measure(PollingAckCallback()))
+    report('condition wakeup', measure())
+
+
+if __name__ == '__main__':
+    main()
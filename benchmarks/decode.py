@@ -0,0 +1,68 @@
+"""
+Compares the cost of decoding a broadcast data frame through the original
+`Message.decode` path (metaclass call, `__init__`, payload setter and a second
+checksum pass) with the current table driven decoder.
+
+Run from the repository root:
+    PYTHONPATH=src python benchmarks/decode.py
+
+"""
+
+from __future__ import division, print_function
+
+import timeit
+
+from ant.core.constants import MESSAGE_TX_SYNC
+from ant.core.event import FrameDecoder
+from struct import unpack
+
+from ant.core.message import Message, ChannelBroadcastDataMessage, ChannelIDMessage, MSG_HEADER_SIZE
+
+RAW = bytes(ChannelBroadcastDataMessage(number=1, data=bytearray(range(8))).encode())
+BATCH = RAW * 64
+NUMBER = 20000
+
+
+def legacy_decode(raw):
+    """The decoder as it was before the frame decoder table."""
+    raw = bytearray(raw)
+    sync, length, type_ = raw[:MSG_HEADER_SIZE]
+    if sync != MESSAGE_TX_SYNC or len(raw) < length + 4:
+        raise ValueError
+    msg = Message(type=type_)  # pylint: disable=unexpected-keyword-arg
+    msg.payload = raw[MSG_HEADER_SIZE:length + MSG_HEADER_SIZE]
+    if msg.checksum != raw[length + MSG_HEADER_SIZE]:
+        raise ValueError
+    return msg
+
+
+def legacy_device_number(msg):
+    """`ChannelIDMessage.deviceNumber` before the struct backed fields."""
+    return unpack(b'<H', bytes(msg.payload[1:3]))[0]
+
+
+def stream_decode(decoder=FrameDecoder()):
+    decoder.feed(BATCH)
+    for _ in decoder:
+        pass
+
+
+def report(name, seconds, frames):
+    print('%-22s %8.2f us/frame' % (name, seconds / frames * 1e6))
+
+
+def main():
+    report('legacy decode', min(timeit.repeat(lambda: legacy_decode(RAW), number=NUMBER)), NUMBER)
+    report('Message.decode', min(timeit.repeat(lambda: Message.decode(RAW), number=NUMBER)), NUMBER)
+    batches = NUMBER // 64
+    report('FrameDecoder stream', min(timeit.repeat(stream_decode, number=batches)), batches * 64)
+    msg = ChannelIDMessage(1, 23358, 120, 1)
+    report('legacy deviceNumber', min(timeit.repeat(lambda: legacy_device_number(msg),
+                                                    number=NUMBER)), NUMBER)
+    report('Field deviceNumber', min(timeit.repeat(lambda: msg.deviceNumber, number=NUMBER)), NUMBER)
+    report('Message.decode_many', min(timeit.repeat(lambda: Message.decode_many(BATCH),
+                                                    number=batches)), batches * 64)
+
+
+if __name__ == '__main__':
+    main()
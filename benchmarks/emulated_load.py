@@ -0,0 +1,57 @@
+"""
+Runs the full receive stack (event pump, node, device profiles) against an
+emulated stick carrying one power meter per channel, and reports how many
+broadcasts per second get through and what they cost.
+
+Run from the repository root:
+    PYTHONPATH=src python benchmarks/emulated_load.py [sensors] [time scale]
+
+"""
+
+from __future__ import division, print_function
+
+import sys
+from time import perf_counter, process_time, sleep
+
+from ant.core.constants import NETWORK_KEY_ANT_PLUS
+from ant.core.emulator import EmulatedStick, PowerMeter
+from ant.core.node import ChannelID, Network, Node
+from ant.plus.power import BicyclePower
+
+DURATION = 5.0
+
+
+def main(sensors=200, timeScale=1.0):
+    stick = EmulatedStick([PowerMeter(number + 1) for number in range(sensors)],
+                          maxChannels=sensors, timeScale=timeScale)
+    node = Node(stick)
+    node.start()
+    try:
+        network = Network(key=NETWORK_KEY_ANT_PLUS, name='N:ANT+')
+        node.setNetworkKey(0, network)
+        received = [0]
+
+        def onPowerData(*_):
+            received[0] += 1
+
+        for number in range(sensors):
+            profile = BicyclePower(node, network, {'onPowerData': onPowerData})
+            profile.open(ChannelID(number + 1, BicyclePower.deviceType, 0))
+
+        basetime, cputime, start = perf_counter(), process_time(), received[0]
+        sleep(DURATION)
+        elapsed = perf_counter() - basetime
+        count = received[0] - start
+
+        print('%d sensors, time scale %.1f' % (sensors, timeScale))
+        print('%10.0f broadcasts/s expected' % (sensors * 32768 / 8182 * timeScale))
+        print('%10.0f broadcasts/s handled' % (count / elapsed))
+        print('%10.1f us CPU per broadcast' % ((process_time() - cputime) / max(count, 1) * 1e6))
+        print('%10d frames dropped' % node.stats()['dropped'])
+    finally:
+        node.stop()
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    main(int(args[0]) if args else 200, float(args[1]) if len(args) > 1 else 1.0)
@@ -0,0 +1,36 @@
+"""
+Reports the memory held by each decoded `ChannelBroadcastDataMessage`, which
+is what message history (event machine queues, recordings, replay buffers)
+ends up paying per frame.
+
+Run from the repository root:
+    PYTHONPATH=src python benchmarks/message_size.py
+
+"""
+
+from __future__ import division, print_function
+
+import sys
+import tracemalloc
+
+from ant.core.message import Message, ChannelBroadcastDataMessage
+
+RAW = bytes(ChannelBroadcastDataMessage(number=1, data=bytearray(range(8))).encode())
+COUNT = 10000
+
+
+def main():
+    msg = Message.decode(RAW)
+    print('__dict__:              %s' % ('yes' if hasattr(msg, '__dict__') else 'no'))
+    print('instance:              %d bytes' % sys.getsizeof(msg))
+    print('payload:               %d bytes' % sys.getsizeof(msg.payload))
+
+    tracemalloc.start()
+    history = [Message.decode(RAW) for _ in range(COUNT)]
+    allocated = tracemalloc.get_traced_memory()[0] - sys.getsizeof(history)
+    tracemalloc.stop()
+    print('allocated per message: %.1f bytes' % (allocated / COUNT))
+
+
+if __name__ == '__main__':
+    main()
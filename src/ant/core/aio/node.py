@@ -0,0 +1,407 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=missing-docstring
+##############################################################################
+#
+# Copyright (c) 2011, Martín Raúl Villalba
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+#
+##############################################################################
+
+from __future__ import division, absolute_import, print_function, unicode_literals
+
+import asyncio
+from collections import deque
+from concurrent.futures import Future
+from threading import Thread
+
+from usb.core import USBError
+
+from ant.core import message
+from ant.core.constants import *
+from ant.core.driver import encodeFrames
+from ant.core.event import FrameDecoder, WriteQueue, Writer, PRIORITY_CONTROL, PRIORITY_DATA
+from ant.core.exceptions import ChannelError, MessageError, MessageTimeoutError, NodeError, \
+        ANTException
+from ant.core.message import CHANNEL_MESSAGE_TYPES, DATA_MESSAGE_TYPES, FRAME_DECODERS
+from ant.core.node import ChannelID, checkConfigured, configureSteps
+
+
+class AsyncChannel(object):
+    def __init__(self, node, number=0, queueSize=64):
+        self.node = node
+        self.number = number
+        self.type = CHANNEL_TYPE_TWOWAY_RECEIVE
+        self.network = None
+        self.id = None
+        self.frequency = None
+        self.period = None
+        self.searchTimeout = None
+        self.queueSize = queueSize
+        self.dropped = 0  # messages discarded because the stream was full
+        self._queue = None
+        self._eventWaiters = []
+
+    async def configure(self, network, channelType, id, frequency, period, searchTimeout,
+                        open=True):  # pylint: disable=redefined-builtin
+        """Same as `Channel.configure`: every command is written in a single
+        transfer and the responses are checked afterwards."""
+        steps = configureSteps(self, network, channelType, id, frequency, period,
+                               searchTimeout, open)
+        node = self.node
+        futures = node.writeMany([msg for _, msg in steps])
+
+        responses = []
+        for future in futures:
+            try:
+                responses.append(await node.wait(future))
+            except MessageTimeoutError:
+                responses.append(None)
+        checkConfigured(self, steps, responses)
+
+        self.type = channelType
+        self.network = network
+        self.id = ChannelID(id.deviceNumber, id.deviceType, id.transmissionType)
+        self.frequency = frequency
+        self.period = period
+        if searchTimeout is not None:
+            self.searchTimeout = searchTimeout
+        if open:
+            self._opened()
+
+    async def open(self):
+        await self._request(message.ChannelOpenMessage(number=self.number), 'open')
+        self._opened()
+
+    async def close(self, timeout=10):
+        closed = self._expectEvent(EVENT_CHANNEL_CLOSED)
+        await self._request(message.ChannelCloseMessage(number=self.number), 'close')
+        await self.node.wait(closed, timeout)
+        self._closed()
+
+    async def unassign(self):
+        await self._request(message.ChannelUnassignMessage(number=self.number), 'unassign')
+        self.network = None
+
+    def send(self, data):
+        """Broadcasts `data` on this channel."""
+        self.node.send(message.ChannelBroadcastDataMessage(self.number, data))
+
+    async def sendAcknowledged(self, data, timeout=10):
+        """Sends `data` as acknowledged data and returns once the receiver has
+        acknowledged it. Raises `ChannelError` if the transfer failed."""
+        done = self._expectEvent(EVENT_TRANSFER_TX_COMPLETED, EVENT_TRANSFER_TX_FAILED)
+        self.node.send(message.ChannelAcknowledgedDataMessage(self.number, data))
+        if await self.node.wait(done, timeout) != EVENT_TRANSFER_TX_COMPLETED:
+            raise ChannelError('%s: acknowledged transfer failed.' % str(self))
+
+    async def messages(self):
+        """Yields every message received on the channel until it is closed.
+
+        If the consumer falls more than `queueSize` messages behind, the
+        oldest ones are dropped and counted in `dropped`.
+        """
+        queue = self._queue
+        if queue is None:
+            raise ChannelError('%s: not open.' % str(self))
+        while True:
+            msg = await queue.get()
+            if msg is None:
+                return
+            yield msg
+
+    async def _request(self, msg, step):
+        response = await self.node.request(msg)
+        if response != RESPONSE_NO_ERROR:
+            raise ChannelError('%s: could not %s (%.2x).' % (str(self), step, response))
+
+    @property
+    def isOpen(self):
+        return self._queue is not None
+
+    def _expectEvent(self, *codes):
+        future = self.node.loop.create_future()
+        self._eventWaiters.append((codes, future))
+        return future
+
+    def _opened(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue(self.queueSize)
+
+    def _closed(self):
+        queue, self._queue = self._queue, None
+        if queue is not None:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(None)
+
+    def _process(self, msg):
+        if msg.type == MESSAGE_CHANNEL_EVENT and msg.messageID == 1:
+            code = msg.messageCode
+            waiters = self._eventWaiters
+            for waiter in waiters:
+                codes, future = waiter
+                if not future.done() and code in codes:
+                    future.set_result(code)
+                    waiters.remove(waiter)
+                    break
+            waiters[:] = [waiter for waiter in waiters if not waiter[1].done()]
+        else:
+            code = None
+
+        queue = self._queue
+        if queue is not None:
+            if queue.full():
+                queue.get_nowait()
+                self.dropped += 1
+            queue.put_nowait(msg)
+
+        if code == EVENT_CHANNEL_CLOSED:
+            # also when the stick closed the channel itself, e.g. on a
+            # search timeout
+            self._closed()
+
+    def __str__(self):
+        rawstr = '<channel %d' % self.number
+        channelId = self.id
+        if channelId is not None:
+            rawstr += ', ' + str(channelId)
+        return rawstr + '>'
+
+
+class AsyncNode(object):
+    """ANT node driven from an asyncio event loop.
+
+    A reader thread blocks in `driver.read` and passes complete frames to the
+    loop, where they are decoded and routed to the waiting futures and the
+    channels' message streams. Writes are queued for a writer thread, so the
+    loop never blocks on the driver. The writer is a thread of its own
+    rather than the reader's: on the reader, writes would wait behind a read
+    until it times out, and a stalled write would hold up reception.
+
+    :param writeRate: Most frames per second the writer thread sends, None
+            for no limit
+    """
+
+    def __init__(self, driver, name=None, writeRate=None):
+        self.driver = driver
+        self.name = name
+        self.writeRate = writeRate
+        self.writeQueue = None
+        self.networks = []
+        self.channels = []
+        self.options = (0x00, 0x00, 0x00)
+        self.running = False
+        self.loop = None
+        self._reader = None
+        self._writer = None
+        self._pending = {}  # (channel, message ID) -> futures for the response code
+        self._waiters = {}  # message class -> futures for the next such message
+
+    async def start(self, wait=True):
+        """Opens the driver, resets the stick and reads its capabilities.
+        :param wait: Whether to wait for startup message or not. Some older devices don't send it.
+        """
+        if self.running:
+            raise NodeError('Could not start ANT node (already started).')
+
+        loop = self.loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.driver.open)
+        self.running = True
+        queue = self.writeQueue = WriteQueue()
+        self._writer = Thread(name=self.name, target=Writer, args=(self, queue))
+        self._writer.start()
+        reader = self._reader = Thread(name=self.name, target=self._read, args=(loop,))
+        reader.start()
+
+        try:
+            await self.reset(wait)
+            capabilities = self.expectMessage(message.CapabilitiesMessage)
+            self.send(message.ChannelRequestMessage(messageID=MESSAGE_CAPABILITIES))
+            caps = await self.wait(capabilities)
+        except MessageError as err:
+            await self.stop()
+            raise NodeError(err)
+
+        self.networks = [None] * caps.maxNetworks
+        self.channels = [AsyncChannel(self, i) for i in range(0, caps.maxChannels)]
+        self.options = (caps.stdOptions, caps.advOptions, caps.advOptions2)
+
+    async def reset(self, wait=True):
+        startup = self.expectMessage(message.StartupMessage) if wait else None
+        self.send(message.SystemResetMessage())
+        if wait:
+            await self.wait(startup)
+
+    async def stop(self):
+        if not self.running:
+            raise NodeError('Could not stop ANT node (not started).')
+
+        try:
+            self.send(message.SystemResetMessage())
+        except (USBError, ANTException):
+            pass
+        self.writeQueue.close()
+        await self.loop.run_in_executor(None, self._writer.join)
+        self.running = False
+        await self.loop.run_in_executor(None, self._reader.join)
+        self.driver.close()
+
+        for channel in self.channels:
+            channel._closed()  # pylint: disable=protected-access
+        for futures in list(self._pending.values()) + list(self._waiters.values()):
+            for future in futures:
+                future.cancel()
+        self._pending.clear()
+        self._waiters.clear()
+
+    def send(self, msg):
+        """Queues `msg` for the writer thread and returns a
+        `concurrent.futures.Future` for the bytes written."""
+        return self._queueWrite((msg,))
+
+    def writeMessage(self, msg):
+        """Sends `msg` and returns a future for the response code the stick
+        answers it with. Driver errors fail the future."""
+        return self.writeMany((msg,))[0]
+
+    def writeMany(self, msgs):
+        """Sends all of `msgs` in a single transfer and returns one future
+        per message, as `writeMessage` would."""
+        msgs = list(msgs)
+        futures = []
+        for msg in msgs:
+            future = self.loop.create_future()
+            key = (msg.payload[0], msg.type)
+            self._pending.setdefault(key, deque()).append(future)
+            futures.append(future)
+        try:
+            handle = self._queueWrite(msgs)
+        except Exception:
+            for future in futures:
+                future.cancel()
+            raise
+        handle.add_done_callback(lambda handle: self._writeDone(handle, futures))
+        return futures
+
+    def _queueWrite(self, msgs):
+        priority = PRIORITY_DATA if all(msg.type in DATA_MESSAGE_TYPES for msg in msgs) \
+            else PRIORITY_CONTROL
+        data, ends = encodeFrames(msgs)
+        handle = Future()
+        queue = self.writeQueue
+        if queue is None or not queue.put(priority, data, ends, handle):
+            raise NodeError('Could not write to ANT node (not started).')
+        return handle
+
+    def _writeDone(self, handle, futures):
+        # runs on the writer thread
+        if handle.cancelled() or handle.exception() is None:
+            return
+        self.loop.call_soon_threadsafe(self._fail, futures, handle.exception())
+
+    @staticmethod
+    def _fail(futures, err):
+        for future in futures:
+            if not future.done():
+                future.set_exception(err)
+
+    def expectMessage(self, class_):
+        """Returns a future for the next received message of `class_`."""
+        future = self.loop.create_future()
+        self._waiters.setdefault(class_, []).append(future)
+        return future
+
+    async def wait(self, future, timeout=10):
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            raise MessageTimeoutError('%s: timeout' % str(future), internal=future)
+
+    async def request(self, msg, timeout=10):
+        """Sends `msg` and returns the response code."""
+        return await self.wait(self.writeMessage(msg), timeout)
+
+    async def setNetworkKey(self, number, network=None):
+        networks = self.networks
+        if network is None:
+            network = networks[number]
+        else:
+            networks[number] = network
+
+        response = await self.request(message.NetworkKeyMessage(number, network.key))
+        if response != RESPONSE_NO_ERROR:
+            raise NodeError("Could not set network key '%d' (0x%.2x)." % (number, response))
+
+        network.number = number
+
+    def getFreeChannel(self):
+        for channel in self.channels:
+            if channel.network is None:
+                return channel
+        raise NodeError('Could not find free channel.')
+
+    def _read(self, loop):
+        decoder = FrameDecoder()
+        driver = self.driver
+        while self.running:
+            try:
+                decoder.feed(driver.read())
+            except USBError as e:
+                if e.errno in (60, 110):  # timeout
+                    continue
+                return
+
+            frames = [bytes(frame) for frame in decoder.frames()]
+            if frames:
+                loop.call_soon_threadsafe(self._dispatch, frames)
+
+    def _dispatch(self, frames):
+        for frame in frames:
+            type_ = frame[2]
+            msg = FRAME_DECODERS[type_](frame, 0, frame[1])
+            if type_ == MESSAGE_CHANNEL_EVENT and msg.messageID != 1 and self._resolve(msg):
+                continue
+
+            waiters = self._waiters.pop(type(msg), None)
+            if waiters:
+                for future in waiters:
+                    if not future.done():
+                        future.set_result(msg)
+
+            if type_ in CHANNEL_MESSAGE_TYPES:
+                number, channels = frame[3], self.channels
+                if number < len(channels):
+                    channels[number]._process(msg)  # pylint: disable=protected-access
+
+    def _resolve(self, msg):
+        key = (msg.channelNumber, msg.messageID)
+        futures = self._pending.get(key)
+        if futures is None:
+            return False
+        while futures:
+            future = futures.popleft()
+            if not future.done():  # skip abandoned waits
+                future.set_result(msg.messageCode)
+                break
+        else:
+            future = None
+        if not futures:
+            del self._pending[key]
+        return future is not None
@@ -45,6 +45,7 @@ MESSAGE_CHANNEL_TX_POWER = 0x60
 MESSAGE_NETWORK_KEY = 0x46
 MESSAGE_TX_POWER = 0x47
 MESSAGE_PROXIMITY_SEARCH = 0x71
+MESSAGE_LIB_CONFIG = 0x6E
 
 # Notification messages
 MESSAGE_STARTUP = 0x6F
@@ -141,5 +142,10 @@ CAPABILITIES_PROX_SEARCH_ENABLED = 0x10
 CAPABILITIES_EXT_ASSIGN_ENABLED = 0x20
 CAPABILITIES_FS_ANTFS_ENABLED = 0x40
 
+# Flagged extended data (lib config flags and the data messages' flag byte)
+EXT_FLAG_CHANNEL_ID = 0x80
+EXT_FLAG_RSSI = 0x40
+EXT_FLAG_RX_TIMESTAMP = 0x20
+
 TIMEOUT_NEVER = 0xFF
 CHANNEL_ID_WILDCARD = 0x00  # For wild-card device searching/pairing
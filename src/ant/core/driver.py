@@ -26,6 +26,7 @@
 
 from __future__ import division, absolute_import, print_function, unicode_literals
 
+from array import array
 from threading import Lock
 
 # USB1 driver uses a USB<->Serial bridge
@@ -41,7 +42,22 @@ from ant.core.exceptions import DriverError
 from asyncio import Event
 
 
+def encodeFrames(msgs):
+    """Encodes `msgs` back to back into a new buffer. Returns the buffer and
+    the offset just past each frame."""
+    msgs = list(msgs)
+    data = bytearray(sum(len(msg) for msg in msgs))
+    ends, offset = [], 0
+    for msg in msgs:
+        offset += msg.encode_into(data, offset)
+        ends.append(offset)
+    return data, ends
+
+
 class Driver(object):
+    readSize = 20  # bytes asked for by `read()` without a count
+    writeSize = None  # most bytes `writeMany` puts in one transfer, None for no limit
+
     def __init__(self, log=None, debug=False):
         self.debug = debug
         self.log = log
@@ -70,22 +86,40 @@ class Driver(object):
             if self.log:
                 self.log.logClose()
 
-    def read(self, count):
-        if count <= 0:
+    def read(self, count=None):
+        """Reads up to `count` bytes. Without a count, returns whatever the
+        device has available in a single transfer, at most `readSize` bytes.
+        """
+        if count is not None and count <= 0:
             raise DriverError("Could not read from device (zero request).")
         if not self.opened:
             raise DriverError("Could not read from device (not open).")
 
         # TODO handle USBError exception here, probably rethrow as DriverError
         # timeouts might be handled as raising a DriverTimeoutError
-        data = self._read(count)
+        data = self._readAvailable() if count is None else self._read(count)
+
+        self._logRead(data)
+        return data
+
+    def readInto(self, buffer_):
+        """Reads up to `len(buffer_)` bytes into `buffer_` and returns how
+        many were read."""
+        if not len(buffer_):
+            raise DriverError("Could not read from device (zero request).")
+        if not self.opened:
+            raise DriverError("Could not read from device (not open).")
+
+        count = self._readInto(buffer_)
+        self._logRead(memoryview(buffer_)[:count])
+        return count
 
+    def _logRead(self, data):
         with self._lock:
             if self.log:
-                self.log.logRead(data)
+                self.log.logRead(data.tobytes() if isinstance(data, memoryview) else data)
             if self.debug:
                 self._dump(data, 'READ')
-        return data
 
     def write(self, msg):
         if not self.opened:
@@ -101,6 +135,58 @@ class Driver(object):
                 self.log.logWrite(data[0:ret])
         return ret
 
+    def writeMany(self, msgs):
+        """Encodes all of `msgs` into one buffer and writes it in a single
+        transfer, or in as few as possible if it exceeds `writeSize`. Frames
+        are never split between transfers. Returns the bytes written; a
+        short write raises `DriverError`.
+        """
+        data, ends = encodeFrames(msgs)
+        return self.writeFrames(data, ends)
+
+    def writeFrames(self, data, ends):
+        """Writes frames already encoded back to back into `data`; `ends`
+        holds the offset just past each frame. See `writeMany`.
+
+        Raises `DriverError` if the device takes fewer bytes than it was
+        given, after logging the part that was written."""
+        if not self.opened:
+            raise DriverError("Could not write to device (not open).")
+        if not data:
+            return 0
+
+        limit = self.writeSize or len(data)
+        transfers, start, previous = [], 0, 0
+        for end in ends:
+            if end - start > limit and previous > start:
+                transfers.append((start, previous))
+                start = previous
+            previous = end
+        transfers.append((start, len(data)))
+
+        view, written = memoryview(data), 0
+        for start, end in transfers:
+            ret = self._write(view[start:end])
+            written += ret
+            with self._lock:
+                if self.debug:
+                    self._dump(data[start:start + ret], 'WRITE')
+            if ret < end - start:
+                break
+
+        with self._lock:
+            if self.log:
+                start = 0
+                for end in ends:
+                    if start >= written:
+                        break
+                    self.log.logWrite(data[start:min(end, written)])
+                    start = end
+        if written < len(data):
+            raise DriverError('Could not write to device (wrote %d of %d bytes).'
+                              % (written, len(data)))
+        return written
+
     @staticmethod
     def _dump(data, title):
         if not data:
@@ -129,11 +215,22 @@ class Driver(object):
     def _read(self, count):
         raise NotImplementedError()
 
+    def _readAvailable(self):
+        return self._read(self.readSize)
+
+    def _readInto(self, buffer_):
+        data = self._read(len(buffer_))
+        count = len(data)
+        buffer_[:count] = data
+        return count
+
     def _write(self, data):
         raise NotImplementedError()
 
 
 class USB1Driver(Driver):
+    READ_TIMEOUT = 0.1  # longest an idle read blocks, so the pump can notice stop()
+
     def __init__(self, device, baudRate=115200, log=None, debug=False):
         super(USB1Driver, self).__init__(log=log, debug=debug)
         self.device = device
@@ -150,7 +247,7 @@ class USB1Driver(Driver):
             raise DriverError("Could not open device")
 
         self._serial = dev
-        dev.timeout = 0.01
+        dev.timeout = self.READ_TIMEOUT
 
     @property
     def _opened(self):
@@ -162,6 +259,17 @@ class USB1Driver(Driver):
     def _read(self, count):
         return self._serial.read(count)
 
+    def _readAvailable(self):
+        # the first byte is waited for in select(), so an idle stick costs
+        # nothing and a frame is returned as soon as it starts arriving
+        serial = self._serial
+        data = serial.read(1)
+        if data:
+            waiting = serial.in_waiting
+            if waiting:
+                data += serial.read(waiting)
+        return data
+
     def _write(self, data):
         try:
             count = self._serial.write(data)
@@ -173,6 +281,7 @@ class USB1Driver(Driver):
 
 
 class USB2Driver(Driver):
+    READ_PACKETS = 4  # bulk packets asked for by a single `read()`
 
     def __init__(self, idVendor=0x0fcf, idProduct=0x1008, bus=None, address=None, log=None, debug=False):
         super(USB2Driver, self).__init__(log=log, debug=debug)
@@ -186,6 +295,8 @@ class USB2Driver(Driver):
         self._epIn = None
         self._dev = None
         self._intNum = None
+        self._rxBuffer = None
+        self._rxView = None
 
         self.disconnected = Event()
 
@@ -223,27 +334,12 @@ class USB2Driver(Driver):
         self._dev = dev
         self._intNum = intf
 
-    def read(self, count):
-        if count <= 0:
-            raise DriverError("Could not read from device (zero request).")
-        if not self.opened:
-            raise DriverError("Could not read from device (not open).")
-
-        try:
-            data = self._read(count)
-        except USBError as e:
-            if e.errno in (60, 110):
-                raise e
-            else:
-                self.disconnected.set()
-                raise e
-
-        with self._lock:
-            if self.log:
-                self.log.logRead(data)
-            if self.debug:
-                self._dump(data, 'READ')
-        return data
+        # the stick packs several frames into one bulk packet; asking for
+        # whole packets keeps libusb from truncating them
+        self.readSize = ep_in.wMaxPacketSize * self.READ_PACKETS
+        self._rxBuffer = array('B', bytes(self.readSize))
+        self._rxView = memoryview(self._rxBuffer)
+        self.writeSize = ep_out.wMaxPacketSize
 
     @property
     def _opened(self):
@@ -256,9 +352,28 @@ class USB2Driver(Driver):
         self._dev = None
         # release 'Endpoints' objects for prevent undeleted 'Device' resource
         self._epOut = self._epIn = None
+        self._rxBuffer = self._rxView = None
+
+    def _transfer(self, sizeOrBuffer):
+        try:
+            return self._epIn.read(sizeOrBuffer)
+        except USBError as e:
+            if e.errno not in (60, 110):  # anything but a timeout
+                self.disconnected.set()
+            raise
 
     def _read(self, count):
-        return self._epIn.read(count).tobytes()
+        return self._transfer(count).tobytes()
+
+    def _readAvailable(self):
+        """Returns a view of the reusable receive buffer, valid until the
+        next read."""
+        return self._rxView[:self._transfer(self._rxBuffer)]
+
+    def _readInto(self, buffer_):
+        if isinstance(buffer_, array) and not len(buffer_) % self._epIn.wMaxPacketSize:
+            return self._transfer(buffer_)
+        return super(USB2Driver, self)._readInto(buffer_)
 
     def _write(self, data):
         # TODO handle USBError here
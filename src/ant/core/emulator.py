@@ -0,0 +1,414 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=missing-docstring
+##############################################################################
+#
+# Copyright (c) 2011, Martín Raúl Villalba
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+#
+##############################################################################
+"""Driver emulating an ANT USB stick, for running the whole stack without
+hardware.
+
+The stick answers commands the way a real one does and transmits broadcast
+data for `VirtualDevice`s on every open channel that pairs with one.
+"""
+
+from __future__ import division, absolute_import, print_function, unicode_literals
+
+from heapq import heappop, heappush
+from struct import pack
+from threading import Condition
+from time import time
+
+from ant.core import message
+from ant.core.constants import *
+from ant.core.driver import Driver
+from ant.core.event import FrameDecoder
+
+CHANNEL_UNASSIGNED = 0
+CHANNEL_ASSIGNED = 1
+CHANNEL_SEARCHING = 2
+CHANNEL_TRACKING = 3
+
+ANT_PLUS_FREQUENCY = 57
+SEARCH_TIMEOUT_UNIT = 2.5  # seconds per search timeout count
+TRANSMIT_TYPES = frozenset((CHANNEL_TYPE_TWOWAY_TRANSMIT, CHANNEL_TYPE_SHARED_TRANSMIT,
+                            CHANNEL_TYPE_ONEWAY_TRANSMIT))
+
+
+class VirtualDevice(object):
+    """A transmitter in range of the emulated stick.
+
+    Subclasses override `page` to return the 8 data bytes of the device's
+    `count`th broadcast; `elapsed` is the time it is sent at, in seconds
+    since the channel opened.
+    """
+    deviceType = 0
+    period = 8192
+    frequency = ANT_PLUS_FREQUENCY
+
+    def __init__(self, deviceNumber, transmissionType=1):
+        self.deviceNumber = deviceNumber
+        self.transmissionType = transmissionType
+
+    def matches(self, channel):
+        return (channel.frequency == self.frequency and
+                channel.deviceNumber in (0, self.deviceNumber) and
+                channel.deviceType & 0x7F in (0, self.deviceType) and
+                channel.transmissionType in (0, self.transmissionType))
+
+    def page(self, count, elapsed):  # pylint: disable=unused-argument
+        return b'\x00' * 8
+
+    def __str__(self):
+        return '<%s %d>' % (type(self).__name__, self.deviceNumber)
+
+
+class HeartRateMonitor(VirtualDevice):
+    deviceType = 0x78
+    period = 8070
+
+    def __init__(self, deviceNumber, bpm=120, transmissionType=1):
+        super(HeartRateMonitor, self).__init__(deviceNumber, transmissionType)
+        self.bpm = bpm
+
+    def page(self, count, elapsed):
+        # page 4, the toggle bit flips every four messages
+        beats = int(elapsed * self.bpm / 60)
+        beatTime = int(beats * 60 * 1024 / self.bpm)
+        previous = int((beats - 1) * 60 * 1024 / self.bpm)
+        toggle = (count // 4) & 1
+        return pack('<BBHHBB', 0x04 | toggle << 7, 0xFF, previous & 0xFFFF,
+                    beatTime & 0xFFFF, beats & 0xFF, self.bpm)
+
+
+class PowerMeter(VirtualDevice):
+    deviceType = 0x0B
+    period = 8182
+
+    def __init__(self, deviceNumber, watts=200, cadence=90, transmissionType=5):
+        super(PowerMeter, self).__init__(deviceNumber, transmissionType)
+        self.watts = watts
+        self.cadence = cadence
+
+    def page(self, count, elapsed):
+        # standard power-only page, pedal power not used
+        events = count + 1
+        return pack('<BBBBHH', 0x10, events & 0xFF, 0xFF, self.cadence,
+                    events * self.watts & 0xFFFF, self.watts)
+
+
+class FitnessEquipment(VirtualDevice):
+    deviceType = 0x11
+    period = 8192
+
+    def __init__(self, deviceNumber, speed=8.0, watts=150, cadence=80, transmissionType=5):
+        """:param speed: in meters per second"""
+        super(FitnessEquipment, self).__init__(deviceNumber, transmissionType)
+        self.speed = speed
+        self.watts = watts
+        self.cadence = cadence
+
+    def page(self, count, elapsed):
+        # general FE data and trainer data take turns
+        if count & 1:
+            events = count // 2 + 1
+            return pack('<BBBHHB', 0x19, events & 0xFF, self.cadence,
+                        events * self.watts & 0xFFFF, self.watts & 0x0FFF, 0x00)
+        return pack('<BBBBHBB', 0x10, 0x19, int(elapsed * 4) & 0xFF,
+                    int(elapsed * self.speed) & 0xFF, int(self.speed * 1000) & 0xFFFF,
+                    0xFF, 0x00)
+
+
+class EmulatedChannel(object):
+    def __init__(self, number):
+        self.number = number
+        self.reset()
+
+    def reset(self):
+        self.state = CHANNEL_UNASSIGNED
+        self.type = CHANNEL_TYPE_TWOWAY_RECEIVE
+        self.network = 0
+        self.deviceNumber = self.deviceType = self.transmissionType = 0
+        self.period = 8192
+        self.frequency = 66
+        self.searchTimeout = 12
+        self.device = None
+        self.opened = 0.0
+        self.count = 0
+        self.generation = 0  # bumped on close, invalidates scheduled broadcasts
+
+
+class EmulatedStick(Driver):
+    """Driver for an ANT stick that only exists in memory.
+
+    :param devices: `VirtualDevice`s in range; each pairs with at most one
+            open receive channel whose ID and frequency match it
+    :param timeScale: How much faster than real time channel periods and
+            search timeouts run
+    """
+    READ_TIMEOUT = 0.1
+
+    def __init__(self, devices=(), maxChannels=8, maxNetworks=8, timeScale=1.0, log=None,
+                 debug=False):
+        super(EmulatedStick, self).__init__(log=log, debug=debug)
+        self.devices = list(devices)
+        self.maxChannels = maxChannels
+        self.maxNetworks = maxNetworks
+        self.timeScale = timeScale
+        self.broadcasts = 0  # data messages generated
+
+        self._isOpen = False
+        self._ready = Condition()
+        self._output = bytearray()
+        self._schedule = []  # (due, generation, channel number, is search timeout)
+        self._channels = []
+        self._extFlags = 0
+
+    @property
+    def _opened(self):
+        return self._isOpen
+
+    def _open(self):
+        with self._ready:
+            self._isOpen = True
+            self._reset()
+
+    def _close(self):
+        with self._ready:
+            self._isOpen = False
+            self._ready.notify_all()
+
+    def _reset(self):
+        del self._output[:]
+        self._schedule = []
+        self._channels = [EmulatedChannel(number) for number in range(self.maxChannels)]
+        self._extFlags = 0
+
+    def _read(self, count):
+        return self._take(count)
+
+    def _readAvailable(self):
+        return self._take(None)
+
+    def _take(self, count):
+        deadline = time() + self.READ_TIMEOUT
+        with self._ready:
+            while self._isOpen:
+                now = time()
+                self._transmit(now)
+                if self._output or now >= deadline:
+                    break
+                wait = deadline - now
+                if self._schedule:
+                    wait = min(wait, self._schedule[0][0] - now)
+                self._ready.wait(wait)
+
+            output = self._output
+            count = len(output) if count is None else min(count, len(output))
+            data = bytes(output[:count])
+            del output[:count]
+        return data
+
+    def _write(self, data):
+        decoder = FrameDecoder()
+        decoder.feed(data)
+        with self._ready:
+            for msg in decoder:
+                self._handle(msg)
+            if self._output:
+                self._ready.notify_all()
+        return len(data)
+
+    def _reply(self, msg):
+        self._output += msg.encode()
+
+    def _respond(self, number, msgType, code=RESPONSE_NO_ERROR):
+        self._reply(message.ChannelEventResponseMessage(number, msgType, code))
+
+    def _event(self, number, code):
+        self._reply(message.ChannelEventResponseMessage(number, 1, code))
+
+    def _handle(self, msg):
+        type_ = msg.type
+        if type_ == MESSAGE_SYSTEM_RESET:
+            self._reset()
+            self._reply(message.StartupMessage(0x20))  # command reset
+        elif type_ == MESSAGE_NETWORK_KEY:
+            code = RESPONSE_NO_ERROR if msg.number < self.maxNetworks else INVALID_NETWORK_NUMBER
+            self._respond(msg.number, type_, code)
+        elif type_ == MESSAGE_LIB_CONFIG:
+            self._extFlags = msg.flags
+            self._respond(0, type_)
+        elif type_ == MESSAGE_CHANNEL_REQUEST:
+            self._request(msg)
+        elif type_ in (MESSAGE_CHANNEL_ASSIGN, MESSAGE_CHANNEL_UNASSIGN, MESSAGE_CHANNEL_ID,
+                       MESSAGE_CHANNEL_PERIOD, MESSAGE_CHANNEL_FREQUENCY,
+                       MESSAGE_CHANNEL_SEARCH_TIMEOUT, MESSAGE_CHANNEL_TX_POWER,
+                       MESSAGE_CHANNEL_OPEN, MESSAGE_CHANNEL_CLOSE):
+            number = msg.channelNumber
+            if number >= self.maxChannels:
+                self._respond(number, type_, INVALID_PARAMETER_PROVIDED)
+            else:
+                code = self._configure(self._channels[number], msg)
+                if code is not None:
+                    self._respond(number, type_, code)
+        elif type_ == MESSAGE_CHANNEL_ACKNOWLEDGED_DATA:
+            channel = self._channel(msg.channelNumber)
+            paired = channel is not None and channel.state == CHANNEL_TRACKING
+            self._event(msg.channelNumber,
+                        EVENT_TRANSFER_TX_COMPLETED if paired else EVENT_TRANSFER_TX_FAILED)
+        elif type_ in (MESSAGE_CHANNEL_BROADCAST_DATA, MESSAGE_CHANNEL_BURST_DATA):
+            pass  # nobody listens to what the host transmits
+        else:
+            self._respond(0, type_, INVALID_MESSAGE)
+
+    def _channel(self, number):
+        channels = self._channels
+        return channels[number] if number < len(channels) else None
+
+    def _request(self, msg):
+        requested, number = msg.messageID, msg.channelNumber
+        channel = self._channel(number)
+        if requested == MESSAGE_CAPABILITIES:
+            self._reply(message.CapabilitiesMessage(self.maxChannels, self.maxNetworks))
+        elif requested == MESSAGE_SERIAL_NUMBER:
+            self._reply(message.SerialNumberMessage(b'\x45\x4d\x55\x01'))
+        elif requested == MESSAGE_VERSION:
+            self._reply(message.VersionMessage(b'EMU1.0\x00\x00\x00'))
+        elif requested == MESSAGE_CHANNEL_STATUS and channel is not None:
+            status = channel.state | (channel.network << 2) | (channel.type & 0xF0)
+            self._reply(message.ChannelStatusMessage(number, status))
+        elif requested == MESSAGE_CHANNEL_ID and channel is not None:
+            device = channel.device
+            if device is not None:
+                self._reply(message.ChannelIDMessage(number, device.deviceNumber,
+                                                     device.deviceType, device.transmissionType))
+            else:
+                self._reply(message.ChannelIDMessage(number, channel.deviceNumber,
+                                                     channel.deviceType, channel.transmissionType))
+        else:
+            self._respond(number, MESSAGE_CHANNEL_REQUEST, INVALID_MESSAGE)
+
+    def _configure(self, channel, msg):
+        """Applies a channel command, returns the response code."""
+        type_, state = msg.type, channel.state
+        if type_ == MESSAGE_CHANNEL_ASSIGN:
+            if state != CHANNEL_UNASSIGNED:
+                return CHANNEL_IN_WRONG_STATE
+            if msg.networkNumber >= self.maxNetworks:
+                return INVALID_NETWORK_NUMBER
+            channel.state = CHANNEL_ASSIGNED
+            channel.type = msg.channelType
+            channel.network = msg.networkNumber
+            return RESPONSE_NO_ERROR
+
+        if state == CHANNEL_UNASSIGNED:
+            return CHANNEL_IN_WRONG_STATE
+        opened = state in (CHANNEL_SEARCHING, CHANNEL_TRACKING)
+
+        if type_ == MESSAGE_CHANNEL_UNASSIGN:
+            if opened:
+                return CHANNEL_IN_WRONG_STATE
+            channel.reset()
+        elif type_ == MESSAGE_CHANNEL_ID:
+            channel.deviceNumber = msg.deviceNumber
+            channel.deviceType = msg.deviceType
+            channel.transmissionType = msg.transmissionType
+        elif type_ == MESSAGE_CHANNEL_PERIOD:
+            channel.period = msg.channelPeriod
+        elif type_ == MESSAGE_CHANNEL_FREQUENCY:
+            channel.frequency = msg.frequency
+        elif type_ == MESSAGE_CHANNEL_SEARCH_TIMEOUT:
+            channel.searchTimeout = msg.timeout
+        elif type_ == MESSAGE_CHANNEL_OPEN:
+            if opened:
+                return CHANNEL_IN_WRONG_STATE
+            self._openChannel(channel)
+        elif type_ == MESSAGE_CHANNEL_CLOSE:
+            if not opened:
+                return CHANNEL_IN_WRONG_STATE
+            self._closeChannel(channel)
+            # the closed event follows the response
+            self._respond(channel.number, type_)
+            self._event(channel.number, EVENT_CHANNEL_CLOSED)
+            return None
+        return RESPONSE_NO_ERROR
+
+    def _openChannel(self, channel):
+        now = time()
+        channel.opened = now
+        channel.count = 0
+        if channel.type in TRANSMIT_TYPES:
+            channel.state = CHANNEL_TRACKING
+            return
+
+        paired = set(id(other.device) for other in self._channels if other.device is not None)
+        for device in self.devices:
+            if id(device) not in paired and device.matches(channel):
+                channel.device = device
+                channel.state = CHANNEL_TRACKING
+                heappush(self._schedule, (now + self._interval(channel), channel.generation,
+                                          channel.number, False))
+                return
+
+        channel.state = CHANNEL_SEARCHING
+        if channel.searchTimeout != 0xFF:  # 255 searches forever
+            timeout = channel.searchTimeout * SEARCH_TIMEOUT_UNIT / self.timeScale
+            heappush(self._schedule, (now + timeout, channel.generation, channel.number, True))
+
+    def _closeChannel(self, channel):
+        channel.state = CHANNEL_ASSIGNED
+        channel.device = None
+        channel.generation += 1
+
+    def _interval(self, channel):
+        return channel.period / 32768 / self.timeScale
+
+    def _transmit(self, now):
+        """Generates everything that has become due by `now`."""
+        schedule, channels = self._schedule, self._channels
+        while schedule and schedule[0][0] <= now:
+            due, generation, number, searchTimeout = heappop(schedule)
+            channel = channels[number]
+            if generation != channel.generation:
+                continue  # closed since
+
+            if searchTimeout:
+                self._closeChannel(channel)
+                self._event(number, EVENT_RX_SEARCH_TIMEOUT)
+                self._event(number, EVENT_CHANNEL_CLOSED)
+                continue
+
+            device = channel.device
+            elapsed = (due - channel.opened) * self.timeScale
+            data = device.page(channel.count, elapsed)
+            if self._extFlags & EXT_FLAG_CHANNEL_ID:
+                data = bytes(data) + pack('<BHBB', EXT_FLAG_CHANNEL_ID, device.deviceNumber,
+                                          device.deviceType, device.transmissionType)
+            self._reply(message.ChannelBroadcastDataMessage(number, data))
+            channel.count += 1
+            self.broadcasts += 1
+
+            # a reader that fell far behind loses the backlog, like a real stick
+            due += self._interval(channel)
+            if due < now - 1.0:
+                due = now
+            heappush(schedule, (due, generation, number, False))
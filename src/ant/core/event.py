@@ -30,56 +30,507 @@
 
 from __future__ import division, absolute_import, print_function, unicode_literals
 
-from time import sleep, time
-from threading import Lock, Thread
-
-from ant.core.constants import MESSAGE_TX_SYNC
-from ant.core.message import Message, ChannelEventResponseMessage
-from ant.core.exceptions import MessageError, MessageTimeoutError
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from heapq import heappop, heappush
+from time import perf_counter, sleep, time
+from threading import Condition, Lock, Thread, current_thread
+
+from ant.core.constants import MESSAGE_CHANNEL_EVENT, MESSAGE_CHANNEL_ID, MESSAGE_TX_SYNC, \
+        EXT_FLAG_CHANNEL_ID
+from ant.core.message import ChannelEventResponseMessage, ChannelIDMessage, ChannelStatusMessage, \
+        StartupMessage, CapabilitiesMessage, VersionMessage, SerialNumberMessage, MessageView, \
+        FRAME_DECODERS, CHANNEL_MESSAGE_TYPES, DATA_MESSAGE_TYPES, EXTENDED_DATA_OFFSET, \
+        FRAME_OVERHEAD, MSG_HEADER_SIZE, frameSize
+from ant.core.driver import encodeFrames
+from ant.core.exceptions import MessageTimeoutError
 from usb.core import USBError
 
 
+class FrameDecoder(object):
+    """Reassembles ANT frames out of the raw byte stream read from a driver.
+
+    Incoming bytes are copied once into a preallocated buffer. Complete frames
+    are decoded straight out of that buffer, and only the unconsumed tail is
+    moved back to the front when the write offset reaches the end.
+    """
+
+    def __init__(self, size=1024):
+        self._buffer = bytearray(size)
+        self._view = memoryview(self._buffer)
+        self._start = 0  # read offset
+        self._end = 0  # write offset
+
+        self.bytesFed = 0
+        self.checksumErrors = 0  # complete frames with a bad checksum
+        self.skippedBytes = 0  # bytes thrown away looking for a frame
+
+    def __len__(self):
+        return self._end - self._start
+
+    buffer = property(lambda self: self._buffer)
+
+    def _reserve(self, count):
+        buffer_, start, end = self._buffer, self._start, self._end
+        size = len(buffer_)
+        if end + count <= size:
+            return
+
+        pending = end - start
+        if pending <= start and pending + count <= size:
+            # the tail doesn't overlap its destination, so move it in place
+            buffer_[:pending] = self._view[start:end]
+        else:
+            size = max(2 * size, pending + count)
+            grown = bytearray(size)
+            grown[:pending] = self._view[start:end]
+            self._view.release()
+            self._buffer, self._view = grown, memoryview(grown)
+        self._start, self._end = 0, pending
+
+    def feed(self, data):
+        count = len(data)
+        self._reserve(count)
+        end = self._end
+        self._buffer[end:end + count] = data
+        self._end = end + count
+        self.bytesFed += count
+
+    def clear(self):
+        self._start = self._end = 0
+
+    def _next(self):
+        """Returns the offset of the next complete and valid frame, or -1."""
+        buffer_ = self._buffer
+        start, end = self._start, self._end
+        while start < end:
+            size = frameSize(buffer_, start, end)
+            if size > 0:
+                self._start = start + size
+                return start
+            if size == 0:
+                break
+
+            # not a valid frame, move on to the next SYNC byte
+            if buffer_[start] == MESSAGE_TX_SYNC:
+                self.checksumErrors += 1
+            skipped = buffer_.find(MESSAGE_TX_SYNC, start + 1, end)
+            if skipped < 0:
+                skipped = end
+            self.skippedBytes += skipped - start
+            start = skipped
+
+        self._start = start
+        return -1
+
+    def offsets(self):
+        """Yields the offset of every complete frame in `buffer`."""
+        while True:
+            start = self._next()
+            if start < 0:
+                return
+            yield start
+
+    def frames(self):
+        """Yields every complete frame as a memoryview into the buffer.
+
+        Views are only valid until the next call to `feed`.
+        """
+        view = self._view
+        while True:
+            start = self._next()
+            if start < 0:
+                return
+            yield view[start:self._start]
+
+    def views(self):
+        """Yields a `MessageView` over every complete frame.
+
+        Like `frames`, views are only valid until the next call to `feed`.
+        """
+        buffer_ = self._buffer
+        while True:
+            start = self._next()
+            if start < 0:
+                return
+            yield MessageView(buffer_, start)
+
+    def __iter__(self):
+        buffer_ = self._buffer
+        while True:
+            start = self._next()
+            if start < 0:
+                return
+            yield FRAME_DECODERS[buffer_[start + 2]](buffer_, start, buffer_[start + 1])
+
+
+OVERFLOW_BLOCK = 'block'  # stall the reader until there is room
+OVERFLOW_DROP_NEWEST = 'dropNewest'  # discard the incoming data frame
+OVERFLOW_DROP_OLDEST = 'dropOldest'  # discard the oldest queued data frame
+
+
+class DispatchQueue(object):
+    """Bounded FIFO of received frames between the reader and a dispatcher.
+
+    Only data frames count against `size` and are subject to the `overflow`
+    policy; responses and events are always queued so no ack gets lost.
+    """
+
+    def __init__(self, size=256, overflow=OVERFLOW_DROP_OLDEST):
+        if overflow not in (OVERFLOW_BLOCK, OVERFLOW_DROP_NEWEST, OVERFLOW_DROP_OLDEST):
+            raise ValueError('Unknown overflow policy %r.' % overflow)
+        self.size = size
+        self.overflow = overflow
+        self._frames = deque()
+        self._lock = Lock()
+        self._notEmpty = Condition(self._lock)
+        self._notFull = Condition(self._lock)
+        self._closed = False
+
+        self.enqueued = 0
+        self.dropped = 0
+        self.maxDepth = 0
+        self._depthTotal = 0
+
+    def __len__(self):
+        return len(self._frames)
+
+    def put(self, frame, rxTime):
+        frames = self._frames
+        with self._lock:
+            if frame[2] in DATA_MESSAGE_TYPES and len(frames) >= self.size:
+                overflow = self.overflow
+                if overflow == OVERFLOW_BLOCK:
+                    while len(frames) >= self.size and not self._closed:
+                        self._notFull.wait()
+                elif overflow == OVERFLOW_DROP_NEWEST:
+                    self.dropped += 1
+                    return
+                else:
+                    for index, (queued, _) in enumerate(frames):
+                        if queued[2] in DATA_MESSAGE_TYPES:
+                            del frames[index]
+                            self.dropped += 1
+                            break
+            if self._closed:
+                return
+
+            frames.append((frame, rxTime))
+            depth = len(frames)
+            self.enqueued += 1
+            self._depthTotal += depth
+            if depth > self.maxDepth:
+                self.maxDepth = depth
+            self._notEmpty.notify()
+
+    def get(self):
+        """Returns the next `(frame, rxTime)`, or None once closed and empty."""
+        frames = self._frames
+        with self._lock:
+            while not frames:
+                if self._closed:
+                    return None
+                self._notEmpty.wait()
+            self._notFull.notify()
+            return frames.popleft()
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._notEmpty.notify_all()
+            self._notFull.notify_all()
+
+    def stats(self):
+        with self._lock:
+            enqueued = self.enqueued
+            return {
+                'depth': len(self._frames),
+                'maxDepth': self.maxDepth,
+                'meanDepth': self._depthTotal / enqueued if enqueued else 0.0,
+                'enqueued': enqueued,
+                'dropped': self.dropped,
+            }
+
+
+PRIORITY_CONTROL = 0  # commands and requests
+PRIORITY_DATA = 1  # broadcast, acknowledged and burst data
+
+
+class WriteQueue(object):
+    """Encoded frames waiting for the writer thread.
+
+    Lower priority numbers go first; within a priority, frames keep the
+    order they were queued in.
+    """
+
+    def __init__(self):
+        self._items = []
+        self._lock = Lock()
+        self._notEmpty = Condition(self._lock)
+        self._closed = False
+        self._sequence = 0
+
+        self.enqueued = 0
+        self.failed = 0
+        self.maxDepth = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def put(self, priority, data, ends, handle):
+        """Queues the frames in `data`, returns False if the queue is closed."""
+        items = self._items
+        with self._lock:
+            if self._closed:
+                return False
+            heappush(items, (priority, self._sequence, data, ends, handle))
+            self._sequence += 1
+            self.enqueued += 1
+            if len(items) > self.maxDepth:
+                self.maxDepth = len(items)
+            self._notEmpty.notify()
+        return True
+
+    def get(self):
+        """Returns the next `(data, ends, handle)`, or None once closed and empty."""
+        items = self._items
+        with self._lock:
+            while not items:
+                if self._closed:
+                    return None
+                self._notEmpty.wait()
+            return heappop(items)[2:]
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._notEmpty.notify_all()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'depth': len(self._items),
+                'maxDepth': self.maxDepth,
+                'enqueued': self.enqueued,
+                'failed': self.failed,
+            }
+
+
+def Writer(evm, queue):
+    nextWrite = 0.0
+    while True:
+        item = queue.get()
+        if item is None:
+            return
+        data, ends, handle = item
+        if not handle.set_running_or_notify_cancel():
+            continue
+
+        # space the frames out so the stick's own queue doesn't overflow
+        rate = evm.writeRate
+        if rate:
+            delay = nextWrite - time()
+            if delay > 0:
+                sleep(delay)
+            nextWrite = max(nextWrite, time()) + len(ends) / rate
+
+        try:
+            handle.set_result(evm.driver.writeFrames(data, ends))
+        except Exception as err:  # pylint: disable=broad-except
+            queue.failed += 1
+            handle.set_exception(err)
+
+
 def EventPump(evm):
-    buffer_ = b''
+    decoder = evm.decoder
+    queues = evm.queues
+    frames = evm.frames
     while True:
         with evm.runningLock:
             if not evm.running:
                 break
 
         try:
-            buffer_ += evm.driver.read(20)
+            decoder.feed(evm.driver.read())
         except USBError as e:
             if e.errno in (60, 110):  # timeout
                 continue
             else:
                 return
 
-        messages = []
-        while buffer_:
+        rxTime = time()
+        buffer_ = decoder.buffer
+        if queues:
+            # hand copies of the frames to the dispatchers, keeping all
+            # messages for one channel on the same dispatcher
+            shards = len(queues)
+            for start in decoder.offsets():
+                frames[buffer_[start + 2]] += 1
+                frame = buffer_[start:start + buffer_[start + 1] + FRAME_OVERHEAD]
+                shard = frame[MSG_HEADER_SIZE] % shards if frame[2] in CHANNEL_MESSAGE_TYPES else 0
+                queues[shard].put(frame, rxTime)
+            continue
+
+        # frames must be dispatched before the next read, views point into
+        # the decoder's buffer
+        with evm.evmCallbackLock:
+            for start in decoder.offsets():
+                frames[buffer_[start + 2]] += 1
+                _dispatchFrame(evm, buffer_, start, rxTime)
+
+
+def Dispatcher(evm, queue):
+    while True:
+        item = queue.get()
+        if item is None:
+            return
+        frame, rxTime = item
+        _dispatchFrame(evm, frame, 0, rxTime)
+
+
+def _dispatchFrame(evm, buffer_, start, rxTime):
+    type_ = buffer_[start + 2]
+    rawCallbacks = evm.rawCallbacks
+    if rawCallbacks:
+        _dispatchRaw(rawCallbacks, buffer_, start, rxTime)
+
+    number = page = deviceType = channel = None
+    if type_ in CHANNEL_MESSAGE_TYPES:
+        number = buffer_[start + MSG_HEADER_SIZE]
+        channel = evm.channels[number]
+    wanted = evm.wantedTypes
+    if channel is None and wanted is not None and type_ not in wanted:
+        return  # nobody needs a message object for this frame
+
+    if evm.routeByPage and type_ in DATA_MESSAGE_TYPES:
+        page = buffer_[start + MSG_HEADER_SIZE + 1]
+    if evm.routeByDeviceType:
+        deviceType = _deviceType(buffer_, start, channel)
+
+    routes = evm.routes
+    key = (type_, number, page, deviceType)
+    route = routes.get(key)
+    if route is None:
+        route = routes[key] = evm.match(*key)
+    callbacks, viewCallbacks = route
+
+    # time the callbacks for one in every TIMING_INTERVAL frames of a type
+    timings = None if evm.frames[type_] % TIMING_INTERVAL else evm.dispatchTimes
+    if viewCallbacks:
+        view = MessageView(buffer_, start)
+        _dispatch(viewCallbacks, view, timings)
+        if channel is None and not callbacks:
+            return
+        msg = view.materialize()
+    elif channel is None and not callbacks:
+        return
+    else:
+        msg = FRAME_DECODERS[type_](buffer_, start, buffer_[start + 1])
+
+    if channel is not None:
+        if timings is None:
             try:
-                msg = Message.decode(buffer_)
-                messages.append(msg)
-                buffer_ = buffer_[len(msg):]
-            except MessageError as err:
-                if err.internal is not Message.INCOMPLETE:
-                    i, length = 1, len(buffer_)
-                    # move to the next SYNC byte
-                    while i < length and buffer_[i] != MESSAGE_TX_SYNC:
-                        i += 1
-                    buffer_ = buffer_[i:]
-                else:
-                    break
+                channel.process(msg)
+            except Exception as err:  # pylint: disable=broad-except
+                print(err)
+        else:
+            _dispatch((channel,), msg, timings)
+    if callbacks:
+        _dispatch(callbacks, msg, timings)
+
+
+def _deviceType(buffer_, start, channel):
+    """Device type of the frame's sender, or None if the frame doesn't tell."""
+    type_, length = buffer_[start + 2], buffer_[start + 1]
+    payload = start + MSG_HEADER_SIZE
+    if type_ == MESSAGE_CHANNEL_ID:
+        return buffer_[payload + 3]
+    if type_ not in DATA_MESSAGE_TYPES:
+        return None
+    if length > EXTENDED_DATA_OFFSET and buffer_[payload + EXTENDED_DATA_OFFSET] & EXT_FLAG_CHANNEL_ID:
+        return buffer_[payload + EXTENDED_DATA_OFFSET + 3]
+    channelId = getattr(channel, 'id', None)
+    if channelId is not None and channelId.deviceType:
+        return channelId.deviceType
+    return None
+
+
+HISTOGRAM_BUCKETS = 24
+TIMING_INTERVAL = 16
+
+
+def _dispatch(callbacks, msg, timings=None):
+    if timings is None:
+        for callback in callbacks:
+            try:
+                callback.process(msg)
+            except Exception as err:  # pylint: disable=broad-except
+                print(err)
+        return
 
-        with evm.evmCallbackLock:
-            for message in messages:
-                for callback in evm.callbacks:
-                    try:
-                        callback.process(message)
-                    except Exception as err:  # pylint: disable=broad-except
-                        print(err)
+    for callback in callbacks:
+        begin = perf_counter()
+        try:
+            callback.process(msg)
+        except Exception as err:  # pylint: disable=broad-except
+            print(err)
+
+        # bucket n counts calls that took [2 ** (n - 1), 2 ** n) microseconds
+        bucket = int((perf_counter() - begin) * 1e6).bit_length()
+        histogram = timings.get(callback)
+        if histogram is None:
+            histogram = timings[callback] = [0] * HISTOGRAM_BUCKETS
+        histogram[bucket if bucket < HISTOGRAM_BUCKETS else HISTOGRAM_BUCKETS - 1] += 1
+
+
+class Subscription(object):
+    """Filters `callback` was registered with. A filter of None matches
+    anything; otherwise it is the set of accepted values."""
+    __slots__ = ('callback', 'views', 'types', 'channels', 'pages', 'deviceTypes')
+
+    def __init__(self, callback, views=False, types=None, channels=None, pages=None,
+                 deviceTypes=None):
+        self.callback = callback
+        self.views = views
+        self.types = None if types is None else frozenset(types)
+        self.channels = None if channels is None else frozenset(channels)
+        self.pages = None if pages is None else frozenset(pages)
+        self.deviceTypes = None if deviceTypes is None else frozenset(deviceTypes)
+
+    @property
+    def messageTypes(self):
+        """`types`, or the callback's own `types` attribute if not given."""
+        types = self.types
+        return getattr(self.callback, 'types', None) if types is None else types
+
+    def matches(self, type_, channel, page, deviceType):
+        types = self.messageTypes
+        return (types is None or type_ in types) and \
+               (self.channels is None or channel in self.channels) and \
+               (self.pages is None or page in self.pages) and \
+               (self.deviceTypes is None or deviceType in self.deviceTypes)
+
+
+def _dispatchRaw(rawCallbacks, buffer_, start, rxTime):
+    type_ = buffer_[start + 2]
+    channel = buffer_[start + MSG_HEADER_SIZE] if type_ in CHANNEL_MESSAGE_TYPES else None
+    payload = None
+    for callback, (types, channels) in rawCallbacks.items():
+        if types is not None and type_ not in types:
+            continue
+        if channels is not None and channel not in channels:
+            continue
+        if payload is None:
+            offset = start + MSG_HEADER_SIZE
+            payload = memoryview(buffer_)[offset:offset + buffer_[start + 1]]
+        try:
+            callback(type_, channel, payload, rxTime)
+        except Exception as err:  # pylint: disable=broad-except
+            print(err)
 
 
 class EventCallback(object):
+    types = None  # message IDs to receive, None for every message
 
     def process(self, msg):
         raise NotImplementedError()
@@ -90,46 +541,190 @@ class EventMachineCallback(EventCallback):
     WAIT_UNTIL = staticmethod(lambda _, __: None)
 
     def __init__(self):
-        self.messages = []
+        self.messages = deque(maxlen=self.MAX_QUEUE)
         self.lock = Lock()
+        self.arrived = Condition(self.lock)
 
     def process(self, msg):
         with self.lock:
-            messages = self.messages
-            messages.append(msg)
-            MAX_QUEUE = self.MAX_QUEUE
-            if len(messages) > MAX_QUEUE:
-                self.messages = messages[-MAX_QUEUE:]
+            self.messages.append(msg)
+            self.arrived.notify_all()
 
     def waitFor(self, foo, timeout=10):  # pylint: disable=blacklisted-name
-        messages = self.messages
-        basetime = time()
-        while time() - basetime < timeout:
-            with self.lock:
-                for emsg in messages:
+        deadline = time() + timeout
+        with self.lock:
+            while True:
+                for emsg in self.messages:
                     if self.WAIT_UNTIL(foo, emsg):
-                        messages.remove(emsg)
+                        self.messages.remove(emsg)
                         return emsg
-            sleep(0.001)
+
+                remaining = deadline - time()
+                if remaining <= 0:
+                    break
+                self.arrived.wait(remaining)
         raise MessageTimeoutError("%s: timeout" % str(foo), internal=foo)
 
 class AckCallback(EventMachineCallback):
+    types = frozenset((MESSAGE_CHANNEL_EVENT,))
     WAIT_UNTIL = staticmethod(lambda msg, emsg: msg.type == emsg.messageID)
 
+    def __init__(self):
+        super(AckCallback, self).__init__()
+        self.pending = {}
+
+    def expect(self, msg):
+        """Returns a future for the response to `msg`, resolved with its
+        response code. Must be called before `msg` is written. Cancelling
+        the future, as a timed out `waitForAck` does, stops waiting for the
+        response."""
+        future = Future()
+        key = (msg.payload[0], msg.type)
+        with self.lock:
+            self.pending.setdefault(key, deque()).append(future)
+        future.add_done_callback(lambda future: future.cancelled() and self._forget(key, future))
+        return future
+
+    def fail(self, future, err):
+        """Fails a future from `expect` whose message could not be written."""
+        with self.lock:
+            for key, futures in self.pending.items():
+                if future in futures:
+                    break
+            else:
+                return
+        if self._forget(key, future) and future.set_running_or_notify_cancel():
+            future.set_exception(err)
+
+    def _forget(self, key, future):
+        """Removes `future` from `pending`, returns False if it wasn't there."""
+        with self.lock:
+            futures = self.pending.get(key)
+            if futures is None or future not in futures:
+                return False
+            futures.remove(future)
+            if not futures:
+                del self.pending[key]
+            return True
+
     def process(self, msg):
         if isinstance(msg, ChannelEventResponseMessage) and \
            msg.messageID != 1:  # response message, not event
-            super(AckCallback, self).process(msg)
+            if not self._resolve(msg):
+                super(AckCallback, self).process(msg)
+
+    def _resolve(self, msg):
+        key = (msg.channelNumber, msg.messageID)
+        with self.lock:
+            futures = self.pending.get(key)
+            if futures is None:
+                return False
+            future = None
+            while futures:
+                candidate = futures.popleft()
+                if candidate.set_running_or_notify_cancel():  # skip abandoned waits
+                    future = candidate
+                    break
+            if not futures:
+                del self.pending[key]
+        if future is None:
+            return False
+        future.set_result(msg.messageCode)
+        return True
 
 
 class MsgCallback(EventMachineCallback):
-    WAIT_UNTIL = staticmethod(lambda class_, emsg: isinstance(emsg, class_))
+    """Keeps the last `MAX_QUEUE` messages of every subscribed class,
+    subclasses included.
+
+    Replies the library waits for are subscribed from the start, as they can
+    arrive before `waitFor` is called; other classes are subscribed on their
+    first `waitFor`. A message matching several subscribed classes is kept
+    for each of them.
+    """
+    SUBSCRIPTIONS = (ChannelEventResponseMessage, ChannelIDMessage, ChannelStatusMessage,
+                     StartupMessage, CapabilitiesMessage, VersionMessage, SerialNumberMessage)
+
+    def __init__(self):
+        super(MsgCallback, self).__init__()
+        self.inboxes = {}
+        self.routes = {}  # message class -> inboxes it goes to
+        self.types = frozenset()
+        for class_ in self.SUBSCRIPTIONS:
+            self.subscribe(class_)
+
+    def subscribe(self, class_):
+        """Starts keeping messages of `class_`. Returns False if they already were."""
+        with self.lock:
+            if class_ in self.inboxes:
+                return False
+            self.inboxes[class_] = deque(maxlen=self.MAX_QUEUE)
+            self.routes = {}
+            if class_.type is None:
+                self.types = None  # untyped base class, any message may match
+            elif self.types is not None:
+                self.types = self.types | {class_.type}
+            return True
+
+    def process(self, msg):
+        with self.lock:
+            inboxes = self.routes.get(type(msg))
+            if inboxes is None:
+                inboxes = self.routes[type(msg)] = [
+                    inbox for class_, inbox in self.inboxes.items() if isinstance(msg, class_)]
+            if inboxes:
+                for inbox in inboxes:
+                    inbox.append(msg)
+                self.arrived.notify_all()
+
+    def waitFor(self, class_, timeout=10):  # pylint: disable=arguments-differ
+        self.subscribe(class_)
+        deadline = time() + timeout
+        with self.lock:
+            inbox = self.inboxes[class_]
+            while not inbox:
+                remaining = deadline - time()
+                if remaining <= 0:
+                    raise MessageTimeoutError("%s: timeout" % str(class_), internal=class_)
+                self.arrived.wait(remaining)
+            return inbox.popleft()
 
 
 class EventMachine(object):
-    def __init__(self, driver):
+    def __init__(self, driver, dispatchers=0, queueSize=256, overflow=OVERFLOW_DROP_OLDEST,
+                 writeRate=None):
+        """
+        :param driver: The driver to read from and write to
+        :param dispatchers: Number of threads running the callbacks. With 0,
+                callbacks run on the reader thread. Otherwise received frames
+                are copied into a `DispatchQueue` per dispatcher, and all
+                messages for a channel are handled by the same dispatcher.
+        :param queueSize: Data frames each dispatch queue holds
+        :param overflow: What to do with data frames once a queue is full, one
+                of `OVERFLOW_BLOCK`, `OVERFLOW_DROP_NEWEST` or `OVERFLOW_DROP_OLDEST`
+        :param writeRate: Most frames per second the writer thread hands to
+                the driver, None for no limit
+        """
         self.driver = driver
-        self.callbacks = set()
+        self.dispatchers = dispatchers
+        self.queueSize = queueSize
+        self.overflow = overflow
+        self.writeRate = writeRate
+        self.queues = []
+        self.dispatcherThreads = []
+        self.writeQueue = None
+        self.writer = None
+
+        # counters are plain ints updated without locking, see `stats`
+        self.decoder = FrameDecoder()
+        self.frames = [0] * 256  # received frames by message ID
+        self.dispatchTimes = {}  # callback -> histogram of sampled process() times
+        self.subscriptions = {}  # callback -> Subscription
+        self.routes = {}  # (type, channel, page, device type) -> callbacks
+        self.routeByPage = self.routeByDeviceType = False
+        self.rawCallbacks = {}
+        self.channels = [None] * 256  # open channels by number
+        self.wantedTypes = frozenset()
         self.eventPump = None
         self.running = False
 
@@ -141,27 +736,238 @@ class EventMachine(object):
         self.registerCallback(ack)
         self.registerCallback(msg)
 
-    def registerCallback(self, callback):
+    def registerCallback(self, callback, views=False, types=None, channels=None, pages=None,
+                         deviceTypes=None):
+        """Registers `callback` to be handed received messages.
+
+        With `views` set, the callback gets a `MessageView` over the receive
+        buffer instead of a message object; it has to call `materialize` on
+        anything it wants to keep past its `process` call.
+
+        The other arguments restrict the messages passed on to the given
+        message IDs, channel numbers, data pages (first data byte of data
+        messages) and sender device types. Messages that don't carry the
+        property filtered on never match. Without `types`, the callback's
+        own `types` attribute is used.
+        """
+        subscription = Subscription(callback, views, types, channels, pages, deviceTypes)
+        # the subscriptions are replaced rather than modified, so the
+        # dispatchers can read them without holding the lock
         with self.evmCallbackLock:
-            self.callbacks.add(callback)
+            subscriptions = dict(self.subscriptions)
+            subscriptions[callback] = subscription
+            self.subscriptions = subscriptions
+            self._compile()
+
+    def registerRawCallback(self, callback, types=None, channels=None):
+        """Registers `callback` to be called for every received frame as
+        `callback(messageID, channel, payload, rxTime)`, before any message
+        object is built.
+
+        `channel` is None for messages that aren't bound to a channel, and
+        `payload` is a memoryview into the receive buffer that is only valid
+        during the call. `types` and `channels` narrow down the frames passed
+        on; None means all of them.
+        """
+        types = None if types is None else frozenset(types)
+        channels = None if channels is None else frozenset(channels)
+        with self.evmCallbackLock:
+            rawCallbacks = dict(self.rawCallbacks)
+            rawCallbacks[callback] = (types, channels)
+            self.rawCallbacks = rawCallbacks
 
     def removeCallback(self, callback):
         with self.evmCallbackLock:
-            try:
-                self.callbacks.remove(callback)
-            except KeyError:
-                pass
-
-    def writeMessage(self, msg):
-        self.driver.write(msg)
-        return self
+            if callback in self.subscriptions:
+                subscriptions = dict(self.subscriptions)
+                del subscriptions[callback]
+                self.subscriptions = subscriptions
+            if callback in self.rawCallbacks:
+                rawCallbacks = dict(self.rawCallbacks)
+                del rawCallbacks[callback]
+                self.rawCallbacks = rawCallbacks
+            self._compile()
+
+    def registerChannel(self, channel):
+        """Routes every message for `channel.number` to `channel.process`."""
+        with self.evmCallbackLock:
+            self.channels[channel.number] = channel
+            self.routes = {}  # the channel's ID may change device types
 
-    def waitForAck(self, msg):
-        return self.ack.waitFor(msg).messageCode
+    def removeChannel(self, channel):
+        with self.evmCallbackLock:
+            if self.channels[channel.number] is channel:
+                self.channels[channel.number] = None
+                self.routes = {}
+
+    def _compile(self):
+        # union of the types of all subscriptions; None when any of them
+        # wants every message
+        wanted = set()
+        subscriptions = self.subscriptions.values()
+        for subscription in subscriptions:
+            types = subscription.messageTypes
+            if types is None:
+                wanted = None
+                break
+            wanted |= types
+        self.wantedTypes = None if wanted is None else frozenset(wanted)
+        self.routeByPage = any(sub.pages is not None for sub in subscriptions)
+        self.routeByDeviceType = any(sub.deviceTypes is not None for sub in subscriptions)
+        self.routes = {}
+
+    def match(self, type_, channel, page, deviceType):
+        """Returns the object and the view callbacks for a frame with these
+        properties. The pump caches the result in `routes`."""
+        callbacks, viewCallbacks = [], []
+        for subscription in self.subscriptions.values():
+            if subscription.matches(type_, channel, page, deviceType):
+                (viewCallbacks if subscription.views else callbacks).append(subscription.callback)
+        return tuple(callbacks), tuple(viewCallbacks)
+
+    def queueWrite(self, msgs, priority=None):
+        """Queues a message, or a list of messages to go out in one transfer,
+        for the writer thread.
+
+        Returns a future resolved with the bytes written, or failed with the
+        driver's exception; wait on it or ignore it. The frames are encoded
+        right away, so messages and frame templates can be reused as soon as
+        this returns. Data messages are queued with `PRIORITY_DATA` and any
+        other with `PRIORITY_CONTROL`, unless `priority` says otherwise.
+        While the event machine isn't running, the frames are written
+        before returning.
+        """
+        if not isinstance(msgs, (list, tuple)):
+            msgs = (msgs,)
+        if priority is None:
+            priority = PRIORITY_DATA if all(msg.type in DATA_MESSAGE_TYPES for msg in msgs) \
+                else PRIORITY_CONTROL
+        data, ends = encodeFrames(msgs)
+
+        handle = Future()
+        queue = self.writeQueue
+        if queue is None or not queue.put(priority, data, ends, handle):
+            handle.set_running_or_notify_cancel()
+            handle.set_result(self.driver.writeFrames(data, ends))
+        return handle
+
+    def writeMessage(self, msg, future=False):
+        """Writes `msg` to the driver.
+
+        Returns the event machine for chaining `waitForAck`, or with `future`
+        set, a future resolved with the response code once the response with
+        the same channel and message ID arrives. Any number of those can be
+        outstanding at once.
+
+        The write goes through the writer thread. Without `future`, callers
+        other than the event machine's own threads wait until it is done, so
+        driver errors are raised as before; with `future`, they fail the
+        returned future.
+        """
+        if not future:
+            handle = self.queueWrite(msg)
+            if not self._ownThread():
+                handle.result()
+            return self
+
+        future = self.ack.expect(msg)
+        try:
+            handle = self.queueWrite(msg)
+        except Exception:
+            future.cancel()
+            raise
+        self._failOnError(handle, (future,))
+        return future
+
+    def writeMany(self, msgs, future=False):
+        """Writes all of `msgs` in a single transfer, see `writeMessage`.
+
+        Returns the event machine, or with `future` set, one future per
+        message as `writeMessage` would.
+        """
+        msgs = list(msgs)
+        if not future:
+            handle = self.queueWrite(msgs)
+            if not self._ownThread():
+                handle.result()
+            return self
+
+        futures = [self.ack.expect(msg) for msg in msgs]
+        try:
+            handle = self.queueWrite(msgs)
+        except Exception:
+            for future in futures:
+                future.cancel()
+            raise
+        self._failOnError(handle, futures)
+        return futures
+
+    def _failOnError(self, handle, futures):
+        def written(handle):
+            err = handle.exception()
+            if err is not None:
+                for future in futures:
+                    self.ack.fail(future, err)
+        handle.add_done_callback(written)
+
+    def _ownThread(self):
+        thread = current_thread()
+        return thread is self.eventPump or thread in self.dispatcherThreads
+
+    def waitForAck(self, msg, timeout=10):
+        if isinstance(msg, Future):
+            try:
+                return msg.result(timeout)
+            except FutureTimeoutError:
+                msg.cancel()
+                raise MessageTimeoutError("%s: timeout" % str(msg), internal=msg)
+        return self.ack.waitFor(msg, timeout).messageCode
+
+    def subscribeMessages(self, class_):
+        """Starts keeping received messages of `class_` for `waitForMessage`."""
+        msg = self.msg
+        if class_ not in msg.inboxes:
+            with self.evmCallbackLock:
+                msg.subscribe(class_)
+                self._compile()
 
     def waitForMessage(self, class_, timeout=10):
+        """Returns the oldest unclaimed message of `class_` or a subclass.
+
+        Only the replies in `MsgCallback.SUBSCRIPTIONS` are kept from the
+        start. Messages of any other class are kept from the first wait for
+        that class on, and ones arriving earlier are dropped; call
+        `subscribeMessages` before triggering them to avoid missing any.
+        """
+        self.subscribeMessages(class_)
         return self.msg.waitFor(class_, timeout)
 
+    def stats(self):
+        """Returns a snapshot of the event pump counters.
+
+        The counters are updated without locking, so values read while the
+        pump is running may be slightly out of step with each other.
+        """
+        decoder, msg = self.decoder, self.msg
+        queues = self.queueStats()
+        return {
+            'bytesRead': decoder.bytesFed,
+            'frames': dict((type_, count) for type_, count in enumerate(self.frames) if count),
+            'checksumErrors': decoder.checksumErrors,
+            'skippedBytes': decoder.skippedBytes,
+            'dropped': sum(queue['dropped'] for queue in queues),
+            'queues': queues,
+            'writes': self.writeQueue.stats() if self.writeQueue is not None else None,
+            'inboxes': dict([('ack', len(self.ack.messages))] +
+                            [(class_.__name__, len(inbox)) for class_, inbox in list(msg.inboxes.items())]),
+            'dispatchTimes': dict((callback, list(histogram))
+                                  for callback, histogram in list(self.dispatchTimes.items())),
+        }
+
+    def queueStats(self):
+        """Returns the `DispatchQueue.stats` of every dispatcher."""
+        return [queue.stats() for queue in self.queues]
+
     def start(self, name=None, driver=None):
         with self.runningLock:
             if self.running:
@@ -171,6 +977,18 @@ class EventMachine(object):
             if driver is not None:
                 self.driver = driver
             self.driver.open()
+            self.decoder.clear()
+
+            self.queues = [DispatchQueue(self.queueSize, self.overflow)
+                           for _ in range(self.dispatchers)]
+            self.dispatcherThreads = [Thread(name=name, target=Dispatcher, args=(self, queue))
+                                      for queue in self.queues]
+            for dispatcher in self.dispatcherThreads:
+                dispatcher.start()
+
+            self.writeQueue = WriteQueue()
+            self.writer = Thread(name=name, target=Writer, args=(self, self.writeQueue))
+            self.writer.start()
 
             evPump = self.eventPump = Thread(name=name, target=EventPump, args=(self,))
             evPump.start()
@@ -180,5 +998,12 @@ class EventMachine(object):
             if not self.running:
                 return
             self.running = False
+        # frames already queued still go out
+        self.writeQueue.close()
+        self.writer.join()
         self.eventPump.join()
+        for queue in self.queues:
+            queue.close()
+        for dispatcher in self.dispatcherThreads:
+            dispatcher.join()
         self.driver.close()
@@ -26,7 +26,9 @@
 
 from __future__ import division, absolute_import, print_function, unicode_literals
 
-from struct import pack, unpack
+from functools import reduce
+from operator import xor
+from struct import Struct, unpack_from
 
 from six import with_metaclass
 
@@ -35,6 +37,10 @@ from ant.core.constants import MESSAGE_TX_SYNC, RESPONSE_NO_ERROR
 from ant.core.exceptions import MessageError
 
 
+# message id -> `_from_frame` of the class registered for it
+FRAME_DECODERS = [None] * 256
+
+
 class MessageType(type):
 
     def __init__(cls, name, bases, dict_):
@@ -42,6 +48,7 @@ class MessageType(type):
         type_ = cls.type
         if type_ is not None:
             cls.TYPES[type_] = cls
+            FRAME_DECODERS[type_] = cls._from_frame
 
     def __call__(cls, *args, **kwargs):
         if cls.type is not None:
@@ -67,10 +74,100 @@ class MessageType(type):
 
 MSG_HEADER_SIZE = 3
 MSG_FOOTER_SIZE = 1
+FRAME_OVERHEAD = MSG_HEADER_SIZE + MSG_FOOTER_SIZE
+
+
+def frameSize(raw, start, end):
+    """Checks for a frame starting at `raw[start]`, looking no further than `end`.
+
+    Returns the frame's size if it's complete and valid, 0 if it's a frame
+    that hasn't been fully received yet and -1 if there's no frame there.
+    """
+    if raw[start] != MESSAGE_TX_SYNC:
+        return -1
+    if end - start < 2:
+        return 0
+    size = raw[start + 1] + FRAME_OVERHEAD
+    if end - start < size:
+        return 0
+    # no slicing, the decoder must not copy frames it only checks
+    checksum = 0
+    for i in range(start, start + size):
+        checksum ^= raw[i]
+    if checksum:
+        return -1
+    return size
+
+
+class UntypedMessageType(object):
+    """`type` of messages without a class of their own.
+
+    Reads as None on the class, so `MessageType` still tells typed and untyped
+    classes apart, and typed subclasses shadow it with their message id.
+    """
+
+    def __get__(self, msg, cls=None):
+        return None if msg is None else msg._type
+
+    def __set__(self, msg, type_):
+        msg._type = type_
+
+
+class Field(object):
+    """Integer payload field backed by a precompiled `struct.Struct`.
+
+    Values are read and written in place with `unpack_from` and `pack_into`,
+    `offset` being relative to the start of the payload.
+    """
+
+    def __init__(self, offset, format_='B'):
+        self.offset = offset
+        self.struct = Struct(format_)
+        self.name = None
+
+        bits = 8 * self.struct.size
+        if format_[-1].islower():
+            self.min, self.max = -(1 << (bits - 1)), (1 << (bits - 1)) - 1
+        else:
+            self.min, self.max = 0, (1 << bits) - 1
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, msg, cls=None):
+        if msg is None:
+            return self
+        return self.struct.unpack_from(msg._payload, self.offset)[0]
+
+    def __set__(self, msg, value):
+        # pack_into clears the field before it fails, so check beforehand
+        if (value > self.max) or (value < self.min):
+            raise MessageError('Could not set %s. Should be %d to %d but was %s.' %
+                               (self.name, self.min, self.max, value))
+        self.struct.pack_into(msg._payload, self.offset, value)
+
+
+class ByteField(Field):
+    """Single unsigned byte, indexed directly instead of going through struct."""
+
+    def __get__(self, msg, cls=None):
+        if msg is None:
+            return self
+        return msg._payload[self.offset]
+
+    def __set__(self, msg, value):
+        if (value > 0xFF) or (value < 0x00):
+            raise MessageError('Could not set %s. Should be 0 to 255 but was %s.' % (self.name, value))
+        msg._payload[self.offset] = value
+
 
 class Message(with_metaclass(MessageType)):
+    __slots__ = ('_payload', '_type')
+
     TYPES = {}
-    type = None
+    type = UntypedMessageType()
+
+    MAX_PAYLOAD_SIZE = 9
 
     INCOMPLETE = 'incomplete'
     CORRUPTED = 'corrupted'
@@ -85,50 +182,105 @@ class Message(with_metaclass(MessageType)):
         return self._payload
     @payload.setter
     def payload(self, payload):
-        if len(payload) > 9:
+        if len(payload) > self.MAX_PAYLOAD_SIZE:
             raise MessageError('Could not set payload (payload too long).',
                                internal=Message.MALFORMED)
         self._payload = payload
 
     @property
     def checksum(self):
-        checksum = MESSAGE_TX_SYNC ^ len(self._payload) ^ self.type
-        for byte in self._payload:
-            checksum ^= byte
-        return checksum
+        payload = self._payload
+        return reduce(xor, payload, MESSAGE_TX_SYNC ^ len(payload) ^ self.type)
 
     def encode(self):
-        raw, payload = bytearray(len(self)), self._payload
-        raw[0:MSG_HEADER_SIZE-1] = (MESSAGE_TX_SYNC, len(payload), self.type)
-        raw[MSG_HEADER_SIZE:-MSG_FOOTER_SIZE] = payload
-        raw[-1] = self.checksum
+        raw = bytearray(len(self))
+        self.encode_into(raw)
         return raw
 
+    def encode_into(self, buf, offset=0):
+        """Writes the encoded frame into `buf` at `offset`, returns its size."""
+        payload, type_ = self._payload, self.type
+        length = len(payload)
+        end = offset + MSG_HEADER_SIZE + length
+        buf[offset] = MESSAGE_TX_SYNC
+        buf[offset + 1] = length
+        buf[offset + 2] = type_
+        buf[offset + MSG_HEADER_SIZE:end] = payload
+        buf[end] = reduce(xor, payload, MESSAGE_TX_SYNC ^ length ^ type_)
+        return end + MSG_FOOTER_SIZE - offset
+
     @classmethod
     def decode(cls, raw):
-        raw = bytearray(raw)
         if len(raw) < 5:
             raise MessageError('Could not decode. Message length should be >=5 bytes but was %d.' % len(raw),
                                internal=Message.INCOMPLETE)
 
-        sync, length, type_ = raw[:MSG_HEADER_SIZE]
+        sync, length, type_ = raw[0], raw[1], raw[2]
 
         if sync != MESSAGE_TX_SYNC:
             raise MessageError('Could not decode. Expected TX sync but got 0x%.2x.' % sync,
                                internal=Message.CORRUPTED)
-        if len(raw) < (length + MSG_HEADER_SIZE + MSG_FOOTER_SIZE):
+        end = length + MSG_HEADER_SIZE
+        if len(raw) < end + MSG_FOOTER_SIZE:
             raise MessageError('Could not decode. Message length should be %d but was %d.' %
-                               (length + MSG_HEADER_SIZE + MSG_FOOTER_SIZE, len(raw)),
+                               (end + MSG_FOOTER_SIZE, len(raw)),
                                internal=Message.INCOMPLETE)
 
-        msg = Message(type=type_)  # pylint: disable=unexpected-keyword-arg
-        msg.payload = raw[MSG_HEADER_SIZE:length + MSG_HEADER_SIZE]
-
-        if msg.checksum != raw[length + MSG_HEADER_SIZE]:
+        checksum = reduce(xor, raw[:end])
+        if checksum != raw[end]:
             raise MessageError('Could not decode. Checksum should be 0x%.2x but was 0x%.2x.' %
-                               (raw[length + MSG_HEADER_SIZE], msg.checksum),
+                               (raw[end], checksum),
                                internal=Message.CORRUPTED)
 
+        return FRAME_DECODERS[type_](raw, 0, length)
+
+    @classmethod
+    def decode_many(cls, buf, start=0):
+        """Decodes every complete frame in `buf` from `start` on.
+
+        Returns `(messages, consumed, errors)`: the decoded messages, the
+        offset of the first byte that wasn't used (an incomplete frame at the
+        end of `buf` is left there for the next call) and a `MessageError` for
+        every run of bytes that had to be skipped to get back in sync.
+        """
+        if isinstance(buf, memoryview):
+            buf = buf.tobytes()
+
+        messages, errors, end = [], [], len(buf)
+        while start < end:
+            size = frameSize(buf, start, end)
+            if size > 0:
+                messages.append(FRAME_DECODERS[buf[start + 2]](buf, start, size - FRAME_OVERHEAD))
+                start += size
+                continue
+            if size == 0:
+                break
+
+            sync = buf.find(MESSAGE_TX_SYNC, start + 1, end)
+            if sync < 0:
+                sync = end
+            reason = 'bad checksum' if buf[start] == MESSAGE_TX_SYNC else 'no TX sync'
+            errors.append(MessageError('Could not decode. Skipped %d bytes at offset %d (%s).' %
+                                       (sync - start, start, reason),
+                                       internal=Message.CORRUPTED))
+            start = sync
+
+        return messages, start, errors
+
+    @classmethod
+    def _from_frame(cls, raw, start, length):
+        """Builds a message straight from an already validated frame.
+
+        `start` is the offset of the SYNC byte in `raw` and `length` the
+        payload size. Bypasses `MessageType.__call__`, `__init__` and the
+        payload setter.
+        """
+        msg = cls.__new__(cls)
+        start += MSG_HEADER_SIZE
+        payload = raw[start:start + length]
+        msg._payload = payload if isinstance(payload, bytearray) else bytearray(payload)
+        if cls.type is None:
+            msg.type = raw[start - 1]
         return msg
 
     def __len__(self):
@@ -141,21 +293,18 @@ class Message(with_metaclass(MessageType)):
         return rawstr + '>'
 
 
+FRAME_DECODERS[:] = [Message._from_frame] * 256
+
+
 class ChannelMessage(Message):
+    __slots__ = ()
+
+    channelNumber = ByteField(0)
+
     def __init__(self, payload=b'', number=0x00):
         super(ChannelMessage, self).__init__(bytearray(1) + payload)
         self.channelNumber = number
 
-    @property
-    def channelNumber(self):
-        return self._payload[0]
-    @channelNumber.setter
-    def channelNumber(self, number):
-        if (number > 0xFF) or (number < 0x00):
-            raise MessageError('Could not set channel number. Should be 0 to 255 but was %s.' % number)
-
-        self._payload[0] = number
-
     def __str__(self, data=None):
         rawstr = "C(%d)" % self.channelNumber
         if data is not None:
@@ -165,6 +314,7 @@ class ChannelMessage(Message):
 
 # Config messages
 class ChannelUnassignMessage(ChannelMessage):
+    __slots__ = ()
     type = constants.MESSAGE_CHANNEL_UNASSIGN
 
     def __init__(self, number=0x00):
@@ -172,30 +322,23 @@ class ChannelUnassignMessage(ChannelMessage):
 
 
 class ChannelAssignMessage(ChannelMessage):
+    __slots__ = ()
     type = constants.MESSAGE_CHANNEL_ASSIGN
+    channelType = ByteField(1)
+    networkNumber = ByteField(2)
 
     def __init__(self, number=0x00, channelType=0x00, network=0x00):
         super(ChannelAssignMessage, self).__init__(payload=bytearray(2), number=number)
         self.channelType = channelType
         self.networkNumber = network
 
-    @property
-    def channelType(self):
-        return self._payload[1]
-    @channelType.setter
-    def channelType(self, type_):
-        self._payload[1] = type_
-
-    @property
-    def networkNumber(self):
-        return self._payload[2]
-    @networkNumber.setter
-    def networkNumber(self, number):
-        self._payload[2] = number
-
 
 class ChannelIDMessage(ChannelMessage):
+    __slots__ = ()
     type = constants.MESSAGE_CHANNEL_ID
+    deviceNumber = Field(1, '<H')
+    deviceType = ByteField(3)
+    transmissionType = ByteField(4)
 
     def __init__(self, number=0x00, device_number=0x0000, device_type=0x00,
                  trans_type=0x00):
@@ -204,104 +347,58 @@ class ChannelIDMessage(ChannelMessage):
         self.deviceType = device_type
         self.transmissionType = trans_type
 
-    @property
-    def deviceNumber(self):
-        return unpack(b'<H', bytes(self._payload[1:3]))[0]
-    @deviceNumber.setter
-    def deviceNumber(self, device_number):
-        self._payload[1:3] = pack(b'<H', device_number)
-
-    @property
-    def deviceType(self):
-        return self._payload[3]
-    @deviceType.setter
-    def deviceType(self, device_type):
-        self._payload[3] = device_type
-
-    @property
-    def transmissionType(self):
-        return self._payload[4]
-    @transmissionType.setter
-    def transmissionType(self, trans_type):
-        self._payload[4] = trans_type
-
 
 class ChannelPeriodMessage(ChannelMessage):
+    __slots__ = ()
     type = constants.MESSAGE_CHANNEL_PERIOD
+    channelPeriod = Field(1, '<H')
 
     def __init__(self, number=0x00, period=8192):
         super(ChannelPeriodMessage, self).__init__(payload=bytearray(2), number=number)
         self.channelPeriod = period
 
-    @property
-    def channelPeriod(self):
-        return unpack('<H', bytes(self._payload[1:3]))[0]
-    @channelPeriod.setter
-    def channelPeriod(self, period):
-        self._payload[1:3] = pack('<H', period)
-
 
 class ChannelSearchTimeoutMessage(ChannelMessage):
+    __slots__ = ()
     type = constants.MESSAGE_CHANNEL_SEARCH_TIMEOUT
+    timeout = ByteField(1)
 
     def __init__(self, number=0x00, timeout=0xFF):
         super(ChannelSearchTimeoutMessage, self).__init__(payload=bytearray(1),
                                                           number=number)
         self.timeout = timeout
 
-    @property
-    def timeout(self):
-        return self._payload[1]
-    @timeout.setter
-    def timeout(self, timeout):
-        self._payload[1] = timeout
-
 
 class ChannelFrequencyMessage(ChannelMessage):
+    __slots__ = ()
     type = constants.MESSAGE_CHANNEL_FREQUENCY
+    frequency = ByteField(1)
 
     def __init__(self, number=0x00, frequency=66):
         super(ChannelFrequencyMessage, self).__init__(payload=bytearray(1), number=number)
         self.frequency = frequency
 
-    @property
-    def frequency(self):
-        return self._payload[1]
-    @frequency.setter
-    def frequency(self, frequency):
-        self._payload[1] = frequency
-
 
 class ChannelTXPowerMessage(ChannelMessage):
+    __slots__ = ()
     type = constants.MESSAGE_CHANNEL_TX_POWER
+    power = ByteField(1)
 
     def __init__(self, number=0x00, power=0x00):
         super(ChannelTXPowerMessage, self).__init__(payload=bytearray(1), number=number)
         self.power = power
 
-    @property
-    def power(self):
-        return self._payload[1]
-    @power.setter
-    def power(self, power):
-        self._payload[1] = power
-
 
 class NetworkKeyMessage(Message):
+    __slots__ = ()
     type = constants.MESSAGE_NETWORK_KEY
+    number = ByteField(0)
 
     def __init__(self, number=0x00, key=b'\x00' * 8):
         super(NetworkKeyMessage, self).__init__(payload=bytearray(9))
         self.number = number
         self.key = key
 
-    @property
-    def number(self):
-        return self._payload[0]
-    @number.setter
-    def number(self, number):
-        self._payload[0] = number
-
     @property
     def key(self):
         return self._payload[1:]
@@ -310,23 +407,29 @@ class NetworkKeyMessage(Message):
         self._payload[1:] = key
 
 
+class LibConfigMessage(Message):
+    __slots__ = ()
+    type = constants.MESSAGE_LIB_CONFIG
+    flags = ByteField(1)
+
+    def __init__(self, flags=0x00):
+        super(LibConfigMessage, self).__init__(payload=bytearray(2))
+        self.flags = flags
+
+
 class TXPowerMessage(Message):
+    __slots__ = ()
     type = constants.MESSAGE_TX_POWER
+    power = ByteField(1)
 
     def __init__(self, power=0x00):
         super(TXPowerMessage, self).__init__(payload=bytearray(2))
         self.power = power
 
-    @property
-    def power(self):
-        return self._payload[1]
-    @power.setter
-    def power(self, power):
-        self._payload[1] = power
-
 
 # Control messages
 class SystemResetMessage(Message):
+    __slots__ = ()
     type = constants.MESSAGE_SYSTEM_RESET
 
     def __init__(self):
@@ -334,6 +437,7 @@ class SystemResetMessage(Message):
 
 
 class ChannelOpenMessage(ChannelMessage):
+    __slots__ = ()
     type = constants.MESSAGE_CHANNEL_OPEN
 
     def __init__(self, number=0x00):
@@ -341,6 +445,7 @@ class ChannelOpenMessage(ChannelMessage):
 
 
 class ChannelCloseMessage(ChannelMessage):
+    __slots__ = ()
     type = constants.MESSAGE_CHANNEL_CLOSE
 
     def __init__(self, number=0x00):
@@ -348,60 +453,99 @@ class ChannelCloseMessage(ChannelMessage):
 
 
 class ChannelRequestMessage(ChannelMessage):
+    __slots__ = ()
     type = constants.MESSAGE_CHANNEL_REQUEST
+    messageID = ByteField(1)
 
     def __init__(self, number=0x00, messageID=constants.MESSAGE_CHANNEL_STATUS):
         super(ChannelRequestMessage, self).__init__(payload=bytearray(1), number=number)
         self.messageID = messageID
 
-    @property
-    def messageID(self):
-        return self._payload[1]
-    @messageID.setter
-    def messageID(self, messageID):
-        if (messageID > 0xFF) or (messageID < 0x00):
-            raise MessageError('Could not set message ID. Should be 0 to 255 but was %s.' % messageID)
 
-        self._payload[1] = messageID
+# Data messages
+EXTENDED_DATA_OFFSET = 9  # flag byte, right after channel number and data
 
 
-# Data messages
-class ChannelBroadcastDataMessage(ChannelMessage):
-    type = constants.MESSAGE_CHANNEL_BROADCAST_DATA
+class ExtendedData(object):
+    """Flagged extended data appended to a data message by the stick.
 
-    def __init__(self, number=0x00, data=b'\x00' * 7):
-        super(ChannelBroadcastDataMessage, self).__init__(payload=data, number=number)
+    Fields the flag byte doesn't announce are None. `rssi` and `threshold`
+    are in dBm, `rxTimestamp` counts 1/32768 s and rolls over.
+    """
+    __slots__ = ('flags', 'deviceNumber', 'deviceType', 'transType',
+                 'measurementType', 'rssi', 'threshold', 'rxTimestamp')
 
-    @property
-    def data(self):
-        return self._payload[1:9]
+    def __init__(self, raw, start, end):
+        self.flags = flags = raw[start]
+        offset = start + 1
 
+        self.deviceNumber = self.deviceType = self.transType = None
+        if flags & constants.EXT_FLAG_CHANNEL_ID and offset + 4 <= end:
+            self.deviceNumber, self.deviceType, self.transType = unpack_from(b'<HBB', raw, offset)
+            offset += 4
 
-class ChannelAcknowledgedDataMessage(ChannelMessage):
-    type = constants.MESSAGE_CHANNEL_ACKNOWLEDGED_DATA
+        self.measurementType = self.rssi = self.threshold = None
+        if flags & constants.EXT_FLAG_RSSI and offset + 3 <= end:
+            self.measurementType, self.rssi, self.threshold = unpack_from(b'<Bbb', raw, offset)
+            offset += 3
+
+        self.rxTimestamp = None
+        if flags & constants.EXT_FLAG_RX_TIMESTAMP and offset + 2 <= end:
+            self.rxTimestamp = unpack_from(b'<H', raw, offset)[0]
+
+    def __str__(self):
+        return '<ExtendedData: device %s/%s/%s, rssi %s, rx time %s>' % (
+            self.deviceNumber, self.deviceType, self.transType, self.rssi, self.rxTimestamp)
+
+
+class ChannelDataMessage(ChannelMessage):
+    __slots__ = ()
+
+    # flag byte + channel ID + RSSI + RX timestamp
+    MAX_PAYLOAD_SIZE = EXTENDED_DATA_OFFSET + 1 + 4 + 3 + 2
 
     def __init__(self, number=0x00, data=b'\x00' * 7):
-        super(ChannelAcknowledgedDataMessage, self).__init__(payload=data, number=number)
+        super(ChannelDataMessage, self).__init__(payload=data, number=number)
 
     @property
     def data(self):
-        return self._payload[1:9]
+        return self._payload[1:EXTENDED_DATA_OFFSET]
+
+    @property
+    def extended(self):
+        """The message's `ExtendedData`, or None if the stick didn't add any."""
+        payload = self._payload
+        if len(payload) <= EXTENDED_DATA_OFFSET:
+            return None
+        return ExtendedData(payload, EXTENDED_DATA_OFFSET, len(payload))
+
+
+class ChannelBroadcastDataMessage(ChannelDataMessage):
+    __slots__ = ()
+    type = constants.MESSAGE_CHANNEL_BROADCAST_DATA
+
 
+class ChannelAcknowledgedDataMessage(ChannelDataMessage):
+    __slots__ = ()
+    type = constants.MESSAGE_CHANNEL_ACKNOWLEDGED_DATA
 
-class ChannelBurstDataMessage(ChannelMessage):
+
+class ChannelBurstDataMessage(ChannelDataMessage):
+    __slots__ = ()
     type = constants.MESSAGE_CHANNEL_BURST_DATA
 
-    def __init__(self, number=0x00, data=b'\x00' * 7):
-        super(ChannelBurstDataMessage, self).__init__(payload=data, number=number)
 
-    @property
-    def data(self):
-        return self._payload[1:9]
+DATA_MESSAGE_TYPES = frozenset((constants.MESSAGE_CHANNEL_BROADCAST_DATA,
+                                constants.MESSAGE_CHANNEL_ACKNOWLEDGED_DATA,
+                                constants.MESSAGE_CHANNEL_BURST_DATA))
 
 
 # Channel event messages
 class ChannelEventResponseMessage(ChannelMessage):
+    __slots__ = ()
     type = constants.MESSAGE_CHANNEL_EVENT
+    messageID = ByteField(1)
+    messageCode = ByteField(2)
 
     def __init__(self, number=0x00, message_id=0x00, message_code=0x00):
         super(ChannelEventResponseMessage, self).__init__(payload=bytearray(2),
@@ -409,26 +553,6 @@ class ChannelEventResponseMessage(ChannelMessage):
         self.messageID = message_id
         self.messageCode = message_code
 
-    @property
-    def messageID(self):
-        return self._payload[1]
-    @messageID.setter
-    def messageID(self, message_id):
-        if (message_id > 0xFF) or (message_id < 0x00):
-            raise MessageError('Could not set message ID. Should be 0 to 255 but was %s.' % message_id)
-
-        self._payload[1] = message_id
-
-    @property
-    def messageCode(self):
-        return self._payload[2]
-    @messageCode.setter
-    def messageCode(self, message_code):
-        if (message_code > 0xFF) or (message_code < 0x00):
-            raise MessageError('Could not set message code. Should be 0 to 255 but was %s.' % message_code)
-
-        self._payload[2] = message_code
-
     def __str__(self):  # pylint: disable=W0221
         msgCode = self.messageCode
         if self.messageID != 1:
@@ -441,24 +565,17 @@ class ChannelEventResponseMessage(ChannelMessage):
 
 # Requested response messages
 class ChannelStatusMessage(ChannelMessage):
+    __slots__ = ()
     type = constants.MESSAGE_CHANNEL_STATUS
+    status = ByteField(1)
 
     def __init__(self, number=0x00, status=0x00):
         super(ChannelStatusMessage, self).__init__(payload=bytearray(1), number=number)
         self.status = status
 
-    @property
-    def status(self):
-        return self._payload[1]
-    @status.setter
-    def status(self, status):
-        if (status > 0xFF) or (status < 0x00):
-            raise MessageError('Could not set channel status. Should be 0 to 255 but was %s.' % status)
-
-        self._payload[1] = status
-
 
 class VersionMessage(Message):
+    __slots__ = ()
     type = constants.MESSAGE_VERSION
 
     def __init__(self, version=b'\x00' * 9):
@@ -477,24 +594,23 @@ class VersionMessage(Message):
 
 
 class StartupMessage(Message):
+    __slots__ = ()
     type = constants.MESSAGE_STARTUP
+    startupMessage = ByteField(0)
 
     def __init__(self, startupMessage=0x00):
         super(StartupMessage, self).__init__(payload=bytearray(1))
         self.startupMessage = startupMessage
 
-    @property
-    def startupMessage(self):
-        return self._payload[0]
-    @startupMessage.setter
-    def startupMessage(self, startupMessage):
-        if (startupMessage > 0xFF) or (startupMessage < 0x00):
-            raise MessageError('Could not set start-up message. Should be 0 to 255 but was %s.' % startupMessage)
-        self._payload[0] = startupMessage
-
 
 class CapabilitiesMessage(Message):
+    __slots__ = ()
     type = constants.MESSAGE_CAPABILITIES
+    maxChannels = ByteField(0)
+    maxNetworks = ByteField(1)
+    stdOptions = ByteField(2)
+    advOptions = ByteField(3)
+
     def __init__(self, max_channels=0x00, max_nets=0x00, std_opts=0x00,
                  adv_opts=0x00, adv_opts2=0x00):
         super(CapabilitiesMessage, self).__init__(payload=bytearray(4))
@@ -505,42 +621,6 @@ class CapabilitiesMessage(Message):
         if adv_opts2 is not None:
             self.advOptions2 = adv_opts2
 
-    @property
-    def maxChannels(self):
-        return self._payload[0]
-    @maxChannels.setter
-    def maxChannels(self, num):
-        if (num > 0xFF) or (num < 0x00):
-            raise MessageError('Could not set max channels. Should be 0 to 255 but was %s.' % num)
-        self._payload[0] = num
-
-    @property
-    def maxNetworks(self):
-        return self._payload[1]
-    @maxNetworks.setter
-    def maxNetworks(self, num):
-        if (num > 0xFF) or (num < 0x00):
-            raise MessageError('Could not set max networks. Should be 0 to 255 but was %s.' % num)
-        self._payload[1] = num
-
-    @property
-    def stdOptions(self):
-        return self._payload[2]
-    @stdOptions.setter
-    def stdOptions(self, num):
-        if (num > 0xFF) or (num < 0x00):
-            raise MessageError('Could not set std options. Should be 0 to 255 but was %s.' % num)
-        self._payload[2] = num
-
-    @property
-    def advOptions(self):
-        return self._payload[3]
-    @advOptions.setter
-    def advOptions(self, num):
-        if (num > 0xFF) or (num < 0x00):
-            raise MessageError('Could not set adv options. Should be 0 to 255 but was %s.' % num)
-        self._payload[3] = num
-
     @property
     def advOptions2(self):
         return self._payload[4] if len(self._payload) == 5 else 0x00
@@ -554,6 +634,7 @@ class CapabilitiesMessage(Message):
 
 
 class SerialNumberMessage(Message):
+    __slots__ = ()
     type = constants.MESSAGE_SERIAL_NUMBER
 
     def __init__(self, serial=b'\x00' * 4):
@@ -569,3 +650,164 @@ class SerialNumberMessage(Message):
             raise MessageError('Could not set serial number (expected 4 bytes).')
 
         self.payload = bytearray(serial)
+
+
+# message IDs whose first payload byte is a channel number
+CHANNEL_MESSAGE_TYPES = frozenset(type_ for type_, class_ in Message.TYPES.items()
+                                  if issubclass(class_, ChannelMessage))
+
+
+class FrameTemplate(object):
+    """Pre-encoded data frame for one channel and message type.
+
+    Meant for transmitters that send the same kind of frame over and over:
+    only the 8 data bytes get patched and the checksum is updated along with
+    them, so sending doesn't allocate. Quacks enough like a message to be
+    handed to `Node.send` or `Driver.write`, which send the template's own
+    buffer.
+    """
+    __slots__ = ('frame', 'type')
+
+    DATA_OFFSET = MSG_HEADER_SIZE + 1
+    DATA_SIZE = 8
+
+    def __init__(self, class_=None, number=0x00, data=b'\x00' * 8):
+        if class_ is None:
+            class_ = ChannelBroadcastDataMessage
+        self.type = class_.type
+        self.frame = class_(number=number, data=data).encode()
+
+    def __len__(self):
+        return len(self.frame)
+
+    def __getitem__(self, index):
+        if not 0 <= index < self.DATA_SIZE:
+            raise IndexError('Data index out of range.')
+        return self.frame[self.DATA_OFFSET + index]
+
+    def __setitem__(self, index, value):
+        if not 0 <= index < self.DATA_SIZE:
+            raise IndexError('Data index out of range.')
+        frame, index = self.frame, self.DATA_OFFSET + index
+        previous = frame[index]
+        frame[index] = value
+        frame[-1] ^= previous ^ value
+
+    @property
+    def channelNumber(self):
+        return self.frame[MSG_HEADER_SIZE]
+    @channelNumber.setter
+    def channelNumber(self, number):
+        frame = self.frame
+        previous = frame[MSG_HEADER_SIZE]
+        frame[MSG_HEADER_SIZE] = number
+        frame[-1] ^= previous ^ number
+
+    @property
+    def data(self):
+        start = self.DATA_OFFSET
+        return self.frame[start:start + self.DATA_SIZE]
+    @data.setter
+    def data(self, data):
+        for index in range(self.DATA_SIZE):
+            self[index] = data[index]
+
+    def pack(self, struct_, *values):
+        """Packs `values` into the data bytes with the precompiled `struct_`."""
+        frame = self.frame
+        checksum = frame[-1]
+        start = self.DATA_OFFSET
+        end = start + self.DATA_SIZE
+        for index in range(start, end):
+            checksum ^= frame[index]
+        try:
+            struct_.pack_into(frame, start, *values)
+        except Exception:
+            # pack_into may have written some bytes before failing
+            checksum = 0
+            for index in range(len(frame) - 1):
+                checksum ^= frame[index]
+            frame[-1] = checksum
+            raise
+        for index in range(start, end):
+            checksum ^= frame[index]
+        frame[-1] = checksum
+
+    def encode(self):
+        return self.frame
+
+    def encode_into(self, buf, offset=0):
+        frame = self.frame
+        size = len(frame)
+        buf[offset:offset + size] = frame
+        return size
+
+    def __str__(self):
+        return '<FrameTemplate %s: C(%d)>' % (Message.TYPES[self.type].__name__, self.channelNumber)
+
+
+class MessageView(object):
+    """Lazily decoded view of a frame that still sits in the receive buffer.
+
+    Fields are read straight from the buffer on access. A view is only valid
+    while the frame is being dispatched; call `materialize` to get a regular
+    message that can be kept around.
+    """
+    __slots__ = ('_raw', '_start', '_message')
+
+    def __init__(self, raw, start):
+        self._raw = raw
+        self._start = start
+        self._message = None
+
+    @property
+    def type(self):
+        return self._raw[self._start + 2]
+
+    @property
+    def payload(self):
+        start = self._start + MSG_HEADER_SIZE
+        return memoryview(self._raw)[start:start + self._raw[self._start + 1]]
+
+    @property
+    def channelNumber(self):
+        return self._raw[self._start + MSG_HEADER_SIZE]
+
+    @property
+    def data(self):
+        start = self._start + MSG_HEADER_SIZE + 1
+        return self._raw[start:start + 8]
+
+    @property
+    def deviceNumber(self):
+        """From a channel ID message or the channel ID extension of a data
+        message, None for frames that carry neither."""
+        if self.type == constants.MESSAGE_CHANNEL_ID:
+            return unpack_from(b'<H', self._raw, self._start + MSG_HEADER_SIZE + 1)[0]
+        extended = self.extended
+        return None if extended is None else extended.deviceNumber
+
+    @property
+    def extended(self):
+        raw, start = self._raw, self._start
+        length = raw[start + 1]
+        if length <= EXTENDED_DATA_OFFSET or raw[start + 2] not in DATA_MESSAGE_TYPES:
+            return None
+        start += MSG_HEADER_SIZE
+        return ExtendedData(raw, start + EXTENDED_DATA_OFFSET, start + length)
+
+    def materialize(self):
+        msg = self._message
+        if msg is None:
+            raw, start = self._raw, self._start
+            msg = self._message = FRAME_DECODERS[raw[start + 2]](raw, start, raw[start + 1])
+        return msg
+
+    def __getattr__(self, name):
+        return getattr(self.materialize(), name)
+
+    def __len__(self):
+        return self._raw[self._start + 1] + MSG_HEADER_SIZE + MSG_FOOTER_SIZE
+
+    def __str__(self):
+        return str(self.materialize())
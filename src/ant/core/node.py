@@ -31,7 +31,8 @@ from threading import Lock
 
 from ant.core import event, message
 from ant.core.constants import *
-from ant.core.exceptions import ChannelError, MessageError, NodeError, ANTException
+from ant.core.exceptions import ChannelError, MessageError, MessageTimeoutError, NodeError, \
+        ANTException
 from ant.core.message import ChannelMessage
 
 import usb.core
@@ -59,6 +60,37 @@ class ChannelID(object):
                 (self.deviceNumber, self.deviceType, self.transmissionType)
 
 
+def configureSteps(channel, network, channelType, id, frequency, period, searchTimeout,
+                   open):  # pylint: disable=redefined-builtin
+    """Returns the `(step name, message)` pairs that set up `channel`."""
+    if searchTimeout is not None and ((searchTimeout > 0xFF) or (searchTimeout < 0x00)):
+        raise ChannelError('%s: search timeout must be between 0 and 255, was %s' % (channel, searchTimeout))
+
+    number = channel.number
+    steps = [
+        ('assign', message.ChannelAssignMessage(number, channelType, network.number)),
+        ('set ID', message.ChannelIDMessage(number, id.deviceNumber, id.deviceType,
+                                            id.transmissionType)),
+        ('set frequency', message.ChannelFrequencyMessage(number, frequency)),
+        ('set period', message.ChannelPeriodMessage(number, period)),
+    ]
+    if searchTimeout is not None:
+        steps.append(('set search timeout', message.ChannelSearchTimeoutMessage(number, searchTimeout)))
+    if open:
+        steps.append(('open', message.ChannelOpenMessage(number=number)))
+    return steps
+
+
+def checkConfigured(channel, steps, responses):
+    """Raises `ChannelError` for the first step whose response (None on
+    timeout) isn't RESPONSE_NO_ERROR."""
+    for (step, _), response in zip(steps, responses):
+        if response is None:
+            raise ChannelError('%s: could not %s (timeout).' % (str(channel), step))
+        if response != RESPONSE_NO_ERROR:
+            raise ChannelError('%s: could not %s (%.2x).' % (str(channel), step, response))
+
+
 class Channel(event.EventCallback):
     def __init__(self, node, number=0):
         self.node = node
@@ -72,6 +104,8 @@ class Channel(event.EventCallback):
         self._searchTimeout = None
         self._period = None
         self._frequency = None
+        self._lastData = None
+        self.duplicatesSuppressed = 0
 
     def assign(self, network, channelType):
         msg = message.ChannelAssignMessage(self.number, channelType, network.number)
@@ -130,7 +164,43 @@ class Channel(event.EventCallback):
         if response != RESPONSE_NO_ERROR:
             raise ChannelError('%s: could not open (%.2x).' % (str(self), response))
 
-        evm.registerCallback(self)
+        self._forgetData()
+        evm.registerChannel(self)
+
+    def configure(self, network, channelType, id, frequency, period, searchTimeout,
+                  open=True):  # pylint: disable=redefined-builtin
+        """Assigns the channel, sets its ID, frequency, period and search
+        timeout, and opens it unless `open` is False.
+
+        All commands are written in a single transfer and their responses
+        checked afterwards. `id` is a `ChannelID`; a `searchTimeout` of None
+        leaves the timeout alone. Raises `ChannelError` naming the first step that
+        failed.
+        """
+        steps = configureSteps(self, network, channelType, id, frequency, period,
+                               searchTimeout, open)
+        evm = self.node.evm
+        futures = evm.writeMany([msg for _, msg in steps], future=True)
+
+        # collect every response, so none is left over for a later waitForAck
+        responses = []
+        for future in futures:
+            try:
+                responses.append(evm.waitForAck(future))
+            except MessageTimeoutError:
+                responses.append(None)
+        checkConfigured(self, steps, responses)
+
+        self.type = channelType
+        self.network = network
+        self.id = ChannelID(id.deviceNumber, id.deviceType, id.transmissionType)
+        self._frequency = frequency
+        self._period = period
+        if searchTimeout is not None:
+            self._searchTimeout = searchTimeout
+        self._forgetData()
+        if open:
+            evm.registerChannel(self)
 
     def close(self):
         msg = message.ChannelCloseMessage(number=self.number)
@@ -145,10 +215,11 @@ class Channel(event.EventCallback):
                msg.messageCode == EVENT_CHANNEL_CLOSED:
                 break
 
-        evm.removeCallback(self)
+        evm.removeChannel(self)
+        self._forgetData()
 
     def send(self, msg):
-        """Sends `msg` on this channel."""
+        """Sends `msg` on this channel, see `Node.send`."""
         msg.channelNumber = self.number
         return self.node.send(msg)
 
@@ -166,11 +237,30 @@ class Channel(event.EventCallback):
     def process(self, msg):
         with self.evmCallbackLock:
             if isinstance(msg, ChannelMessage) and msg.channelNumber == self.number:
+                duplicate = False
+                if msg.type == MESSAGE_CHANNEL_BROADCAST_DATA:
+                    # Sensors rebroadcast an unchanged page every period;
+                    # callbacks with `suppressDuplicates` set only see changes.
+                    data = msg.data
+                    duplicate = data == self._lastData
+                    self._lastData = data
+
+                suppressed = False
                 for callback in self.callbacks:
+                    if duplicate and getattr(callback, 'suppressDuplicates', False):
+                        suppressed = True
+                        continue
                     try:
                         callback.process(msg, self)
                     except Exception as err:  # pylint: disable=broad-except
                         print(err)
+                if suppressed:
+                    self.duplicatesSuppressed += 1
+
+    def _forgetData(self):
+        # a new session's first page is never a duplicate
+        with self.evmCallbackLock:
+            self._lastData = None
 
     def __str__(self):
         rawstr = '<channel %d' % self.number
@@ -181,8 +271,20 @@ class Channel(event.EventCallback):
 
 
 class Node(object):
-    def __init__(self, driver, name=None):
-        self.evm = event.EventMachine(driver)
+    def __init__(self, driver, name=None, dispatchers=0, queueSize=256,
+                 overflow=event.OVERFLOW_DROP_OLDEST, writeRate=None):
+        """
+        :param driver: The driver of the ANT device
+        :param dispatchers: Number of threads running the callbacks, 0 to run
+                them on the reader thread. See `EventMachine`.
+        :param queueSize: Data frames each dispatcher queues
+        :param overflow: What to do with data frames once a dispatcher's queue
+                is full, one of the `event.OVERFLOW_*` policies
+        :param writeRate: Most frames per second written to the device, None
+                for no limit
+        """
+        self.evm = event.EventMachine(driver, dispatchers=dispatchers, queueSize=queueSize,
+                                      overflow=overflow, writeRate=writeRate)
         self.name = name
         self.networks = []
         self.channels = []
@@ -233,8 +335,24 @@ class Node(object):
             pass
 
     def send(self, msg):
-        """Sends `msg` to the ANT device"""
-        return self.evm.writeMessage(msg)
+        """Queues `msg` for the ANT device. Returns a future that is resolved
+        once it has been written; waiting on it is optional.
+
+        It no longer returns the event machine, so chain `waitForAck` on
+        `evm.writeMessage(msg)` instead of `send(msg)`."""
+        return self.evm.queueWrite(msg)
+
+    def sendMany(self, msgs):
+        """Queues all of `msgs` to go out in a single transfer, see `send`."""
+        return self.evm.queueWrite(list(msgs))
+
+    def stats(self):
+        """Returns the counters of `EventMachine.stats`, plus the broadcasts
+        the channels suppressed as duplicates."""
+        stats = self.evm.stats()
+        stats['duplicatesSuppressed'] = sum(channel.duplicatesSuppressed
+                                            for channel in self.channels)
+        return stats
 
     def getCapabilities(self):
         return len(self.channels), len(self.networks), self.options
@@ -253,11 +371,26 @@ class Node(object):
 
         network.number = number
 
+    def enableExtendedMessages(self, channelId=True, rssi=False, rxTimestamp=False):
+        """Makes the stick append flagged extended data to received data messages.
+
+        The extra fields show up in the messages' `extended` attribute, which
+        lets a single wildcard channel tell transmitters apart.
+        """
+        flags = (EXT_FLAG_CHANNEL_ID if channelId else 0) | \
+                (EXT_FLAG_RSSI if rssi else 0) | \
+                (EXT_FLAG_RX_TIMESTAMP if rxTimestamp else 0)
+        msg = message.LibConfigMessage(flags)
+        response = self.evm.writeMessage(msg).waitForAck(msg)
+        if response != RESPONSE_NO_ERROR:
+            raise NodeError('Could not enable extended messages (0x%.2x).' % response)
+
     def getFreeChannel(self):
         for channel in self.channels:
             if channel.network is None:
                 return channel
         raise NodeError('Could not find free channel.')
 
-    def registerEventListener(self, callback):
-        self.evm.registerCallback(callback)
+    def registerEventListener(self, callback, **filters):
+        """Registers `callback`; see `EventMachine.registerCallback` for `filters`."""
+        self.evm.registerCallback(callback, **filters)
@@ -3,6 +3,7 @@
 # https://github.com/dhague/vpower
 
 import sys
+from struct import Struct
 from ant.core import message, node, driver
 from ant.core.constants import *
 from ant.core.exceptions import ChannelError
@@ -11,6 +12,7 @@ from constants import *
 from config import NETKEY, VPOWER_DEBUG
 
 CHANNEL_PERIOD = 8182
+POWER_ONLY_PAGE = Struct('<BBBBHH')
 
 # Transmitter for Bicycle Power ANT+ sensor
 
@@ -30,13 +32,13 @@ class PowerMeterTx(object):
         try:
             self.channel.name = 'C:POWER'
             network = node.Network(NETKEY, 'N:ANT+')
-            self.channel.assign(network, CHANNEL_TYPE_TWOWAY_TRANSMIT)
-            self.channel.setID(POWER_DEVICE_TYPE, sensor_id, 0)
-            self.channel.period = CHANNEL_PERIOD
-            self.channel.frequency = 57
+            self.channel.configure(network, CHANNEL_TYPE_TWOWAY_TRANSMIT,
+                                   node.ChannelID(sensor_id, POWER_DEVICE_TYPE, 0),
+                                   57, CHANNEL_PERIOD, None, open=False)
         except ChannelError as e:
             print("Channel config error: " + repr(e))
         self.powerData = PowerMeterTx.PowerData()
+        self.frame = message.FrameTemplate(message.ChannelBroadcastDataMessage, self.channel.number)
 
     def open(self):
         self.channel.open()
@@ -48,7 +50,7 @@ class PowerMeterTx(object):
         self.channel.unassign()
 
     # Power was updated, so send out an ANT+ message
-    def update(self, power, cadence):
+    def update(self, power, cadence, send=True):
 
         if cadence > 254:
            cadence = 90
@@ -67,20 +69,13 @@ class PowerMeterTx(object):
            if VPOWER_DEBUG: print ('cumulativePower ', self.powerData.cumulativePower)
            self.powerData.instantaneousPower = int(power)
            if VPOWER_DEBUG: print ('instantaneousPower ', self.powerData.instantaneousPower)
-           myPayload = [0x10]  # standard power-only message
-           myPayload.append(myEventCount)
-           myPayload.append(0xFF)     # Pedal power not used
-           myPayload.append(cadence)  # Cadence ??
-           myPayload.append(self.powerData.cumulativePower & 0xff)
-           myPayload.append(self.powerData.cumulativePower >> 8)
-           myPayload.append(self.powerData.instantaneousPower & 0xff)
-           myPayload.append(self.powerData.instantaneousPower >> 8)
-           payload = bytearray(myPayload)
-           ant_msg = message.ChannelBroadcastDataMessage(self.channel.number, data=payload)
-
-           # print("PowerMeter: " +str(payload))
+           # standard power-only message, pedal power not used
+           self.frame.pack(POWER_ONLY_PAGE, 0x10, myEventCount, 0xFF, cadence,
+                           self.powerData.cumulativePower,
+                           self.powerData.instantaneousPower & 0xffff)
 
            if VPOWER_DEBUG: print ('Write message to ANT stick on channel ' + repr(self.channel.number))
-           self.antnode.send(ant_msg)
+           if send:
+               self.antnode.send(self.frame)
         except Exception as e:
                print ("Exception in PowerMeterTX: "+repr(e))
@@ -65,8 +65,10 @@ def Rower(elapsedTime, distanceTraveled, msSecSpeed, kmhSpeed, cadence, power):
 
     print("INPUT --- Speed Km/h {} Cadence {} Power {}".format(str(kmhSpeed), str(cadence), str(power)))
 
-    speed_meter.update(1+(msSecSpeed*SPEED_ADJUST))
-    power_meter.update(int(power*POWER_ADJUST), int(cadence*RPM_ADJUST))
+    speed_meter.update(1+(msSecSpeed*SPEED_ADJUST), send=False)
+    power_meter.update(int(power*POWER_ADJUST), int(cadence*RPM_ADJUST), send=False)
+    # both frames go out in one USB transfer
+    antnode.sendMany([speed_meter.frame, power_meter.frame])
 
 #-------------------------------------------------#
 #  Initialization                                 #
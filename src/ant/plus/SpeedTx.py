@@ -3,6 +3,7 @@
 
 import sys
 import time
+from struct import Struct
 from ant.core import message, node, driver
 from ant.core.constants import *
 from ant.core.exceptions import ChannelError
@@ -11,6 +12,7 @@ from constants import *
 from config import NETKEY, VPOWER_DEBUG
 
 CHANNEL_PERIOD = 8118
+SPEED_PAGE = Struct('<BBBBHH')
 
 # Transmitter for Bicycle Speed ANT+ sensor
 class SpeedTx(object):
@@ -30,14 +32,14 @@ class SpeedTx(object):
         try:
             self.channel.name = 'C:SPEED'
             network = node.Network(NETKEY, 'N:ANT+')
-            self.channel.assign(network, CHANNEL_TYPE_TWOWAY_TRANSMIT)
-            self.channel.setID(SPEED_DEVICE_TYPE, sensor_id, 0)
-            self.channel.period = CHANNEL_PERIOD
-            self.channel.frequency = 57
+            self.channel.configure(network, CHANNEL_TYPE_TWOWAY_TRANSMIT,
+                                   node.ChannelID(sensor_id, SPEED_DEVICE_TYPE, 0),
+                                   57, CHANNEL_PERIOD, None, open=False)
         except ChannelError as e:
             print ("Channel config error: "+e.message)
 
         self.speedData = SpeedTx.SpeedData()
+        self.frame = message.FrameTemplate(message.ChannelBroadcastDataMessage, self.channel.number)
 
     def open(self):
         self.channel.open()
@@ -48,7 +50,7 @@ class SpeedTx(object):
     def unassign(self):
         self.channel.unassign()
 
-    def update(self, myWheel, mySpeed):
+    def update(self, myWheel, mySpeed, send=True):
 
 	# input mySpeed must be millimeters/sec
 	# Then how much time a wheel rotation ?
@@ -71,32 +73,16 @@ class SpeedTx(object):
 
         self.speedData.totalRevolutions += 1
 
-        # payloads
-
-        myP4 = (antSlot & 0xff)
-        myP5 = (antSlot >> 8)
-        myP6 = (self.speedData.totalRevolutions & 0xff)
-        myP7 = (self.speedData.totalRevolutions >> 8)
-
         try:
 
            self.speedData.eventCount = (self.speedData.eventCount + 1) & 0xff
-           myPayload = [0x00]
 #
-#   3 byte reserved and set to FF
+#   page 0, 3 byte reserved and set to FF, event time and revolution count
 #
-           myPayload.append(0xff)
-           myPayload.append(0xff)
-           myPayload.append(0xff)
-
-           myPayload.append(myP4)
-           myPayload.append(myP5)
-           myPayload.append(myP6)
-           myPayload.append(myP7)
-
-           payload = bytearray(myPayload)
-           ant_msg = message.ChannelBroadcastDataMessage(self.channel.number, data=payload)
-           self.antnode.send(ant_msg)
+           self.frame.pack(SPEED_PAGE, 0x00, 0xff, 0xff, 0xff, antSlot & 0xffff,
+                           self.speedData.totalRevolutions & 0xffff)
+           if send:
+               self.antnode.send(self.frame)
 
         except Exception as e:
                print ("Exception in SpeedTX: "+repr(e))
@@ -11,8 +11,8 @@ class bikeTrainer(DeviceProfile):
     name = 'Stationary Bike'
 
 
-    def __init__(self, node, network, callbacks=None):
-        super(bikeTrainer, self).__init__(node, network, callbacks)
+    def __init__(self, node, network, callbacks=None, executor=None):
+        super(bikeTrainer, self).__init__(node, network, callbacks, executor)
 
         self.page16 = genericFEC()
         self._elapsedTime = 0.0
@@ -44,7 +44,7 @@ class bikeTrainer(DeviceProfile):
                    self._power = 0.0
                    self._cadence = 0
 
-            callback = self.callbacks.get('onBikeTrainer')
-            if callback:
-                callback(self._elapsedTime, self._distanceTraveled, self._instantaneousSpeed, self._kmSpeed, self._cadence, self._power)
+            values = (self._elapsedTime, self._distanceTraveled, self._instantaneousSpeed, self._kmSpeed, self._cadence, self._power)
+
+        self.notify('onBikeTrainer', *values)
 
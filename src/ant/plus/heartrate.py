@@ -39,7 +39,7 @@ class HeartRate(DeviceProfile):
     deviceType = 0x78
     name = 'Heart Rate'
 
-    def __init__(self, node, network, callbacks=None):
+    def __init__(self, node, network, callbacks=None, executor=None):
         """
         :param node: The ANT node to use
         :param network: The ANT network to connect on
@@ -47,8 +47,9 @@ class HeartRate(DeviceProfile):
                 use for each event. In addition to the events supported by `DeviceProfile`,
                 `HeartRate` also has the following:
                 'onHeartRateData'
+        :param executor: See `DeviceProfile`
         """
-        super(HeartRate, self).__init__(node, network, callbacks)
+        super(HeartRate, self).__init__(node, network, callbacks, executor)
 
         self._computed_heart_rate = None
         self._previous_beat_count = 0
@@ -112,9 +113,9 @@ class HeartRate(DeviceProfile):
             self._previous_event_time = event_time
             self._accumulated_event_time += float(self.event_time_correction(time_difference)) / 1000
 
-            callback = self.callbacks.get('onHeartRateData')
-            if callback:
-                callback(self._computed_heart_rate, self._accumulated_event_time, rr_interval)
+            values = (self._computed_heart_rate, self._accumulated_event_time, rr_interval)
+
+        self.notify('onHeartRateData', *values)
 
     @property
     def computed_heart_rate(self):
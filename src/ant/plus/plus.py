@@ -28,6 +28,7 @@
 ##############################################################################
 
 from __future__ import print_function
+from collections import deque
 from threading import Lock
 from enum import Enum
 
@@ -49,8 +50,9 @@ class DeviceProfile(object):
     channelPeriod = 0   # Subclasses should override
     deviceType = 0      # Subclasses should override
     name = 'Ant Device'
+    suppressDuplicates = False  # Set to skip broadcast pages identical to the previous one
 
-    def __init__(self, node, network, callbacks=None):
+    def __init__(self, node, network, callbacks=None, executor=None):
         """
         :param node: The ANT node to use
         :param network: The ANT network to connect on
@@ -59,14 +61,21 @@ class DeviceProfile(object):
                 'onDevicePaired'
                 'onSearchTimeout'
                 'onChannelClosed'
+        :param executor: Optional `concurrent.futures.Executor` to run the callbacks on,
+                so the thread receiving messages never waits for them. Callbacks of one
+                profile still run one at a time, in the order of the events.
         """
         self.node = node
         self.network = network
         self.callbacks = callbacks if callbacks is not None else {}
+        self.executor = executor
         self.channel = None
         self.lock = Lock()
         self.state = ChannelState.CLOSED
         self._detected = False
+        self._pending = deque()
+        self._pendingLock = Lock()
+        self._draining = False
 
     def open(self, channelId=None, searchTimeout=30):
         """Pairs with a device and opens a channel for communicating.
@@ -79,24 +88,57 @@ class DeviceProfile(object):
                 `ant.node.ChannelID` to pair with a specific device.
         :param searchTimeout: Time to allow for searching, in seconds.
         """
-        deviceNumber = 0 if channelId is None else channelId.deviceNumber
-        deviceType = self.deviceType if channelId is None else channelId.deviceType
-        transmissionType = 0 if channelId is None else channelId.transmissionType
+        if channelId is None:
+            channelId = ChannelID(0, self.deviceType, 0)
 
         self.channel = self.node.getFreeChannel()
         self.channel.registerCallback(self)
-        self.channel.assign(self.network, CHANNEL_TYPE_TWOWAY_RECEIVE)
-        self.channel.setID(deviceType, deviceNumber, transmissionType)
-        self.channel.frequency = self.channelFrequency
-        self.channel.period = self.channelPeriod
-        self.channel.searchTimeout = int(searchTimeout / 2.5)  # ANT spec says each count is equivalent to 2.5 seconds.
-
-        self.channel.open()
+        self.channel.configure(self.network, CHANNEL_TYPE_TWOWAY_RECEIVE, channelId,
+                               self.channelFrequency, self.channelPeriod,
+                               int(searchTimeout / 2.5))  # ANT spec says each count is equivalent to 2.5 seconds.
         self.state = ChannelState.SEARCHING
 
     def close(self):
         self.channel.close()
 
+    def notify(self, event, *args):
+        """Calls the callback registered for `event` with `args`, or queues
+        the call to the executor. Must not be called with `lock` held. If the
+        executor rejects the call, its error is raised and the call dropped."""
+        callback = self.callbacks.get(event)
+        if callback is None:
+            return
+        if self.executor is None:
+            callback(*args)
+            return
+
+        with self._pendingLock:
+            self._pending.append((callback, args))
+            if self._draining:
+                return
+            self._draining = True
+        try:
+            self.executor.submit(self._drain)
+        except Exception:
+            # e.g. the executor was shut down; don't leave later calls stuck behind this one
+            with self._pendingLock:
+                self._pending.clear()
+                self._draining = False
+            raise
+
+    def _drain(self):
+        # a single task per profile works through the calls, keeping them in order
+        while True:
+            with self._pendingLock:
+                if not self._pending:
+                    self._draining = False
+                    return
+                callback, args = self._pending.popleft()
+            try:
+                callback(*args)
+            except Exception as err:  # pylint: disable=broad-except
+                print(err)
+
     def wrapDifference(self, current, previous, max):
         if previous > current:
             correction = current + max
@@ -119,21 +161,16 @@ class DeviceProfile(object):
 
         elif isinstance(msg, ChannelIDMessage):
             self.state = ChannelState.OPEN
-            onDevicePaired = self.callbacks.get('onDevicePaired')
-            if onDevicePaired:
-                onDevicePaired(self, ChannelID(msg.deviceNumber, msg.deviceType, msg.transmissionType))
+            self.notify('onDevicePaired', self,
+                        ChannelID(msg.deviceNumber, msg.deviceType, msg.transmissionType))
 
         elif isinstance(msg, ChannelEventResponseMessage):
             if msg.messageCode == EVENT_CHANNEL_CLOSED:
                 self.state = ChannelState.CLOSED
-                onChannelClosed = self.callbacks.get('onChannelClosed')
-                if onChannelClosed:
-                    onChannelClosed(self)
+                self.notify('onChannelClosed', self)
             elif msg.messageCode == EVENT_RX_SEARCH_TIMEOUT:
                 self.state = ChannelState.SEARCH_TIMEOUT
-                onSearchTimeout = self.callbacks.get('onSearchTimeout')
-                if onSearchTimeout:
-                    onSearchTimeout(self)
+                self.notify('onSearchTimeout', self)
             elif msg.messageCode == EVENT_RX_FAIL_GO_TO_SEARCH:
                 self.state = ChannelState.SEARCHING
 
@@ -51,7 +51,7 @@ class BicyclePower(DeviceProfile):
     deviceType = 0x0B
     name = 'Bicycle Power'
 
-    def __init__(self, node, network, callbacks=None):
+    def __init__(self, node, network, callbacks=None, executor=None):
         """
         :param node: The ANT node to use
         :param network: The ANT network to connect on
@@ -61,7 +61,7 @@ class BicyclePower(DeviceProfile):
                 'onPowerData'
                 'onTorqueAndPedalData'
         """
-        super(BicyclePower, self).__init__(node, network, callbacks)
+        super(BicyclePower, self).__init__(node, network, callbacks, executor)
 
         self.eventCount = None
         self.pedalPowerRatio = None
@@ -100,6 +100,7 @@ class BicyclePower(DeviceProfile):
 
     def processData(self, data):
         page = data[0]
+        event = None
         with self.lock:
             if page == POWER_ONLY_PAGE:
                 self.eventCount, pedalPowerByte, self.cadence,\
@@ -114,10 +115,9 @@ class BicyclePower(DeviceProfile):
                 if self.cadence == 0xFF:  # Invalid value
                     self.cadence = None
 
-                callback = self.callbacks.get('onPowerData')
-                if callback:
-                    callback(self.eventCount, self.pedalPowerRatio, self.cadence,
-                             self.accumulatedPower, self.instantaneousPower)
+                event = 'onPowerData'
+                values = (self.eventCount, self.pedalPowerRatio, self.cadence,
+                          self.accumulatedPower, self.instantaneousPower)
 
             elif page == TORQUE_AND_PEDAL_PAGE:
                 self.eventCount, self.leftTorque, self.rightTorque,\
@@ -132,10 +132,12 @@ class BicyclePower(DeviceProfile):
                 else:
                     self.rightPedalSmoothness = convertPercent(self.rightPedalSmoothness)
 
-                callback = self.callbacks.get('onTorqueAndPedalData')
-                if callback:
-                    callback(self.eventCount, self.leftTorque, self.rightTorque,
-                             self.leftPedalSmoothness, self.rightPedalSmoothness)
+                event = 'onTorqueAndPedalData'
+                values = (self.eventCount, self.leftTorque, self.rightTorque,
+                          self.leftPedalSmoothness, self.rightPedalSmoothness)
+
+        if event is not None:
+            self.notify(event, *values)
 
 
 # Used by Torque Effectiveness and Pedal Smoothness page. Assumes value is in 1/2% increments.
@@ -11,8 +11,8 @@ class rower(DeviceProfile):
     name = 'Rower'
 
 
-    def __init__(self, node, network, callbacks=None):
-        super(rower, self).__init__(node, network, callbacks)
+    def __init__(self, node, network, callbacks=None, executor=None):
+        super(rower, self).__init__(node, network, callbacks, executor)
 
         self.page16 = genericFEC()
         self._elapsedTime = 0.0
@@ -46,7 +46,7 @@ class rower(DeviceProfile):
 
 #################################################################################
 
-            callback = self.callbacks.get('onRower')
-            if callback:
-                callback(self._elapsedTime, self._distanceTraveled, self._instantaneousSpeed, self._kmSpeed, self._cadence, self._power)
+            values = (self._elapsedTime, self._distanceTraveled, self._instantaneousSpeed, self._kmSpeed, self._cadence, self._power)
+
+        self.notify('onRower', *values)
 
@@ -41,7 +41,7 @@ class Stride(DeviceProfile):
     deviceType = 0x7c
     name = 'Stride Based Speed and Distance'
 
-    def __init__(self, node, network, callbacks=None):
+    def __init__(self, node, network, callbacks=None, executor=None):
         """
         :param node: The ANT node to use
         :param network: The ANT network to connect on
@@ -50,8 +50,9 @@ class Stride(DeviceProfile):
                 `Stride` also has the following:
                 'onStrideCount'
                 'onCalories'
+        :param executor: See `DeviceProfile`
         """
-        super(Stride, self).__init__(node, network, callbacks)
+        super(Stride, self).__init__(node, network, callbacks, executor)
 
         self._detected_device = None
 
@@ -66,6 +67,7 @@ class Stride(DeviceProfile):
     def processData(self, data):
         payload_offset = 0
         device_page = None
+        event = None
 
         with self.lock:
             data_page_index = 0 + payload_offset
@@ -74,9 +76,7 @@ class Stride(DeviceProfile):
             if device_page == 0x01:
                 stride_count_index = 6 + payload_offset
                 self._stride_count = data[stride_count_index]
-                callback = self.callbacks.get('onStrideCount')
-                if callback:
-                    callback(self._stride_count)
+                event, values = 'onStrideCount', (self._stride_count,)
 
             elif device_page == 0x02:
                 print("page 2, template")
@@ -84,9 +84,7 @@ class Stride(DeviceProfile):
             elif device_page == 0x03:
                 calories_index = 6 + payload_offset
                 self._calories = data[calories_index]
-                callback = self.callbacks.get('onCalories')
-                if callback:
-                    callback(self._calories)
+                event, values = 'onCalories', (self._calories,)
 
             elif device_page == 0x10:
                 print("page 16, Distance & Strides Since Battery Reset")
@@ -109,6 +107,9 @@ class Stride(DeviceProfile):
                 self._sw_revision = data[3 + payload_offset]
                 self._serial_number = struct.unpack('>L', data[4 + payload_offset:8 + payload_offset])[0]
 
+        if event is not None:
+            self.notify(event, *values)
+
     @property
     def stride_count(self):
         """Accumulated Strides.
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+
+##############################################################################
+#
+# Copyright (c) 2017, Matt Hughes
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+#
+##############################################################################
+
+import asyncio
+import threading
+import unittest
+from six.moves.queue import Queue, Empty
+
+from ant.core.aio import AsyncNode
+from ant.core.constants import *
+from ant.core.driver import Driver
+from ant.core.emulator import EmulatedStick
+from ant.core.event import FrameDecoder
+from ant.core.exceptions import ChannelError, DriverError
+from ant.core.message import CapabilitiesMessage, ChannelBroadcastDataMessage, \
+        ChannelEventResponseMessage, StartupMessage
+from ant.core.node import ChannelID, Network
+
+
+class StickDriver(Driver):
+    """Answers commands the way an ANT stick with 8 channels would."""
+
+    def __init__(self):
+        super(StickDriver, self).__init__()
+        self.is_open = False
+        self.reads = Queue()
+        self.written = []
+        self.transfers = 0
+        self.failAcknowledged = False
+        self.rejected = set()
+        self.writers = set()
+        self.failWrites = False
+
+    @property
+    def _opened(self):
+        return self.is_open
+
+    def _open(self):
+        self.is_open = True
+
+    def _close(self):
+        self.is_open = False
+
+    def _read(self, count):
+        try:
+            return self.reads.get(timeout=0.01)
+        except Empty:
+            return b''
+
+    def reply(self, msg):
+        self.reads.put(bytes(msg.encode()))
+
+    def _write(self, data):
+        self.writers.add(threading.current_thread())
+        if self.failWrites:
+            raise DriverError('write failed')
+        self.transfers += 1
+        decoder = FrameDecoder()
+        decoder.feed(data)
+        for msg in decoder:
+            self.answer(msg)
+        return len(data)
+
+    def answer(self, msg):
+        self.written.append(msg)
+        type_ = msg.type
+        if type_ == MESSAGE_SYSTEM_RESET:
+            self.reply(StartupMessage())
+        elif type_ == MESSAGE_CHANNEL_REQUEST:
+            self.reply(CapabilitiesMessage(8, 3))
+        elif type_ == MESSAGE_CHANNEL_ACKNOWLEDGED_DATA:
+            code = EVENT_TRANSFER_TX_FAILED if self.failAcknowledged else EVENT_TRANSFER_TX_COMPLETED
+            self.reply(ChannelEventResponseMessage(msg.payload[0], 1, code))
+        elif type_ != MESSAGE_CHANNEL_BROADCAST_DATA:
+            code = INVALID_MESSAGE if type_ in self.rejected else RESPONSE_NO_ERROR
+            self.reply(ChannelEventResponseMessage(msg.payload[0], type_, code))
+            if type_ == MESSAGE_CHANNEL_CLOSE:
+                self.reply(ChannelEventResponseMessage(msg.payload[0], 1, EVENT_CHANNEL_CLOSED))
+
+
+class AsyncNodeTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.driver = StickDriver()
+        self.node = AsyncNode(self.driver)
+        await self.node.start()
+
+    async def asyncTearDown(self):
+        if self.node.running:
+            await self.node.stop()
+
+    async def configure(self, channel):
+        network = Network(name='N:ANT+')
+        await self.node.setNetworkKey(0, network)
+        await channel.configure(network, CHANNEL_TYPE_TWOWAY_RECEIVE,
+                                ChannelID(23358, 0x78, 1), 0x39, 8070, 12)
+
+    async def test_start_reads_capabilities(self):
+        self.assertEqual(8, len(self.node.channels))
+        self.assertEqual(3, len(self.node.networks))
+
+    async def test_configure_and_stream(self):
+        channel = self.node.getFreeChannel()
+        transfers = self.driver.transfers
+        await self.configure(channel)
+        self.assertEqual(23358, channel.id.deviceNumber)
+        # the network key, then all configuration steps in one go
+        self.assertEqual(transfers + 2, self.driver.transfers)
+
+        self.driver.reply(ChannelBroadcastDataMessage(0, b'\x11' * 8))
+        self.driver.reply(ChannelBroadcastDataMessage(0, b'\x22' * 8))
+
+        received = []
+        async def consume():
+            async for msg in channel.messages():
+                if isinstance(msg, ChannelBroadcastDataMessage):
+                    received.append(bytes(msg.data))
+                    if len(received) == 2:
+                        await channel.close()
+        await asyncio.wait_for(consume(), 1)
+
+        self.assertEqual([b'\x11' * 8, b'\x22' * 8], received)
+
+    async def test_configure_reports_failed_step(self):
+        self.driver.rejected.add(MESSAGE_CHANNEL_PERIOD)
+        channel = self.node.channels[1]
+        with self.assertRaisesRegex(ChannelError, 'could not set period'):
+            await channel.configure(Network(), CHANNEL_TYPE_TWOWAY_RECEIVE,
+                                    ChannelID(0, 0x78, 0), 0x39, 8070, 12)
+        self.assertIsNone(channel.network)
+
+    async def test_send_acknowledged(self):
+        channel = self.node.getFreeChannel()
+        await self.configure(channel)
+        await channel.sendAcknowledged(b'\x01' * 8)
+
+        self.driver.failAcknowledged = True
+        with self.assertRaises(ChannelError):
+            await channel.sendAcknowledged(b'\x01' * 8)
+
+    async def test_writes_stay_off_the_loop_thread(self):
+        channel = self.node.getFreeChannel()
+        await self.configure(channel)
+        self.assertEqual(1, len(self.driver.writers))
+        self.assertNotIn(threading.current_thread(), self.driver.writers)
+
+    async def test_write_error_fails_response_future(self):
+        self.driver.failWrites = True
+        with self.assertRaises(DriverError):
+            await self.node.setNetworkKey(0, Network(name='N:ANT+'))
+
+
+class AsyncNodeEmulatorTest(unittest.IsolatedAsyncioTestCase):
+    async def test_search_timeout_ends_message_stream(self):
+        node = AsyncNode(EmulatedStick(timeScale=100))
+        await node.start()
+        try:
+            network = Network(name='N:ANT+')
+            await node.setNetworkKey(0, network)
+            channel = node.getFreeChannel()
+            # nothing in range, the stick gives up after 2.5 s / 100
+            await channel.configure(network, CHANNEL_TYPE_TWOWAY_RECEIVE,
+                                    ChannelID(0, 0x78, 0), 0x39, 8070, 1)
+            self.assertTrue(channel.isOpen)
+
+            async def consume():
+                return [msg.messageCode async for msg in channel.messages()]
+            codes = await asyncio.wait_for(consume(), 2)
+
+            self.assertEqual([EVENT_RX_SEARCH_TIMEOUT, EVENT_CHANNEL_CLOSED], codes)
+            self.assertFalse(channel.isOpen)
+        finally:
+            await node.stop()
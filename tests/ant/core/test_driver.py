@@ -24,13 +24,19 @@
 #
 ##############################################################################
 
+import os
+import select
+import threading
 import unittest
+from array import array
+from unittest import mock
 
 from ant.core.driver import *
 from ant.core.log import *
-from ant.core.message import ChannelAssignMessage
+from ant.core.message import ChannelAssignMessage, ChannelPeriodMessage
 
 from serial import Serial, SerialException, SerialTimeoutException
+from time import sleep, thread_time, time
 
 dumps = []
 class FakeDriver(Driver):
@@ -60,7 +66,8 @@ class FakeDriver(Driver):
         return data_to_return
 
     def _write(self, data):
-        self.written_data.append(data)
+        self.written_data.append(bytes(data))
+        return len(data)
 
     @staticmethod
     def _dump(data, title):
@@ -132,6 +139,18 @@ class DriverTest(unittest.TestCase):
         global dumps
         self.assertEqual(dumps[0], (bytearray([0]), 'READ'))
 
+    def test_read_without_count_reads_read_size(self):
+        self.driver.open()
+        self.driver.readSize = 4
+        self.assertEqual(self.driver.read(), bytearray(range(4)))
+
+    def test_read_into(self):
+        self.driver.open()
+        buffer_ = bytearray(4)
+        self.assertEqual(self.driver.readInto(buffer_), 4)
+        self.assertEqual(buffer_, bytearray(range(4)))
+        self.assertEqual(self.driver.log.logs[-1], (LOG_READ, bytes(range(4))))
+
     def test_read_zero_or_less_raises_error(self):
         self.driver.open()
 
@@ -165,6 +184,38 @@ class DriverTest(unittest.TestCase):
             msg = ChannelAssignMessage()
             self.driver.write(msg)
 
+    def test_write_many(self):
+        self.driver.open()
+
+        msgs = [ChannelAssignMessage(number=1), ChannelPeriodMessage(1, 8070)]
+        frames = [bytes(msg.encode()) for msg in msgs]
+        self.assertEqual(self.driver.writeMany(msgs), len(b''.join(frames)))
+
+        self.assertEqual(self.driver.written_data, [b''.join(frames)])
+        self.assertEqual(self.driver.log.logs[-2:], [(LOG_WRITE, frame) for frame in frames])
+
+    def test_write_many_splits_transfers_between_frames(self):
+        self.driver.open()
+        self.driver.writeSize = 20
+
+        msgs = [ChannelPeriodMessage(number, 8070) for number in range(3)]  # 7 bytes each
+        frames = [bytes(msg.encode()) for msg in msgs]
+        self.driver.writeMany(msgs)
+
+        self.assertEqual(self.driver.written_data, [frames[0] + frames[1], frames[2]])
+
+    def test_write_many_short_write(self):
+        self.driver.open()
+        self.driver._write = lambda data: 10
+
+        msgs = [ChannelPeriodMessage(number, 8070) for number in range(3)]
+        with self.assertRaisesRegex(DriverError, '10 of 21'):
+            self.driver.writeMany(msgs)
+
+        frames = [bytes(msg.encode()) for msg in msgs]
+        self.assertEqual(self.driver.log.logs[-2:],
+                         [(LOG_WRITE, frames[0]), (LOG_WRITE, frames[1][:3])])
+
 class USB1DriverTest(unittest.TestCase):
     def setUp(self):
         this = self
@@ -198,13 +249,20 @@ class USB1DriverTest(unittest.TestCase):
         def serial_flush(self):
             this.serial_flush_called = True
 
-        Serial.__init__ = serial_init
-        Serial.isOpen = serial_is_open
-        Serial.timeout = property(serial_get_timeout, serial_set_timeout)
-        Serial.close = serial_close
-        Serial.read = serial_read
-        Serial.write = serial_write
-        Serial.flush = serial_flush
+        fakes = {
+            '__init__': serial_init,
+            'isOpen': serial_is_open,
+            'timeout': property(serial_get_timeout, serial_set_timeout),
+            'close': serial_close,
+            'read': serial_read,
+            'write': serial_write,
+            'flush': serial_flush,
+        }
+        # restored afterwards, so later tests can use a real serial port
+        for name, fake in fakes.items():
+            patch = mock.patch.object(Serial, name, fake)
+            patch.start()
+            self.addCleanup(patch.stop)
 
     def test_open(self):
         driver = USB1Driver('/dev/ttyS0')
@@ -213,7 +271,7 @@ class USB1DriverTest(unittest.TestCase):
         driver.open()
 
         self.assertIsNotNone(driver._serial)
-        self.assertEqual(driver._serial.timeout, 0.01)
+        self.assertEqual(driver._serial.timeout, USB1Driver.READ_TIMEOUT)
         self.assertEqual(driver._opened, True)
 
     def test_open_raises_driver_error_on_SerialException(self):
@@ -271,15 +329,147 @@ class USB1DriverTest(unittest.TestCase):
             count = driver.write(msg)
 
 
+@unittest.skipUnless(hasattr(os, 'openpty'), 'needs a pseudo terminal')
+class USB1DriverPtyTest(unittest.TestCase):
+    def setUp(self):
+        self.master, slave = os.openpty()
+        self.addCleanup(os.close, self.master)
+        self.addCleanup(os.close, slave)
+        self.driver = USB1Driver(os.ttyname(slave))
+        self.driver.open()
+        self.addCleanup(self.driver.close)
+
+    def test_read_returns_as_soon_as_bytes_arrive(self):
+        frame = bytes(ChannelPeriodMessage(1, 8070).encode())
+        latencies = []
+
+        for _ in range(9):
+            sent = []
+
+            def send():
+                sleep(0.005)  # let the read below block first
+                sent.append(time())
+                os.write(self.master, frame)
+            sender = threading.Thread(target=send)
+            sender.start()
+
+            data, deadline = b'', time() + 1
+            while not data and time() < deadline:
+                data = bytes(self.driver.read())
+            arrived = time()
+            while len(data) < len(frame) and time() < deadline:
+                data += bytes(self.driver.read())
+            sender.join()
+
+            self.assertEqual(frame, data)
+            latencies.append(arrived - sent[0])
+
+        # sub-millisecond normally; the median and the margin keep a loaded
+        # runner from failing this, a read waiting for a timeout still would
+        self.assertLess(sorted(latencies)[len(latencies) // 2], 0.002)
+
+    def test_idle_read_sleeps(self):
+        duration = 3 * USB1Driver.READ_TIMEOUT
+        basetime, cputime, reads = time(), thread_time(), 0
+        while time() - basetime < duration:
+            self.assertEqual(b'', bytes(self.driver.read()))
+            reads += 1
+        idle = thread_time() - cputime
+
+        # what the same time costs when polling without blocking
+        basetime, cputime = time(), thread_time()
+        while time() - basetime < duration:
+            select.select([self.master], [], [], 0)
+        busy = thread_time() - cputime
+
+        self.assertLessEqual(reads, 4)
+        self.assertLess(idle, busy / 5)
+
+
+class FakeEndpoint(object):
+    """Bulk IN endpoint handing out queued USB packets."""
+
+    wMaxPacketSize = 64
+
+    def __init__(self, packets):
+        self.packets = list(packets)
+        self.transfers = []
+
+    def read(self, size_or_buffer):
+        self.transfers.append(size_or_buffer)
+        data = self.packets.pop(0) if self.packets else b''
+        if isinstance(size_or_buffer, array):
+            size_or_buffer[:len(data)] = array('B', data)
+            return len(data)
+        return array('B', data[:size_or_buffer])
+
+
 class USB2DriverTest(unittest.TestCase):
     def setUp(self):
-        pass
+        self.endpoint = FakeEndpoint([bytes(range(13)) * 3, b'\xa4' * 20])
+        interface = mock.MagicMock()
+        device = mock.MagicMock()
+        device.get_active_configuration.return_value = {(0, 0): interface}
+        patches = [
+            mock.patch('usb.core.find', return_value=device),
+            mock.patch('ant.core.driver.claim_interface'),
+            mock.patch('ant.core.driver.find_descriptor', return_value=self.endpoint),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_read_size_is_a_multiple_of_the_packet_size(self):
+        driver = USB2Driver()
+        driver.open()
+        self.assertEqual(driver.readSize, 64 * USB2Driver.READ_PACKETS)
 
-    def test_something(self):
-        pass
+    def test_read_without_count_returns_whole_transfer(self):
+        driver = USB2Driver()
+        driver.open()
+
+        self.assertEqual(bytes(driver.read()), bytes(range(13)) * 3)
+        self.assertEqual(bytes(driver.read()), b'\xa4' * 20)
 
+        # both transfers went into the same preallocated buffer
+        buffer_ = self.endpoint.transfers[0]
+        self.assertIsInstance(buffer_, array)
+        self.assertEqual(len(buffer_), driver.readSize)
+        self.assertIs(self.endpoint.transfers[1], buffer_)
 
+    def test_read_with_count(self):
+        driver = USB2Driver()
+        driver.open()
+        self.assertEqual(driver.read(5), bytes(range(5)))
+        self.assertEqual(self.endpoint.transfers, [5])
+
+    def test_read_into(self):
+        driver = USB2Driver()
+        driver.open()
 
+        buffer_ = array('B', bytes(64))
+        self.assertEqual(driver.readInto(buffer_), 39)
+        self.assertEqual(buffer_[:39].tobytes(), bytes(range(13)) * 3)
+        self.assertIs(self.endpoint.transfers[0], buffer_)
 
+        buffer_ = bytearray(32)
+        self.assertEqual(driver.readInto(buffer_), 20)
+        self.assertEqual(buffer_[:20], b'\xa4' * 20)
 
+    def test_read_error_marks_driver_disconnected(self):
+        driver = USB2Driver()
+        driver.open()
+        self.endpoint.read = mock.Mock(side_effect=USBError('gone', errno=19))
+
+        with self.assertRaises(USBError):
+            driver.read()
+        self.assertTrue(driver.disconnected.is_set())
+
+    def test_read_timeout_keeps_driver_connected(self):
+        driver = USB2Driver()
+        driver.open()
+        self.endpoint.read = mock.Mock(side_effect=USBError('timeout', errno=110))
 
+        with self.assertRaises(USBError):
+            driver.read()
+        self.assertFalse(driver.disconnected.is_set())
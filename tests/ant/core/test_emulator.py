@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+##############################################################################
+#
+# Copyright (c) 2017, Matt Hughes
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+#
+##############################################################################
+
+
+import threading
+import unittest
+
+from ant.core.constants import *
+from ant.core.emulator import EmulatedStick, FitnessEquipment, HeartRateMonitor, PowerMeter
+from ant.core.event import FrameDecoder
+from ant.core.message import ChannelAssignMessage, ChannelCloseMessage, ChannelIDMessage, \
+        ChannelOpenMessage, ChannelPeriodMessage, ChannelFrequencyMessage
+from ant.core.node import ChannelID, Network, Node
+from ant.plus.bikeTrainer import bikeTrainer
+from ant.plus.heartrate import HeartRate
+from ant.plus.power import BicyclePower
+
+
+class EmulatedStickTest(unittest.TestCase):
+    def setUp(self):
+        self.stick = EmulatedStick([PowerMeter(42)], timeScale=50)
+        self.stick.open()
+        self.addCleanup(self.stick.close)
+
+    def command(self, *msgs):
+        self.stick.writeMany(msgs)
+        decoder = FrameDecoder()
+        decoder.feed(self.stick.read())
+        return list(decoder)
+
+    def test_commands_are_acknowledged(self):
+        responses = self.command(ChannelAssignMessage(1, CHANNEL_TYPE_TWOWAY_RECEIVE, 0),
+                                 ChannelPeriodMessage(1, 8182))
+        self.assertEqual([(MESSAGE_CHANNEL_ASSIGN, RESPONSE_NO_ERROR),
+                          (MESSAGE_CHANNEL_PERIOD, RESPONSE_NO_ERROR)],
+                         [(msg.messageID, msg.messageCode) for msg in responses])
+
+    def test_unassigned_channel_in_wrong_state(self):
+        response, = self.command(ChannelPeriodMessage(1, 8182))
+        self.assertEqual(CHANNEL_IN_WRONG_STATE, response.messageCode)
+
+    def test_open_channel_receives_broadcasts(self):
+        self.command(ChannelAssignMessage(0, CHANNEL_TYPE_TWOWAY_RECEIVE, 0),
+                     ChannelIDMessage(0, 0, 0x0B, 0),
+                     ChannelFrequencyMessage(0, 57),
+                     ChannelPeriodMessage(0, 8182),
+                     ChannelOpenMessage(0))
+
+        decoder = FrameDecoder()
+        for _ in range(20):
+            decoder.feed(self.stick.read())
+            if self.stick.broadcasts >= 3:
+                break
+        pages = [bytes(msg.data) for msg in decoder]
+        self.assertEqual(3, len(pages))
+        self.assertEqual([1, 2, 3], [page[1] for page in pages])  # event counts
+
+        responses = self.command(ChannelCloseMessage(0))
+        self.assertEqual([EVENT_CHANNEL_CLOSED], [msg.messageCode for msg in responses
+                                                  if msg.messageID == 1])
+
+
+class EmulatedNodeTest(unittest.TestCase):
+    def setUp(self):
+        self.stick = EmulatedStick([HeartRateMonitor(1234, bpm=150), PowerMeter(42),
+                                    FitnessEquipment(7)], timeScale=20)
+        self.node = Node(self.stick)
+        self.node.start()
+        self.addCleanup(self.node.stop)
+        self.network = Network(key=NETWORK_KEY_ANT_PLUS, name='N:ANT+')
+        self.node.setNetworkKey(0, self.network)
+
+    def test_profiles_pair_and_receive_data(self):
+        paired, received = [], {}
+        done = threading.Event()
+
+        def record(event):
+            def callback(*args):
+                received.setdefault(event, []).append(args)
+                if len(received) == 3 and all(len(values) >= 5 for values in received.values()):
+                    done.set()
+            return callback
+
+        callbacks = {'onDevicePaired': lambda profile, channelId: paired.append(channelId)}
+        profiles = [
+            HeartRate(self.node, self.network, dict(callbacks, onHeartRateData=record('hr'))),
+            BicyclePower(self.node, self.network, dict(callbacks, onPowerData=record('power'))),
+            bikeTrainer(self.node, self.network, dict(callbacks, onBikeTrainer=record('fec'))),
+        ]
+        for profile in profiles:
+            profile.open()
+
+        self.assertTrue(done.wait(5))
+        self.assertEqual({1234, 42, 7}, set(channelId.deviceNumber for channelId in paired))
+        self.assertEqual(150, received['hr'][-1][0])
+        self.assertEqual(200, received['power'][-1][4])
+        self.assertEqual(150, received['fec'][-1][5])
+
+    def test_search_timeout(self):
+        timedOut = threading.Event()
+        profile = HeartRate(self.node, self.network,
+                            {'onSearchTimeout': lambda profile: timedOut.set()})
+        profile.open(channelId=ChannelID(999, 0x78, 0), searchTimeout=2.5)
+
+        self.assertTrue(timedOut.wait(2))
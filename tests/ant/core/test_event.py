@@ -0,0 +1,573 @@
+# -*- coding: utf-8 -*-
+
+##############################################################################
+#
+# Copyright (c) 2017, Matt Hughes
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+#
+##############################################################################
+
+
+import threading
+import time
+import unittest
+from six.moves.queue import Queue, Empty
+
+from ant.core import message
+from ant.core.constants import MESSAGE_CHANNEL_BROADCAST_DATA, MESSAGE_CHANNEL_EVENT, \
+        MESSAGE_CHANNEL_PERIOD, RESPONSE_NO_ERROR, CHANNEL_IN_WRONG_STATE
+from ant.core.driver import Driver
+from ant.core.event import EventCallback, EventMachine, FrameDecoder, MsgCallback, DispatchQueue, \
+        WriteQueue, OVERFLOW_DROP_NEWEST, OVERFLOW_DROP_OLDEST, PRIORITY_CONTROL, PRIORITY_DATA
+from ant.core.exceptions import DriverError, MessageTimeoutError
+from ant.core.message import ChannelBroadcastDataMessage, ChannelEventResponseMessage, \
+        ChannelMessage, ChannelPeriodMessage, FrameTemplate, MessageView
+from ant.core.node import ChannelID
+
+
+def broadcast(number, byte):
+    return ChannelBroadcastDataMessage(number, data=bytearray([byte] * 8)).encode()
+
+
+class FakeDriver(Driver):
+    def __init__(self):
+        super(FakeDriver, self).__init__()
+        self.is_open = False
+        self.reads = Queue()
+        self.written = []
+
+    @property
+    def _opened(self):
+        return self.is_open
+
+    def _open(self):
+        self.is_open = True
+
+    def _close(self):
+        self.is_open = False
+
+    def _read(self, count):
+        try:
+            return self.reads.get(timeout=0.01)
+        except Empty:
+            return b''
+
+    def _write(self, data):
+        self.written.append(data)
+        return len(data)
+
+
+class Recorder(EventCallback):
+    def __init__(self, expected, keep=lambda msg: msg):
+        self.received = []
+        self.keep = keep
+        self.expected = expected
+        self.done = threading.Event()
+
+    def process(self, msg):
+        self.received.append(self.keep(msg))
+        if len(self.received) >= self.expected:
+            self.done.set()
+
+
+class FrameDecoderTest(unittest.TestCase):
+    def setUp(self):
+        self.decoder = FrameDecoder(size=32)
+
+    def test_decodes_complete_frames(self):
+        self.decoder.feed(broadcast(1, 0x11) + broadcast(2, 0x22))
+
+        messages = list(self.decoder)
+
+        self.assertEqual(2, len(messages))
+        self.assertIsInstance(messages[0], ChannelBroadcastDataMessage)
+        self.assertEqual(1, messages[0].channelNumber)
+        self.assertEqual(bytearray([0x22] * 8), messages[1].data)
+        self.assertEqual(0, len(self.decoder))
+
+    def test_keeps_incomplete_tail(self):
+        raw = broadcast(1, 0x11)
+        self.decoder.feed(raw[:5])
+        self.assertEqual([], list(self.decoder))
+        self.assertEqual(5, len(self.decoder))
+
+        self.decoder.feed(raw[5:])
+        messages = list(self.decoder)
+        self.assertEqual(1, len(messages))
+        self.assertEqual(1, messages[0].channelNumber)
+
+    def test_counts_skipped_bytes(self):
+        corrupted = broadcast(1, 0x11)
+        corrupted[-1] ^= 0xFF
+        self.decoder.feed(b'\x00\x01' + corrupted + broadcast(2, 0x22))
+
+        self.assertEqual(1, len(list(self.decoder)))
+        self.assertEqual(2 + 2 * len(corrupted), self.decoder.bytesFed)
+        self.assertEqual(1, self.decoder.checksumErrors)
+        self.assertEqual(2 + len(corrupted), self.decoder.skippedBytes)
+
+    def test_skips_garbage_before_sync(self):
+        self.decoder.feed(b'\x00\x01\x02' + broadcast(3, 0x33))
+
+        messages = list(self.decoder)
+
+        self.assertEqual(1, len(messages))
+        self.assertEqual(3, messages[0].channelNumber)
+
+    def test_resyncs_after_bad_checksum(self):
+        corrupted = broadcast(1, 0x11)
+        corrupted[-1] ^= 0xFF
+        self.decoder.feed(corrupted + broadcast(2, 0x22))
+
+        messages = list(self.decoder)
+
+        self.assertEqual(1, len(messages))
+        self.assertEqual(2, messages[0].channelNumber)
+
+    def test_compacts_and_grows_buffer(self):
+        raw = ChannelEventResponseMessage(4, 0x01, 0x03).encode()
+        received = []
+        for _ in range(20):
+            # feed frames split in odd places so that the tail has to move
+            self.decoder.feed(raw[:3])
+            received.extend(self.decoder)
+            self.decoder.feed(raw[3:] + broadcast(5, 0x55) + raw[:1])
+            received.extend(self.decoder)
+            self.decoder.feed(raw[1:])
+            received.extend(self.decoder)
+
+        self.assertEqual(60, len(received))
+        self.assertEqual([4, 5, 4] * 20, [msg.channelNumber for msg in received])
+
+    def test_frames_are_views_into_the_buffer(self):
+        raw = broadcast(1, 0x11)
+        self.decoder.feed(raw)
+
+        frames = list(self.decoder.frames())
+
+        self.assertEqual(1, len(frames))
+        self.assertIsInstance(frames[0], memoryview)
+        self.assertEqual(bytes(raw), frames[0].tobytes())
+
+    def test_grows_for_large_reads(self):
+        self.decoder.feed(b''.join(bytes(broadcast(i, i)) for i in range(8)))
+
+        self.assertEqual(list(range(8)), [msg.channelNumber for msg in self.decoder])
+
+
+class EventMachineCallbackTest(unittest.TestCase):
+    def test_wait_for_wakes_on_process(self):
+        callback = MsgCallback()
+        msg = ChannelEventResponseMessage(1, 0x42, 0)
+        timer = threading.Timer(0.05, callback.process, (msg,))
+        timer.start()
+        try:
+            self.assertIs(msg, callback.waitFor(ChannelEventResponseMessage, timeout=1))
+        finally:
+            timer.join()
+        self.assertFalse(callback.inboxes[ChannelEventResponseMessage])
+
+    def test_wait_for_returns_queued_message(self):
+        callback = MsgCallback()
+        msg = ChannelEventResponseMessage(1, 0x42, 0)
+        callback.process(msg)
+        self.assertIs(msg, callback.waitFor(ChannelEventResponseMessage, timeout=0))
+
+    def test_unsubscribed_messages_not_kept(self):
+        callback = MsgCallback()
+        callback.process(ChannelBroadcastDataMessage(1))
+        self.assertNotIn(ChannelBroadcastDataMessage, callback.inboxes)
+        self.assertNotIn(MESSAGE_CHANNEL_BROADCAST_DATA, callback.types)
+
+        self.assertTrue(callback.subscribe(ChannelBroadcastDataMessage))
+        self.assertFalse(callback.subscribe(ChannelBroadcastDataMessage))
+        callback.process(ChannelBroadcastDataMessage(1))
+        self.assertIsNotNone(callback.waitFor(ChannelBroadcastDataMessage, timeout=0))
+
+    def test_wait_for_base_class_matches_subclasses(self):
+        callback = MsgCallback()
+        callback.subscribe(ChannelMessage)
+        self.assertIsNone(callback.types)
+
+        msg = ChannelEventResponseMessage(1, 0x42, 0)
+        callback.process(msg)
+        self.assertIs(msg, callback.waitFor(ChannelMessage, timeout=0))
+        # also kept for its own class
+        self.assertIs(msg, callback.waitFor(ChannelEventResponseMessage, timeout=0))
+
+    def test_inbox_bounded(self):
+        callback = MsgCallback()
+        for number in range(MsgCallback.MAX_QUEUE + 5):
+            callback.process(ChannelEventResponseMessage(number, 0x42, 0))
+        inbox = callback.inboxes[ChannelEventResponseMessage]
+        self.assertEqual(MsgCallback.MAX_QUEUE, len(inbox))
+        self.assertEqual(5, inbox[0].channelNumber)
+
+    def test_wait_for_timeout(self):
+        callback = MsgCallback()
+        callback.process(ChannelEventResponseMessage(1, 0x42, 0))
+        basetime = time.time()
+        with self.assertRaises(MessageTimeoutError):
+            callback.waitFor(ChannelBroadcastDataMessage, timeout=0.05)
+        self.assertGreaterEqual(time.time() - basetime, 0.05)
+
+
+class DispatchQueueTest(unittest.TestCase):
+    def response(self):
+        return ChannelEventResponseMessage(1, MESSAGE_CHANNEL_PERIOD, RESPONSE_NO_ERROR).encode()
+
+    def test_fifo_and_stats(self):
+        queue = DispatchQueue(4)
+        queue.put(broadcast(1, 0x11), 1.0)
+        queue.put(broadcast(1, 0x22), 2.0)
+
+        self.assertEqual((broadcast(1, 0x11), 1.0), queue.get())
+        stats = queue.stats()
+        self.assertEqual(1, stats['depth'])
+        self.assertEqual(2, stats['maxDepth'])
+        self.assertEqual(1.5, stats['meanDepth'])
+        self.assertEqual(2, stats['enqueued'])
+        self.assertEqual(0, stats['dropped'])
+
+    def test_drop_oldest_keeps_responses(self):
+        queue = DispatchQueue(2, OVERFLOW_DROP_OLDEST)
+        queue.put(self.response(), 0)
+        queue.put(broadcast(1, 0x11), 0)
+        queue.put(broadcast(1, 0x22), 0)
+
+        self.assertEqual([self.response(), broadcast(1, 0x22)],
+                         [queue.get()[0] for _ in range(len(queue))])
+        self.assertEqual(1, queue.stats()['dropped'])
+
+    def test_drop_newest(self):
+        queue = DispatchQueue(1, OVERFLOW_DROP_NEWEST)
+        queue.put(broadcast(1, 0x11), 0)
+        queue.put(broadcast(1, 0x22), 0)
+        queue.put(self.response(), 0)
+
+        self.assertEqual([broadcast(1, 0x11), self.response()],
+                         [queue.get()[0] for _ in range(len(queue))])
+        self.assertEqual(1, queue.stats()['dropped'])
+
+    def test_get_returns_none_when_closed(self):
+        queue = DispatchQueue()
+        queue.put(broadcast(1, 0x11), 0)
+        queue.close()
+        self.assertIsNotNone(queue.get())
+        self.assertIsNone(queue.get())
+
+
+class WriteQueueTest(unittest.TestCase):
+    def test_control_before_data(self):
+        queue = WriteQueue()
+        queue.put(PRIORITY_DATA, b'data 1', [6], None)
+        queue.put(PRIORITY_CONTROL, b'control 1', [9], None)
+        queue.put(PRIORITY_DATA, b'data 2', [6], None)
+        queue.put(PRIORITY_CONTROL, b'control 2', [9], None)
+
+        self.assertEqual([b'control 1', b'control 2', b'data 1', b'data 2'],
+                         [queue.get()[0] for _ in range(len(queue))])
+        self.assertEqual(4, queue.stats()['maxDepth'])
+
+    def test_get_returns_none_when_closed(self):
+        queue = WriteQueue()
+        queue.put(PRIORITY_DATA, b'data', [4], None)
+        queue.close()
+        self.assertFalse(queue.put(PRIORITY_DATA, b'late', [4], None))
+        self.assertEqual(b'data', queue.get()[0])
+        self.assertIsNone(queue.get())
+
+
+class DispatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.driver = FakeDriver()
+        self.evm = EventMachine(self.driver, dispatchers=2)
+        self.evm.start()
+
+    def tearDown(self):
+        self.evm.stop()
+
+    def test_slow_callback_does_not_stall_reader(self):
+        release = threading.Event()
+        slow = Recorder(1, keep=lambda msg: release.wait(1) and msg)
+        slow.number = 1
+        fast = Recorder(3)
+        fast.number = 2
+        self.evm.registerChannel(slow)
+        self.evm.registerChannel(fast)
+
+        self.driver.reads.put(bytes(broadcast(1, 0x11) + broadcast(2, 0x22)))
+        self.driver.reads.put(bytes(broadcast(2, 0x33) + broadcast(2, 0x44)))
+        self.assertTrue(fast.done.wait(1))
+        self.assertFalse(slow.done.is_set())
+        release.set()
+        self.assertTrue(slow.done.wait(1))
+
+        self.assertEqual([b'\x22' * 8, b'\x33' * 8, b'\x44' * 8],
+                         [msg.data for msg in fast.received])
+        self.assertEqual(4, sum(stats['enqueued'] for stats in self.evm.queueStats()))
+
+
+class EventMachineTest(unittest.TestCase):
+    def setUp(self):
+        self.driver = FakeDriver()
+        self.evm = EventMachine(self.driver)
+        self.evm.start()
+
+    def tearDown(self):
+        self.evm.stop()
+
+    def test_view_callbacks(self):
+        views = Recorder(2, keep=lambda view: (view, view.channelNumber, bytes(view.data),
+                                               view.materialize()))
+        messages = Recorder(2)
+        self.evm.registerCallback(views, views=True)
+        self.evm.registerCallback(messages)
+
+        self.driver.reads.put(bytes(broadcast(1, 0x11) + broadcast(2, 0x22)))
+        self.assertTrue(views.done.wait(1))
+        self.assertTrue(messages.done.wait(1))
+
+        (view, number, data, kept), _ = views.received
+        self.assertIsInstance(view, MessageView)
+        self.assertEqual(1, number)
+        self.assertEqual(b'\x11' * 8, data)
+        self.assertIsInstance(kept, ChannelBroadcastDataMessage)
+        self.assertIs(kept, messages.received[0])
+        self.assertEqual([1, 2], [msg.channelNumber for msg in messages.received])
+
+    def test_raw_callbacks(self):
+        received = []
+        done = threading.Event()
+        def callback(messageID, channel, payload, rxTime):
+            received.append((messageID, channel, bytes(payload), rxTime))
+            done.set()
+
+        self.evm.registerRawCallback(callback, channels=[2])
+        self.driver.reads.put(bytes(broadcast(1, 0x11) + broadcast(2, 0x22)))
+        self.assertTrue(done.wait(1))
+
+        (messageID, channel, payload, rxTime), = received
+        self.assertEqual(MESSAGE_CHANNEL_BROADCAST_DATA, messageID)
+        self.assertEqual(2, channel)
+        self.assertEqual(b'\x02' + b'\x22' * 8, payload)
+        self.assertIsInstance(rxTime, float)
+
+    def test_raw_only_frames_not_decoded(self):
+        built = []
+        decoder = message.FRAME_DECODERS[MESSAGE_CHANNEL_BROADCAST_DATA]
+        def counting(raw, start, length):
+            built.append(start)
+            return decoder(raw, start, length)
+
+        done = threading.Event()
+        self.evm.registerRawCallback(lambda *args: done.set())
+        message.FRAME_DECODERS[MESSAGE_CHANNEL_BROADCAST_DATA] = counting
+        try:
+            self.driver.reads.put(bytes(broadcast(1, 0x11)))
+            self.assertTrue(done.wait(1))
+            with self.evm.evmCallbackLock:  # let the pump finish the frame
+                pass
+        finally:
+            message.FRAME_DECODERS[MESSAGE_CHANNEL_BROADCAST_DATA] = decoder
+
+        self.assertEqual([], built)
+        self.assertNotIn(MESSAGE_CHANNEL_BROADCAST_DATA, self.evm.wantedTypes)
+
+    def test_ack_futures_matched_by_channel(self):
+        first = self.evm.writeMessage(ChannelPeriodMessage(1, 8070), future=True)
+        second = self.evm.writeMessage(ChannelPeriodMessage(2, 8070), future=True)
+
+        self.driver.reads.put(bytes(
+            ChannelEventResponseMessage(2, MESSAGE_CHANNEL_PERIOD, CHANNEL_IN_WRONG_STATE).encode() +
+            ChannelEventResponseMessage(1, MESSAGE_CHANNEL_PERIOD, RESPONSE_NO_ERROR).encode()))
+
+        self.assertEqual(RESPONSE_NO_ERROR, self.evm.waitForAck(first, timeout=1))
+        self.assertEqual(CHANNEL_IN_WRONG_STATE, self.evm.waitForAck(second, timeout=1))
+        self.assertFalse(self.evm.ack.messages)
+        self.assertEqual(2, len(self.driver.written))
+
+    def test_write_many_futures(self):
+        msgs = [ChannelPeriodMessage(1, 8070), ChannelPeriodMessage(2, 8070)]
+        first, second = self.evm.writeMany(msgs, future=True)
+
+        self.driver.reads.put(bytes(
+            ChannelEventResponseMessage(2, MESSAGE_CHANNEL_PERIOD, RESPONSE_NO_ERROR).encode() +
+            ChannelEventResponseMessage(1, MESSAGE_CHANNEL_PERIOD, RESPONSE_NO_ERROR).encode()))
+        self.assertEqual(RESPONSE_NO_ERROR, self.evm.waitForAck(first, timeout=1))
+        self.assertEqual(RESPONSE_NO_ERROR, self.evm.waitForAck(second, timeout=1))
+        self.assertEqual([bytes(msgs[0].encode()) + bytes(msgs[1].encode())],
+                         [bytes(data) for data in self.driver.written])
+
+    def test_ack_future_timeout(self):
+        future = self.evm.writeMessage(ChannelPeriodMessage(1, 8070), future=True)
+        with self.assertRaises(MessageTimeoutError):
+            self.evm.waitForAck(future, timeout=0.01)
+        self.assertTrue(future.cancelled())
+        self.assertFalse(self.evm.ack.pending)
+
+        self.evm.ack.expect(ChannelPeriodMessage(2, 8070)).cancel()
+        self.assertFalse(self.evm.ack.pending)
+
+        # a late response goes to the next waiter, not the abandoned one
+        retry = self.evm.writeMessage(ChannelPeriodMessage(1, 8070), future=True)
+        self.driver.reads.put(bytes(
+            ChannelEventResponseMessage(1, MESSAGE_CHANNEL_PERIOD, RESPONSE_NO_ERROR).encode()))
+        self.assertEqual(RESPONSE_NO_ERROR, self.evm.waitForAck(retry, timeout=1))
+
+    def test_channel_routing(self):
+        first, second = Recorder(1), Recorder(1)
+        first.number, second.number = 1, 2
+        self.evm.registerChannel(first)
+        self.evm.registerChannel(second)
+        events = Recorder(1)
+        events.types = frozenset((MESSAGE_CHANNEL_EVENT,))
+        self.evm.registerCallback(events)
+
+        self.driver.reads.put(bytes(broadcast(1, 0x11) + broadcast(2, 0x22) + broadcast(3, 0x33)))
+        self.assertTrue(first.done.wait(1))
+        self.assertTrue(second.done.wait(1))
+
+        self.evm.removeChannel(first)
+        second.expected = 2
+        second.done.clear()
+        self.driver.reads.put(bytes(broadcast(1, 0x11) + broadcast(2, 0x22)))
+        self.assertTrue(second.done.wait(1))
+
+        self.assertEqual([b'\x11' * 8], [msg.data for msg in first.received])
+        self.assertEqual([2, 2], [msg.channelNumber for msg in second.received])
+        self.assertEqual([], events.received)
+
+    def test_wait_for_message_subscribes(self):
+        self.assertNotIn(MESSAGE_CHANNEL_BROADCAST_DATA, self.evm.wantedTypes)
+        threading.Timer(0.05, self.driver.reads.put, (bytes(broadcast(1, 0x11)),)).start()
+        msg = self.evm.waitForMessage(ChannelBroadcastDataMessage, timeout=1)
+        self.assertEqual(b'\x11' * 8, msg.data)
+        self.assertIn(MESSAGE_CHANNEL_BROADCAST_DATA, self.evm.wantedTypes)
+
+    def test_message_arriving_before_wait(self):
+        self.evm.subscribeMessages(ChannelBroadcastDataMessage)
+        self.assertIn(MESSAGE_CHANNEL_BROADCAST_DATA, self.evm.wantedTypes)
+        self.driver.reads.put(bytes(broadcast(1, 0x11)))
+        inbox = self.evm.msg.inboxes[ChannelBroadcastDataMessage]
+        deadline = time.time() + 1
+        while not inbox and time.time() < deadline:
+            time.sleep(0.001)
+
+        msg = self.evm.waitForMessage(ChannelBroadcastDataMessage, timeout=0)
+        self.assertEqual(b'\x11' * 8, msg.data)
+
+    def test_filtered_subscriptions(self):
+        channel = Recorder(2)
+        channel.number, channel.id = 1, ChannelID(23358, 0x78, 1)
+        self.evm.registerChannel(channel)
+        byPage, byChannel, byDeviceType = Recorder(1), Recorder(1), Recorder(1)
+        self.evm.registerCallback(byPage, pages=[0x22])
+        self.evm.registerCallback(byChannel, channels=[2])
+        self.evm.registerCallback(byDeviceType, types=[MESSAGE_CHANNEL_BROADCAST_DATA],
+                                  deviceTypes=[0x78])
+
+        self.driver.reads.put(bytes(broadcast(1, 0x11) + broadcast(2, 0x22) + broadcast(1, 0x33)))
+        self.assertTrue(channel.done.wait(1))
+        with self.evm.evmCallbackLock:
+            pass
+
+        self.assertEqual([b'\x22' * 8], [msg.data for msg in byPage.received])
+        self.assertEqual([b'\x22' * 8], [msg.data for msg in byChannel.received])
+        self.assertEqual([b'\x11' * 8, b'\x33' * 8], [msg.data for msg in byDeviceType.received])
+        self.assertIn((MESSAGE_CHANNEL_BROADCAST_DATA, 1, 0x11, 0x78), self.evm.routes)
+
+    def test_stats(self):
+        messages = Recorder(16)
+        self.evm.registerCallback(messages)
+        self.driver.reads.put(b'\x00' + bytes(broadcast(1, 0x11) * 16))
+        self.assertTrue(messages.done.wait(1))
+        with self.evm.evmCallbackLock:
+            pass
+
+        stats = self.evm.stats()
+        self.assertEqual(1 + 16 * len(broadcast(1, 0x11)), stats['bytesRead'])
+        self.assertEqual({MESSAGE_CHANNEL_BROADCAST_DATA: 16}, stats['frames'])
+        self.assertEqual(0, stats['checksumErrors'])
+        self.assertEqual(1, stats['skippedBytes'])
+        self.assertEqual(0, stats['dropped'])
+        self.assertEqual(0, stats['inboxes']['StartupMessage'])
+        self.assertEqual(1, sum(stats['dispatchTimes'][messages]))
+
+    def test_queue_write(self):
+        template = FrameTemplate(ChannelBroadcastDataMessage, 1, b'\x11' * 8)
+        handle = self.evm.queueWrite(template)
+        template.data = b'\x22' * 8  # the queued frame is a copy
+
+        self.assertEqual(len(template), handle.result(1))
+        self.assertEqual([bytes(broadcast(1, 0x11))], [bytes(data) for data in self.driver.written])
+
+    def test_write_from_callback_does_not_block_reception(self):
+        release = threading.Event()
+        write = self.driver._write
+        self.driver._write = lambda data: release.wait(1) and write(data)
+
+        class Requester(EventCallback):
+            def __init__(self, evm):
+                self.evm = evm
+                self.received = Recorder(2)
+
+            def process(self, msg):
+                if msg.channelNumber == 1:
+                    self.evm.writeMessage(ChannelPeriodMessage(1, 8070))
+                self.received.process(msg)
+
+        requester = Requester(self.evm)
+        self.evm.registerCallback(requester, types=[MESSAGE_CHANNEL_BROADCAST_DATA])
+        self.driver.reads.put(bytes(broadcast(1, 0x11)))
+        self.driver.reads.put(bytes(broadcast(2, 0x22)))
+
+        # the second broadcast arrives while the write is still stuck
+        self.assertTrue(requester.received.done.wait(1))
+        self.assertEqual([], self.driver.written)
+        release.set()
+
+    def test_write_error_fails_ack_future(self):
+        def fail(data):
+            raise DriverError('unplugged')
+        self.driver._write = fail
+
+        future = self.evm.writeMessage(ChannelPeriodMessage(1, 8070), future=True)
+        with self.assertRaises(DriverError):
+            self.evm.waitForAck(future, timeout=1)
+        self.assertFalse(self.evm.ack.pending)
+        with self.assertRaises(DriverError):
+            self.evm.writeMessage(ChannelPeriodMessage(1, 8070))
+        self.assertEqual(2, self.evm.stats()['writes']['failed'])
+
+    def test_short_write_fails_handle(self):
+        self.driver._write = lambda data: len(data) - 1
+        handle = self.evm.queueWrite(ChannelPeriodMessage(1, 8070))
+        with self.assertRaises(DriverError):
+            handle.result(1)
+
+    def test_write_rate(self):
+        self.evm.writeRate = 200
+        basetime = time.time()
+        msg = ChannelBroadcastDataMessage(1, data=b'\x11' * 8)
+        handles = [self.evm.queueWrite(msg) for _ in range(5)]
+        for handle in handles:
+            handle.result(1)
+        self.assertGreaterEqual(time.time() - basetime, 4 / 200.0)
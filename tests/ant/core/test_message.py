@@ -0,0 +1,330 @@
+# -*- coding: utf-8 -*-
+
+##############################################################################
+#
+# Copyright (c) 2017, Matt Hughes
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+#
+##############################################################################
+
+
+import unittest
+from struct import Struct, error as StructError
+
+from ant.core.constants import (MESSAGE_CHANNEL_ASSIGN, MESSAGE_CHANNEL_BROADCAST_DATA,
+                                EXT_FLAG_CHANNEL_ID, EXT_FLAG_RSSI, EXT_FLAG_RX_TIMESTAMP,
+                                EVENT_RX_FAIL)
+from ant.core.exceptions import MessageError
+from ant.core.message import *
+
+
+class MessageDecodeTest(unittest.TestCase):
+    def test_decode_builds_registered_class(self):
+        raw = ChannelBroadcastDataMessage(number=2, data=bytearray(range(8))).encode()
+
+        msg = Message.decode(bytes(raw))
+
+        self.assertIsInstance(msg, ChannelBroadcastDataMessage)
+        self.assertEqual(2, msg.channelNumber)
+        self.assertEqual(bytearray(range(8)), msg.data)
+        self.assertIsInstance(msg.payload, bytearray)
+        self.assertEqual(raw, msg.encode())
+
+    def test_decode_unknown_type(self):
+        msg = Message.decode(b'\xA4\x01\x99\x05\x39')
+
+        self.assertEqual(0x99, msg.type)
+        self.assertEqual(bytearray(b'\x05'), msg.payload)
+
+    def test_decode_accepts_memoryview(self):
+        raw = memoryview(b'\x00\xA4\x03\x42\x00\x00\x00\xE5')[1:]
+
+        msg = Message.decode(raw)
+
+        self.assertIsInstance(msg, ChannelAssignMessage)
+        self.assertEqual(MESSAGE_CHANNEL_ASSIGN, msg.type)
+
+    def test_decode_errors(self):
+        with self.assertRaises(MessageError) as ctx:
+            Message.decode(b'\xA4\x03\x42')
+        self.assertEqual(Message.INCOMPLETE, ctx.exception.internal)
+
+        with self.assertRaises(MessageError) as ctx:
+            Message.decode(b'\xA4\x03\x42\x00\x00\x00')
+        self.assertEqual(Message.INCOMPLETE, ctx.exception.internal)
+
+        with self.assertRaises(MessageError) as ctx:
+            Message.decode(b'\xA5\x03\x42\x00\x00\x00\xE5')
+        self.assertEqual(Message.CORRUPTED, ctx.exception.internal)
+
+        with self.assertRaises(MessageError) as ctx:
+            Message.decode(b'\xA4\x03\x42\x01\x02\xF3\xE5')
+        self.assertEqual(Message.CORRUPTED, ctx.exception.internal)
+
+    def test_from_frame_uses_offsets(self):
+        raw = bytearray(b'\xFF\xFF') + ChannelEventResponseMessage(3, 0x4B, 0x00).encode()
+
+        msg = FRAME_DECODERS[raw[4]](raw, 2, raw[3])
+
+        self.assertIsInstance(msg, ChannelEventResponseMessage)
+        self.assertEqual(3, msg.channelNumber)
+        self.assertEqual(0x4B, msg.messageID)
+
+
+class MessageDecodeManyTest(unittest.TestCase):
+    def setUp(self):
+        self.first = ChannelBroadcastDataMessage(1, data=bytearray(8)).encode()
+        self.second = ChannelEventResponseMessage(2, 0x4B, 0x00).encode()
+
+    def test_decodes_all_frames_and_leaves_tail(self):
+        buf = bytes(self.first + self.second + self.first[:6])
+
+        messages, consumed, errors = Message.decode_many(buf)
+
+        self.assertEqual([1, 2], [msg.channelNumber for msg in messages])
+        self.assertEqual(len(self.first) + len(self.second), consumed)
+        self.assertEqual([], errors)
+
+    def test_reports_skipped_bytes(self):
+        corrupted = bytearray(self.first)
+        corrupted[-1] ^= 0xFF
+        buf = bytearray(b'\x01\x02') + corrupted + self.second
+
+        messages, consumed, errors = Message.decode_many(buf)
+
+        self.assertEqual(1, len(messages))
+        self.assertIsInstance(messages[0], ChannelEventResponseMessage)
+        self.assertEqual(len(buf), consumed)
+        self.assertEqual(2, len(errors))
+        for error in errors:
+            self.assertIsInstance(error, MessageError)
+            self.assertEqual(Message.CORRUPTED, error.internal)
+
+    def test_starts_at_offset(self):
+        buf = memoryview(self.first + self.second)
+
+        messages, consumed, errors = Message.decode_many(buf, start=len(self.first))
+
+        self.assertEqual(1, len(messages))
+        self.assertEqual(2, messages[0].channelNumber)
+        self.assertEqual(len(buf), consumed)
+
+    def test_incomplete_buffer(self):
+        self.assertEqual(([], 0, []), Message.decode_many(b'\xA4'))
+        self.assertEqual(([], 0, []), Message.decode_many(b''))
+
+
+class MessageEncodeTest(unittest.TestCase):
+    def test_encode_into(self):
+        msg = ChannelIDMessage(1, 23358, 120, 1)
+        buf = bytearray(12)
+
+        size = msg.encode_into(buf, 2)
+
+        self.assertEqual(len(msg), size)
+        self.assertEqual(msg.encode(), buf[2:2 + size])
+        self.assertEqual(b'\xA4\x05\x51\x01\x3E\x5B\x78\x01\xED', bytes(buf[2:2 + size]))
+
+
+class FrameTemplateTest(unittest.TestCase):
+    def setUp(self):
+        self.template = FrameTemplate(ChannelBroadcastDataMessage, number=3)
+
+    def decoded(self):
+        return Message.decode(self.template.encode())
+
+    def test_initial_frame(self):
+        self.assertEqual(ChannelBroadcastDataMessage(3, data=b'\x00' * 8).encode(),
+                         self.template.encode())
+
+    def test_patching_bytes_keeps_checksum_valid(self):
+        self.template[0] = 0x10
+        self.template[7] = 0xFF
+        self.template.channelNumber = 4
+
+        msg = self.decoded()
+
+        self.assertEqual(4, msg.channelNumber)
+        self.assertEqual(bytearray(b'\x10' + b'\x00' * 6 + b'\xFF'), msg.data)
+        self.assertEqual(0x10, self.template[0])
+
+    def test_pack_and_data(self):
+        self.template.pack(Struct('<BBBBHH'), 0x10, 1, 0xFF, 90, 1000, 250)
+        self.assertEqual(bytearray(b'\x10\x01\xFF\x5A\xE8\x03\xFA\x00'), self.decoded().data)
+
+        self.template.data = bytearray(range(8))
+        self.assertEqual(bytearray(range(8)), self.decoded().data)
+
+    def test_failed_pack_keeps_checksum_valid(self):
+        struct_ = Struct('<BBBBHH')
+        with self.assertRaises(StructError):
+            self.template.pack(struct_, 0x10, 1, 0xFF, 90, -5, 250)
+        self.template.pack(struct_, 0x10, 2, 0xFF, 90, 1000, 250)
+        self.assertEqual(bytearray(b'\x10\x02\xFF\x5A\xE8\x03\xFA\x00'), self.decoded().data)
+
+    def test_index_limited_to_data_bytes(self):
+        for index in (-1, 8):
+            with self.assertRaises(IndexError):
+                self.template[index] = 0x10
+            with self.assertRaises(IndexError):
+                self.template[index]  # pylint: disable=pointless-statement
+        self.assertEqual(ChannelBroadcastDataMessage(3, data=b'\x00' * 8).encode(),
+                         self.template.encode())
+
+    def test_encode_into_and_type(self):
+        buf = bytearray(20)
+        size = self.template.encode_into(buf, 1)
+
+        self.assertEqual(13, size)
+        self.assertEqual(self.template.encode(), buf[1:14])
+        self.assertEqual(MESSAGE_CHANNEL_BROADCAST_DATA, self.template.type)
+
+
+def extended_frame(flags, trailer):
+    payload = bytearray([1]) + bytearray(range(8)) + bytearray([flags]) + trailer
+    return ChannelBroadcastDataMessage(number=1, data=payload[1:]).encode()
+
+
+class ExtendedDataTest(unittest.TestCase):
+    def test_all_fields(self):
+        trailer = bytearray(b'\x3E\x5B\x78\x01' + b'\x20\xC4\xB0' + b'\x10\x80')
+        raw = extended_frame(EXT_FLAG_CHANNEL_ID | EXT_FLAG_RSSI | EXT_FLAG_RX_TIMESTAMP, trailer)
+
+        msg = Message.decode(raw)
+        extended = msg.extended
+
+        self.assertEqual(bytearray(range(8)), msg.data)
+        self.assertEqual(23358, extended.deviceNumber)
+        self.assertEqual(0x78, extended.deviceType)
+        self.assertEqual(1, extended.transType)
+        self.assertEqual(-60, extended.rssi)
+        self.assertEqual(-80, extended.threshold)
+        self.assertEqual(0x8010, extended.rxTimestamp)
+
+    def test_partial_fields(self):
+        raw = extended_frame(EXT_FLAG_RX_TIMESTAMP, bytearray(b'\x01\x00'))
+
+        extended = Message.decode(raw).extended
+
+        self.assertIsNone(extended.deviceNumber)
+        self.assertIsNone(extended.rssi)
+        self.assertEqual(1, extended.rxTimestamp)
+
+    def test_no_extended_data(self):
+        msg = ChannelBroadcastDataMessage(number=1, data=bytearray(8))
+        self.assertIsNone(msg.extended)
+        self.assertIsNone(MessageView(msg.encode(), 0).extended)
+
+    def test_view(self):
+        raw = extended_frame(EXT_FLAG_CHANNEL_ID, bytearray(b'\x3E\x5B\x78\x01'))
+
+        view = MessageView(raw, 0)
+
+        self.assertEqual(23358, view.deviceNumber)
+        self.assertEqual(0x78, view.extended.deviceType)
+
+    def test_payload_limits(self):
+        with self.assertRaises(MessageError):
+            ChannelIDMessage().payload = bytearray(10)
+        with self.assertRaises(MessageError):
+            ChannelBroadcastDataMessage().payload = bytearray(20)
+        ChannelBroadcastDataMessage().payload = bytearray(19)
+
+    def test_lib_config(self):
+        msg = LibConfigMessage(EXT_FLAG_CHANNEL_ID | EXT_FLAG_RSSI)
+        self.assertEqual(b'\xA4\x02\x6E\x00\xC0\x08', bytes(msg.encode()))
+
+
+class FieldTest(unittest.TestCase):
+    def test_fields_read_and_write_payload(self):
+        msg = ChannelIDMessage(1, 23358, 120, 1)
+
+        self.assertEqual(bytearray(b'\x01\x3E\x5B\x78\x01'), msg.payload)
+        self.assertEqual(23358, msg.deviceNumber)
+        msg.deviceNumber = 0x1234
+        msg.transmissionType = 5
+        self.assertEqual(bytearray(b'\x01\x34\x12\x78\x05'), msg.payload)
+
+    def test_out_of_range_values(self):
+        msg = ChannelPeriodMessage()
+        with self.assertRaises(MessageError):
+            msg.channelPeriod = 0x10000
+        with self.assertRaises(MessageError):
+            msg.channelNumber = 256
+        with self.assertRaises(MessageError):
+            msg.channelNumber = -1
+        self.assertEqual(bytearray(b'\x00\x00\x20'), msg.payload)
+
+    def test_class_access_returns_field(self):
+        self.assertIsInstance(ChannelIDMessage.deviceNumber, Field)
+        self.assertIsInstance(ChannelMessage.channelNumber, ByteField)
+
+
+class MessageSlotsTest(unittest.TestCase):
+    def test_messages_have_no_instance_dict(self):
+        for class_ in Message.TYPES.values():
+            self.assertFalse(hasattr(class_(), '__dict__'), class_.__name__)
+
+    def test_untyped_message_keeps_its_type(self):
+        msg = Message(type=0x23)  # pylint: disable=unexpected-keyword-arg
+        self.assertEqual(0x23, msg.type)
+        msg.type = 0x24
+        self.assertEqual(0x24, msg.type)
+        self.assertIsNone(Message.type)
+        self.assertIsNone(ChannelMessage.type)
+
+
+class MessageViewTest(unittest.TestCase):
+    def test_reads_fields_from_buffer(self):
+        raw = bytearray(b'\x00') + ChannelBroadcastDataMessage(5, data=bytearray(range(8))).encode()
+
+        view = MessageView(raw, 1)
+
+        self.assertEqual(MESSAGE_CHANNEL_BROADCAST_DATA, view.type)
+        self.assertEqual(5, view.channelNumber)
+        self.assertEqual(bytearray(range(8)), view.data)
+        self.assertEqual(13, len(view))
+        self.assertEqual(bytearray([5]) + bytearray(range(8)), view.payload.tobytes())
+
+    def test_device_number(self):
+        raw = ChannelIDMessage(1, 23358, 120, 1).encode()
+
+        view = MessageView(raw, 0)
+
+        self.assertEqual(23358, view.deviceNumber)
+        self.assertEqual(120, view.deviceType)
+
+    def test_device_number_without_channel_id(self):
+        raw = ChannelBroadcastDataMessage(0, data=bytearray(8)).encode()
+        self.assertIsNone(MessageView(raw, 0).deviceNumber)
+
+        raw = ChannelEventResponseMessage(0, 1, EVENT_RX_FAIL).encode()
+        self.assertIsNone(MessageView(raw, 0).deviceNumber)
+
+    def test_materialize(self):
+        raw = ChannelEventResponseMessage(2, 0x4B, 0x00).encode()
+        view = MessageView(raw, 0)
+
+        msg = view.materialize()
+        raw[:] = bytearray(len(raw))
+
+        self.assertIsInstance(msg, ChannelEventResponseMessage)
+        self.assertEqual(0x4B, msg.messageID)
+        self.assertIs(msg, view.materialize())
@@ -24,3 +24,179 @@
 #
 ##############################################################################
 
+import unittest
+from concurrent.futures import Future
+
+from ant.core.constants import *
+from ant.core.event import OVERFLOW_BLOCK
+from ant.core.exceptions import ChannelError, NodeError
+from ant.core.message import ChannelAcknowledgedDataMessage, ChannelBroadcastDataMessage, \
+        ChannelOpenMessage, LibConfigMessage
+from ant.core.node import Channel, ChannelID, Network, Node
+
+
+class StubEventMachine(object):
+    def __init__(self, response=RESPONSE_NO_ERROR):
+        self.response = response
+        self.responses = {}
+        self.written = []
+        self.batches = []
+        self.registered = []
+
+    def writeMessage(self, msg, future=False):
+        self.written.append(msg)
+        if future:
+            future = Future()
+            future.set_result(self.responses.get(msg.type, self.response))
+            return future
+        return self
+
+    def writeMany(self, msgs, future=False):
+        msgs = list(msgs)
+        self.batches.append(msgs)
+        futures = [self.writeMessage(msg, future) for msg in msgs]
+        return futures if future else self
+
+    def waitForAck(self, msg, timeout=10):
+        if isinstance(msg, Future):
+            return msg.result()
+        return self.response
+
+    def registerChannel(self, channel):
+        self.registered.append(channel)
+
+
+class NodeTest(unittest.TestCase):
+    def setUp(self):
+        self.node = Node(None)
+        self.node.evm = self.evm = StubEventMachine()
+
+    def test_enable_extended_messages(self):
+        self.node.enableExtendedMessages(rssi=True)
+
+        msg = self.evm.written[-1]
+        self.assertIsInstance(msg, LibConfigMessage)
+        self.assertEqual(EXT_FLAG_CHANNEL_ID | EXT_FLAG_RSSI, msg.flags)
+
+    def test_enable_extended_messages_failure(self):
+        self.evm.response = INVALID_MESSAGE
+        with self.assertRaises(NodeError):
+            self.node.enableExtendedMessages()
+
+    def test_event_machine_options(self):
+        node = Node(None, dispatchers=2, queueSize=16, overflow=OVERFLOW_BLOCK, writeRate=100)
+        self.assertEqual(100, node.evm.writeRate)
+        self.assertEqual(2, node.evm.dispatchers)
+        self.assertEqual(16, node.evm.queueSize)
+        self.assertEqual(OVERFLOW_BLOCK, node.evm.overflow)
+
+    def test_stats(self):
+        node = Node(None)
+        node.channels = [Channel(node, 0), Channel(node, 1)]
+        node.channels[1].duplicatesSuppressed = 3
+
+        stats = node.stats()
+        self.assertEqual(3, stats['duplicatesSuppressed'])
+        self.assertEqual(0, stats['bytesRead'])
+        self.assertEqual({}, stats['frames'])
+
+
+class Recorder(object):
+    def __init__(self, suppressDuplicates=False):
+        self.suppressDuplicates = suppressDuplicates
+        self.received = []
+
+    def process(self, msg, channel):
+        self.received.append(msg)
+
+
+class ChannelDuplicateTest(unittest.TestCase):
+    def setUp(self):
+        self.channel = Channel(None, 1)
+        self.deduped = Recorder(suppressDuplicates=True)
+        self.everything = Recorder()
+        self.channel.registerCallback(self.deduped)
+        self.channel.registerCallback(self.everything)
+
+    def test_identical_broadcasts_suppressed(self):
+        for data in (b'\x01' * 8, b'\x01' * 8, b'\x02' * 8, b'\x01' * 8):
+            self.channel.process(ChannelBroadcastDataMessage(1, data))
+
+        self.assertEqual([b'\x01' * 8, b'\x02' * 8, b'\x01' * 8],
+                         [msg.data for msg in self.deduped.received])
+        self.assertEqual(4, len(self.everything.received))
+        self.assertEqual(1, self.channel.duplicatesSuppressed)
+
+    def test_acknowledged_data_never_suppressed(self):
+        for _ in range(2):
+            self.channel.process(ChannelAcknowledgedDataMessage(1, b'\x01' * 8))
+
+        self.assertEqual(2, len(self.deduped.received))
+        self.assertEqual(0, self.channel.duplicatesSuppressed)
+
+    def test_other_channel_ignored(self):
+        self.channel.process(ChannelBroadcastDataMessage(1, b'\x01' * 8))
+        self.channel.process(ChannelBroadcastDataMessage(2, b'\x01' * 8))
+        self.channel.process(ChannelBroadcastDataMessage(1, b'\x01' * 8))
+
+        self.assertEqual(1, len(self.deduped.received))
+        self.assertEqual(1, self.channel.duplicatesSuppressed)
+
+    def test_counted_once_per_frame(self):
+        self.channel.registerCallback(Recorder(suppressDuplicates=True))
+        for _ in range(3):
+            self.channel.process(ChannelBroadcastDataMessage(1, b'\x01' * 8))
+
+        self.assertEqual(2, self.channel.duplicatesSuppressed)
+
+    def test_reopened_channel_forgets_last_page(self):
+        node = Node(None)
+        node.evm = StubEventMachine()
+        self.channel.node = node
+
+        self.channel.process(ChannelBroadcastDataMessage(1, b'\x01' * 8))
+        self.channel.open()
+        self.channel.process(ChannelBroadcastDataMessage(1, b'\x01' * 8))
+
+        self.assertEqual(2, len(self.deduped.received))
+        self.assertEqual(0, self.channel.duplicatesSuppressed)
+
+
+class ChannelConfigureTest(unittest.TestCase):
+    def setUp(self):
+        self.node = Node(None)
+        self.node.evm = self.evm = StubEventMachine()
+        self.channel = Channel(self.node, 2)
+        self.network = Network(name='N:ANT+')
+
+    def configure(self, **kwargs):
+        self.channel.configure(self.network, CHANNEL_TYPE_TWOWAY_RECEIVE,
+                               ChannelID(23358, 0x78, 1), 0x39, 8070, 12, **kwargs)
+
+    def test_configure_sends_all_steps(self):
+        self.configure()
+
+        self.assertEqual([MESSAGE_CHANNEL_ASSIGN, MESSAGE_CHANNEL_ID, MESSAGE_CHANNEL_FREQUENCY,
+                          MESSAGE_CHANNEL_PERIOD, MESSAGE_CHANNEL_SEARCH_TIMEOUT,
+                          MESSAGE_CHANNEL_OPEN],
+                         [msg.type for msg in self.evm.written])
+        self.assertEqual([self.evm.written], self.evm.batches)
+        self.assertTrue(all(msg.channelNumber == 2 for msg in self.evm.written))
+        self.assertEqual(23358, self.channel.id.deviceNumber)
+        self.assertEqual(8070, self.channel.period)
+        self.assertIs(self.network, self.channel.network)
+        self.assertEqual([self.channel], self.evm.registered)
+
+    def test_configure_without_open(self):
+        self.configure(open=False)
+
+        self.assertNotIsInstance(self.evm.written[-1], ChannelOpenMessage)
+        self.assertEqual([], self.evm.registered)
+
+    def test_configure_reports_failed_step(self):
+        self.evm.responses[MESSAGE_CHANNEL_PERIOD] = INVALID_MESSAGE
+
+        with self.assertRaisesRegex(ChannelError, 'could not set period'):
+            self.configure()
+        self.assertEqual(6, len(self.evm.written))
+        self.assertIsNone(self.channel.network)
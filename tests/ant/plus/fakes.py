@@ -24,6 +24,8 @@
 #
 ##############################################################################
 
+from concurrent.futures import Future
+
 from ant.core.node import Node, Channel
 from ant.core.constants import RESPONSE_NO_ERROR
 
@@ -32,11 +34,29 @@ class FakeEventMachine():
         self.messages = []
         self.waited_message = None
 
-    def writeMessage(self, msg):
+    def writeMessage(self, msg, future=False):
         self.messages.append(msg)
+        if future:
+            future = Future()
+            future.set_result(RESPONSE_NO_ERROR)
+            return future
         return self
 
-    def waitForAck(self, msg):
+    def queueWrite(self, msgs, priority=None):
+        if not isinstance(msgs, (list, tuple)):
+            msgs = [msgs]
+        self.messages.extend(msgs)
+        handle = Future()
+        handle.set_result(0)
+        return handle
+
+    def writeMany(self, msgs, future=False):
+        futures = [self.writeMessage(msg, future) for msg in msgs]
+        return futures if future else self
+
+    def waitForAck(self, msg, timeout=10):
+        if isinstance(msg, Future):
+            return msg.result()
         return RESPONSE_NO_ERROR
 
     def waitForMessage(self, class_):
@@ -48,6 +68,12 @@ class FakeEventMachine():
     def removeCallback(self, callback):
         pass
 
+    def registerChannel(self, channel):
+        pass
+
+    def removeChannel(self, channel):
+        pass
+
 class FakeChannel(Channel):
     def __init__(self, node, number=0):
         super(FakeChannel, self).__init__(node, number)
@@ -58,6 +84,15 @@ class FakeChannel(Channel):
         self.assigned_channel_number = self.number
         super(FakeChannel, self).assign(network, channelType)
 
+    def configure(self, network, channelType, id, frequency, period, searchTimeout, open=True):
+        self.assigned_network = network
+        self.assigned_channel_type = channelType
+        self.assigned_channel_number = self.number
+        if open:
+            self.open_called = True
+        super(FakeChannel, self).configure(network, channelType, id, frequency, period,
+                                           searchTimeout, open)
+
     def open(self):
         self.open_called = True
         super(FakeChannel, self).open()
@@ -25,7 +25,9 @@
 ##############################################################################
 
 import struct
+import threading
 import unittest
+from concurrent.futures import ThreadPoolExecutor
 
 from ant.core.message import *
 from ant.core.node import Network
@@ -340,3 +342,52 @@ class HeartRateTest(unittest.TestCase):
         self.assertEqual(True, closeCalled)
         self.assertEqual(ChannelState.CLOSED, hr.state)
 
+
+    def test_data_callback_called_without_lock(self):
+        locked = None
+        def callback(computedHeartRate, accumulatedEventTime, rrInterval):
+            nonlocal locked
+            locked = hr.lock.locked()
+
+        hr = HeartRate(self.node, self.network, callbacks = {'onHeartRateData': callback})
+        hr.open()
+
+        send_fake_heartrate_msg(hr)
+        self.assertEqual(False, locked)
+
+    def test_callbacks_on_executor_keep_order(self):
+        counts = []
+        threads = set()
+        def callback(computedHeartRate, accumulatedEventTime, rrInterval):
+            counts.append(computedHeartRate)
+            threads.add(threading.current_thread())
+
+        executor = ThreadPoolExecutor(4)
+        hr = HeartRate(self.node, self.network, callbacks = {'onHeartRateData': callback},
+                       executor = executor)
+        hr.open()
+
+        for count in range(100):
+            hr.processData(create_msg(beat_count = count, computed_hr = count)[1:])
+        executor.shutdown(wait = True)
+
+        self.assertEqual(list(range(100)), counts)
+        self.assertNotIn(threading.current_thread(), threads)
+
+    def test_callbacks_recover_from_rejected_submit(self):
+        counts = []
+        def callback(computedHeartRate, accumulatedEventTime, rrInterval):
+            counts.append(computedHeartRate)
+
+        executor = ThreadPoolExecutor(1)
+        executor.shutdown(wait = True)
+        hr = HeartRate(self.node, self.network, callbacks = {'onHeartRateData': callback},
+                       executor = executor)
+        with self.assertRaises(RuntimeError):
+            hr.notify('onHeartRateData', 1, 0, 0)
+
+        hr.executor = executor = ThreadPoolExecutor(1)
+        hr.notify('onHeartRateData', 2, 0, 0)
+        executor.shutdown(wait = True)
+
+        self.assertEqual([2], counts)